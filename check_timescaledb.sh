@@ -0,0 +1,19 @@
+#!/bin/sh
+# Проверка режима TimescaleDB: расширение, гипертаблицы Zabbix, чанки и сжатие.
+# Запуск из каталога установки: sh check_timescaledb.sh (POSTGRES_USER/POSTGRES_DB берутся из .env).
+cd "$(dirname "$0")"
+POSTGRES_USER="$(grep '^POSTGRES_USER=' .env 2>/dev/null | cut -d= -f2-)"
+POSTGRES_DB="$(grep '^POSTGRES_DB=' .env 2>/dev/null | cut -d= -f2-)"
+psql_query() {
+  docker exec zabbix-postgres psql -U "${POSTGRES_USER:-zabbix}" -d "${POSTGRES_DB:-zabbix}" -P pager=off -c "$1" 2>&1
+}
+echo "=== Расширение timescaledb ==="
+psql_query "SELECT extname, extversion FROM pg_extension WHERE extname = 'timescaledb';"
+echo "=== Гипертаблицы ==="
+psql_query "SELECT hypertable_name, num_chunks, compression_enabled FROM timescaledb_information.hypertables ORDER BY 1;"
+echo "=== Чанки: всего / сжато ==="
+psql_query "SELECT hypertable_name, count(*) AS chunks, count(*) FILTER (WHERE is_compressed) AS compressed FROM timescaledb_information.chunks GROUP BY 1 ORDER BY 1;"
+echo "=== Сжатие: объём до / после ==="
+psql_query "SELECT h.hypertable_name, pg_size_pretty(s.before_compression_total_bytes) AS before, pg_size_pretty(s.after_compression_total_bytes) AS after, round(100 - 100.0 * s.after_compression_total_bytes / nullif(s.before_compression_total_bytes, 0), 1) AS saved_pct FROM timescaledb_information.hypertables h, LATERAL hypertable_compression_stats(format('%I.%I', h.hypertable_schema, h.hypertable_name)::regclass) s ORDER BY 1;"
+echo "=== Задания сжатия ==="
+psql_query "SELECT j.hypertable_name, j.schedule_interval, s.last_run_status, s.last_successful_finish FROM timescaledb_information.jobs j JOIN timescaledb_information.job_stats s USING (job_id) WHERE j.proc_name = 'policy_compression' ORDER BY 1;"
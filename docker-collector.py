@@ -0,0 +1,696 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сборщик состояния Docker для дашборда «Главный экран» без опроса через CLI.
+Держит keep-alive соединение с /var/run/docker.sock, подписывается на поток /events и хранит в памяти снимок
+сервисов, exited-контейнеров и состояния Swarm. Изменения отправляются в элементы-трапперы Zabbix
+(docker.services.json, docker.containers.exited.list, docker.swarm.state) по протоколу Zabbix sender:
+пакетами по много значений, со сжатием zlib.
+Элементы-трапперы создаёт zabbix-init-config.py при ZABBIX_DOCKER_COLLECTOR=1.
+Запуск:
+  python3 docker-collector.py --zabbix-server 127.0.0.1:10051 --host Visiology-Server
+  python3 docker-collector.py --once --dry-run     # один снимок, вывод значений без отправки
+  python3 docker-collector.py selfcheck            # проверка на поддельных Docker и траппере в том же процессе
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import http.client
+import http.server
+import json
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+
+
+def env(key, default=None):
+    return os.environ.get(key, default)
+
+
+DOCKER_SOCKET = env("DOCKER_SOCKET", "/var/run/docker.sock")
+ZABBIX_SERVER = env("ZABBIX_SERVER", "127.0.0.1:10051")
+ZBX_HOSTNAME = env("ZBX_HOSTNAME", "Visiology-Server")
+# Полная пересинхронизация (и повторная отправка всех значений) раз в RESYNC_INTERVAL секунд — на случай
+# пропущенных событий и чтобы «Exited (0) 2 hours ago» не устаревало.
+RESYNC_INTERVAL = float(env("DOCKER_COLLECTOR_RESYNC", "300"))
+# События за это окно (сек) объединяются в одно обновление снимка
+DEBOUNCE = float(env("DOCKER_COLLECTOR_DEBOUNCE", "0.5"))
+SENDER_BATCH = int(env("DOCKER_COLLECTOR_BATCH", "250"))
+SENDER_TIMEOUT = float(env("DOCKER_COLLECTOR_TIMEOUT", "10"))
+# Тот же предел, что и head -c 65535 в agent2.d/98_docker_commands.conf
+TEXT_LIMIT = 65535
+
+KEY_SERVICES = "docker.services.json"
+KEY_EXITED = "docker.containers.exited.list"
+KEY_SWARM = "docker.swarm.state"
+
+# Заголовок протокола Zabbix: "ZBXD", флаги, длина данных, зарезервировано (исходная длина при сжатии)
+ZBX_HEADER = b"ZBXD"
+ZBX_FLAG_PROTOCOL = 0x01
+ZBX_FLAG_COMPRESS = 0x02
+ZBX_HEADER_SIZE = 13
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP/1.1 поверх unix-сокета Docker Engine."""
+
+    def __init__(self, socket_path, timeout=None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerClient(object):
+    """Запросы к Docker Engine API по одному keep-alive соединению; поток событий — по отдельному."""
+
+    def __init__(self, socket_path=DOCKER_SOCKET, timeout=10):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._conn = None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @staticmethod
+    def _url(path, params):
+        if params:
+            path += "?" + urllib.parse.urlencode(
+                {k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in params.items()})
+        return path
+
+    def get(self, path, params=None):
+        url = self._url(path, params)
+        for attempt in (0, 1):
+            reused = self._conn is not None
+            if self._conn is None:
+                self._conn = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+            try:
+                self._conn.request("GET", url)
+                resp = self._conn.getresponse()
+                data = resp.read()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                # Docker закрыл простаивающее соединение — повторяем один раз по новому
+                if reused and attempt == 0:
+                    continue
+                raise
+            if resp.will_close:
+                self.close()
+            if resp.status >= 400:
+                try:
+                    message = json.loads(data.decode("utf-8")).get("message", "")
+                except ValueError:
+                    message = data.decode("utf-8", "replace")
+                raise RuntimeError("Docker %s: HTTP %s %s" % (path, resp.status, message))
+            return json.loads(data.decode("utf-8")) if data else None
+
+    def events(self, filters=None):
+        """Генератор событий /events (бесконечный ответ, по объекту JSON на строку)."""
+        conn = UnixHTTPConnection(self.socket_path, timeout=None)
+        try:
+            conn.request("GET", self._url("/events", {"filters": filters} if filters else None))
+            resp = conn.getresponse()
+            if resp.status >= 400:
+                raise RuntimeError("Docker /events: HTTP %s" % resp.status)
+            while True:
+                line = resp.readline()
+                if not line:
+                    return
+                line = line.strip()
+                if line:
+                    yield json.loads(line.decode("utf-8"))
+        finally:
+            conn.close()
+
+
+def _table(header, rows):
+    """Таблица с выравниванием колонок, как в выводе docker CLI (--format "table ...")."""
+    widths = [max(len(str(r[i])) for r in [header] + rows) for i in range(len(header))]
+    lines = []
+    for r in [header] + rows:
+        cells = [str(c).ljust(w) for c, w in zip(r, widths)]
+        lines.append("   ".join(cells).rstrip())
+    return "\n".join(lines)[:TEXT_LIMIT]
+
+
+def render_services(services):
+    """
+    Сервисы в том же компактном JSON, что и UserParameter docker.services.json (поля docker service ls).
+    Таблицу для виджета и элементы по сервисам из него строит сервер Zabbix (зависимые элементы, LLD).
+    """
+    rows = []
+    for svc in sorted(services, key=lambda s: s["Spec"]["Name"]):
+        spec = svc["Spec"]
+        status = svc.get("ServiceStatus") or {}
+        mode = "global" if "Global" in spec.get("Mode", {}) else "replicated"
+        desired = status.get("DesiredTasks", spec.get("Mode", {}).get("Replicated", {}).get("Replicas", 0))
+        rows.append({
+            "ID": svc["ID"][:12],
+            "Name": spec["Name"],
+            "Mode": mode,
+            "Replicas": "%s/%s" % (status.get("RunningTasks", 0), desired),
+            "Image": spec.get("TaskTemplate", {}).get("ContainerSpec", {}).get("Image", ""),
+        })
+    return json.dumps(rows, separators=(",", ":"))
+
+
+def render_exited(containers):
+    rows = [
+        [c["Id"][:12], ",".join(n.lstrip("/") for n in c.get("Names", [])), c.get("Status", "")]
+        for c in containers
+    ]
+    return _table(["CONTAINER ID", "NAMES", "STATUS"], rows)
+
+
+class Snapshot(object):
+    """Последние значения элементов; refresh() возвращает только изменившиеся."""
+
+    def __init__(self, docker):
+        self.docker = docker
+        self.values = {}
+
+    def _collect(self, kind):
+        if kind == "services":
+            try:
+                return KEY_SERVICES, render_services(self.docker.get("/services", {"status": "true"}))
+            except RuntimeError:
+                # Узел не менеджер Swarm (или Swarm выключен)
+                return KEY_SERVICES, "[]"
+        if kind == "containers":
+            return KEY_EXITED, render_exited(
+                self.docker.get("/containers/json", {"all": "1", "filters": {"status": ["exited"]}}))
+        info = self.docker.get("/info")
+        return KEY_SWARM, (info.get("Swarm") or {}).get("LocalNodeState", "")
+
+    def refresh(self, kinds=("services", "containers", "swarm")):
+        changed = {}
+        for kind in kinds:
+            key, value = self._collect(kind)
+            if self.values.get(key) != value:
+                self.values[key] = value
+                changed[key] = value
+        return changed
+
+
+def event_kinds(event):
+    """Какие части снимка затрагивает событие Docker."""
+    etype = event.get("Type")
+    action = event.get("Action", "")
+    if etype == "container":
+        if action.startswith("exec_") or action.startswith("health_status"):
+            return set()
+        kinds = {"containers"}
+        # Запуск/остановка задач Swarm меняет число работающих реплик сервиса
+        if "com.docker.swarm.service.id" in event.get("Actor", {}).get("Attributes", {}):
+            kinds.add("services")
+        return kinds
+    if etype == "service":
+        return {"services"}
+    if etype == "node":
+        return {"swarm", "services"}
+    return set()
+
+
+def encode_packet(payload, compress=True):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    if compress:
+        packed = zlib.compress(data)
+        return ZBX_HEADER + struct.pack("<BII", ZBX_FLAG_PROTOCOL | ZBX_FLAG_COMPRESS, len(packed), len(data)) + packed
+    return ZBX_HEADER + struct.pack("<BII", ZBX_FLAG_PROTOCOL, len(data), 0) + data
+
+
+def _recv_exact(sock, size):
+    buf = b""
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise RuntimeError("Zabbix закрыл соединение до конца ответа.")
+        buf += chunk
+    return buf
+
+
+def read_packet(sock):
+    header = _recv_exact(sock, ZBX_HEADER_SIZE)
+    if header[:4] != ZBX_HEADER:
+        raise RuntimeError("Неверный заголовок ответа Zabbix: %r" % header[:4])
+    flags, size, _ = struct.unpack("<BII", header[4:])
+    data = _recv_exact(sock, size)
+    if flags & ZBX_FLAG_COMPRESS:
+        data = zlib.decompress(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def parse_sender_info(info):
+    """«processed: 2; failed: 1; total: 3; seconds spent: 0.000055» -> {"processed": 2, "failed": 1, "total": 3}."""
+    fields = {}
+    for part in (info or "").split(";"):
+        name, _, value = part.partition(":")
+        if value.strip().isdigit():
+            fields[name.strip()] = int(value)
+    return fields
+
+
+class ZabbixSender(object):
+    """Отправка значений элементам-трапперам (протокол «sender data»), по batch_size значений в пакете."""
+
+    def __init__(self, server=ZABBIX_SERVER, timeout=SENDER_TIMEOUT, batch_size=SENDER_BATCH, compress=True):
+        host, _, port = server.rpartition(":") if ":" in server else (server, "", "10051")
+        self.address = (host, int(port))
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.compress = compress
+
+    def _send_batch(self, values):
+        now = time.time()
+        payload = {"request": "sender data", "data": values, "clock": int(now), "ns": int((now % 1) * 1e9)}
+        with socket.create_connection(self.address, timeout=self.timeout) as sock:
+            sock.sendall(encode_packet(payload, self.compress))
+            resp = read_packet(sock)
+        if resp.get("response") != "success":
+            raise RuntimeError("Zabbix отклонил пакет: %s" % resp)
+        return resp.get("info", "")
+
+    def send(self, values):
+        """values — список {"host", "key", "value"[, "clock", "ns"]}. Возвращает ответы сервера по пакетам."""
+        infos = []
+        for i in range(0, len(values), self.batch_size):
+            infos.append(self._send_batch(values[i:i + self.batch_size]))
+        return infos
+
+
+class Collector(object):
+    def __init__(self, docker, sender, host, resync=RESYNC_INTERVAL, debounce=DEBOUNCE, dry_run=False):
+        self.docker = docker
+        self.sender = sender
+        self.host = host
+        self.resync = resync
+        self.debounce = debounce
+        self.dry_run = dry_run
+        self.snapshot = Snapshot(docker)
+        self.pending = {}
+        self.events = queue.Queue()
+        self._stop = threading.Event()
+
+    def push(self, changed):
+        """
+        Отправляет изменения; при ошибке они остаются в очереди до следующей попытки. Пакет, в котором сервер
+        не принял хотя бы одно значение (failed в ответе), тоже остаётся в очереди целиком: какое именно значение
+        отклонено, сервер не сообщает.
+        """
+        self.pending.update(changed)
+        if not self.pending:
+            return
+        now = time.time()
+        values = [
+            {"host": self.host, "key": k, "value": v, "clock": int(now), "ns": int((now % 1) * 1e9)}
+            for k, v in sorted(self.pending.items())
+        ]
+        if self.dry_run:
+            for v in values:
+                print("%s %s:\n%s" % (v["host"], v["key"], v["value"]))
+            self.pending.clear()
+            return
+        try:
+            infos = self.sender.send(values)
+        except (OSError, RuntimeError) as e:
+            print("Отправка в Zabbix не удалась (повтор позже): %s" % e, file=sys.stderr)
+            return
+        size = self.sender.batch_size
+        for i, info in enumerate(infos):
+            batch = values[i * size:(i + 1) * size]
+            result = parse_sender_info(info)
+            if result.get("failed"):
+                # Элементы-трапперы ещё не созданы, неверное имя хоста или тип элемента — не «Zabbix trapper»
+                print("Zabbix не принял %d из %d значений (%s), повтор позже: %s" % (
+                    result["failed"], len(batch), ", ".join(v["key"] for v in batch), info), file=sys.stderr)
+                continue
+            print("Отправлено %d значений: %s" % (result.get("processed", len(batch)), info))
+            for v in batch:
+                self.pending.pop(v["key"], None)
+
+    def _watch_events(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                for event in self.docker.events({"type": ["container", "service", "node"]}):
+                    backoff = 1
+                    kinds = event_kinds(event)
+                    if kinds:
+                        self.events.put(kinds)
+            except (OSError, http.client.HTTPException, RuntimeError, ValueError) as e:
+                print("Поток событий Docker прерван: %s" % e, file=sys.stderr)
+            if self._stop.is_set():
+                return
+            # После переподключения события могли быть пропущены — полная пересинхронизация
+            self.events.put({"services", "containers", "swarm"})
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def run_once(self):
+        self.push(self.snapshot.refresh())
+
+    def run(self):
+        self.run_once()
+        threading.Thread(target=self._watch_events, name="docker-events", daemon=True).start()
+        next_resync = time.time() + self.resync
+        while not self._stop.is_set():
+            try:
+                kinds = self.events.get(timeout=max(0, next_resync - time.time()))
+            except queue.Empty:
+                kinds = set()
+            else:
+                deadline = time.time() + self.debounce
+                while True:
+                    try:
+                        kinds |= self.events.get(timeout=max(0, deadline - time.time()))
+                    except queue.Empty:
+                        break
+            if self._stop.is_set():
+                return
+            try:
+                # Срок проверяется на каждом проходе: на занятом Swarm события идут непрерывно,
+                # очередь не пустеет, и по одному таймауту ожидания пересинхронизация не наступила бы
+                if time.time() >= next_resync:
+                    next_resync = time.time() + self.resync
+                    # Плановая пересинхронизация: отправляем все значения, а не только изменения
+                    self.snapshot.refresh()
+                    self.push(dict(self.snapshot.values))
+                elif kinds:
+                    self.push(self.snapshot.refresh(sorted(kinds)))
+            except (OSError, http.client.HTTPException, RuntimeError, ValueError) as e:
+                print("Не удалось обновить снимок Docker: %s" % e, file=sys.stderr)
+
+    def stop(self):
+        self._stop.set()
+        # Будит основной цикл, ждущий событие до срока пересинхронизации
+        self.events.put(set())
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _FakeDocker(object):
+    """Docker Engine API на unix-сокете для самопроверки: снимок из полей объекта, /events — из очереди."""
+
+    def __init__(self, path):
+        self.path = path
+        self.services = [{
+            "ID": "svc0000000001", "Spec": {"Name": "visiology_api", "Mode": {"Replicated": {"Replicas": 2}},
+                                            "TaskTemplate": {"ContainerSpec": {"Image": "visiology/api:3"}}},
+            "ServiceStatus": {"RunningTasks": 2, "DesiredTasks": 2},
+        }]
+        self.containers = []
+        self.swarm = "active"
+        self.requests = collections.Counter()
+        self.streams = []
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = urllib.parse.urlsplit(self.path).path
+                fake.requests[path] += 1
+                if path == "/events":
+                    return fake._stream(self)
+                body = json.dumps({
+                    "/services": fake.services,
+                    "/containers/json": fake.containers,
+                    "/info": {"Swarm": {"LocalNodeState": fake.swarm}},
+                }[path]).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = _UnixHTTPServer(path, Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _stream(self, handler):
+        feed = queue.Queue()
+        self.streams.append(feed)
+        # Без Content-Length: как у Docker, ответ длится до закрытия соединения
+        handler.close_connection = True
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.end_headers()
+        while True:
+            event = feed.get()
+            if event is None:
+                return
+            handler.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+
+    def emit(self, event):
+        self.streams[-1].put(event)
+
+    def end_streams(self):
+        for feed in self.streams:
+            feed.put(None)
+        del self.streams[:]
+
+    def close(self):
+        self.end_streams()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _FakeTrapper(object):
+    """Траппер Zabbix на 127.0.0.1: принимает пакеты sender data и запоминает значения по пакетам."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.address = "127.0.0.1:%d" % self.sock.getsockname()[1]
+        self.packets = []
+        # Ключи, значения которых траппер не принимает (как элементы, которых нет или которые не трапперы)
+        self.refuse = set()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                data = read_packet(conn)["data"]
+                self.packets.append(data)
+                failed = sum(1 for v in data if v["key"] in self.refuse)
+                conn.sendall(encode_packet({"response": "success", "info": "processed: %d; failed: %d; total: %d"
+                                            % (len(data) - failed, failed, len(data))}, compress=False))
+
+    def keys(self, index):
+        return sorted(v["key"] for v in self.packets[index])
+
+    def close(self):
+        self.sock.close()
+
+
+def _wait(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _container_event(name):
+    return {"Type": "container", "Action": "die", "Actor": {"Attributes": {"name": name}}}
+
+
+def _check_packets():
+    """encode_packet/read_packet туда и обратно, со сжатием и без."""
+    payload = {"request": "sender data", "data": [{"host": "Хост", "key": KEY_EXITED, "value": "x" * TEXT_LIMIT}]}
+    sizes = {}
+    ok = True
+    for compress in (True, False):
+        packet = encode_packet(payload, compress)
+        sizes[compress] = len(packet)
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(packet)
+            ok = read_packet(right) == payload and ok
+    ok = ok and sizes[True] < sizes[False]
+    print("Пакет Zabbix: разбор %s, со сжатием %d байт, без сжатия %d." % (
+        "совпадает" if ok else "НЕ СОВПАДАЕТ", sizes[True], sizes[False]))
+    return ok
+
+
+def _start(fake, trapper, resync, debounce):
+    collector = Collector(DockerClient(fake.path), ZabbixSender(trapper.address, batch_size=2), "Visiology-Server",
+                          resync=resync, debounce=debounce)
+    streams, sent = len(fake.streams), len(trapper.packets)
+    thread = threading.Thread(target=collector.run, daemon=True)
+    thread.start()
+    # Первый снимок — три значения пакетами по 2 — и подписка на /events
+    _wait(lambda: len(fake.streams) > streams and len(trapper.packets) >= sent + 2)
+    return collector, thread
+
+
+def _finish(fake, collector, thread):
+    collector.stop()
+    fake.end_streams()
+    thread.join(5)
+    collector.docker.close()
+
+
+def _check_snapshot(fake, trapper):
+    """Первый снимок уходит целиком (пакетами по batch_size), повторный без изменений — ничего не отправляет."""
+    collector = Collector(DockerClient(fake.path), ZabbixSender(trapper.address, batch_size=2), "Visiology-Server")
+    try:
+        collector.run_once()
+        collector.run_once()
+    finally:
+        collector.docker.close()
+    values = {v["key"]: v["value"] for packet in trapper.packets for v in packet}
+    services = json.loads(values.get(KEY_SERVICES, "[]"))
+    ok = (len(trapper.packets) == 2 and sorted(values) == sorted([KEY_SERVICES, KEY_EXITED, KEY_SWARM])
+          and services and services[0]["Name"] == "visiology_api" and services[0]["Replicas"] == "2/2"
+          and values[KEY_SWARM] == "active")
+    print("Снимок: пакетов %d, значений %d; повторный снимок без изменений %s." % (
+        len(trapper.packets), len(values), "не отправлен" if len(trapper.packets) == 2 else "ОТПРАВЛЕН"))
+    return ok
+
+
+def _check_refused(fake, trapper):
+    """Значения, которые траппер не принял (failed > 0), остаются в очереди и уходят при следующей отправке."""
+    collector = Collector(DockerClient(fake.path), ZabbixSender(trapper.address, batch_size=2), "Visiology-Server")
+    trapper.refuse.add(KEY_SWARM)
+    try:
+        collector.push({KEY_EXITED: "a", KEY_SERVICES: "[]", KEY_SWARM: "inactive"})
+        kept = sorted(collector.pending)
+        trapper.refuse.clear()
+        collector.push({})
+    finally:
+        trapper.refuse.clear()
+        collector.docker.close()
+    ok = kept == [KEY_SWARM] and not collector.pending
+    print("Отклонённые значения: в очереди после отказа %s, после повтора %d." % (
+        ", ".join(kept) or "ничего", len(collector.pending)))
+    return ok
+
+
+def _check_debounce(fake, trapper, debounce=0.3):
+    """Серия событий за окно debounce даёт один запрос к Docker и одну отправку изменившегося значения."""
+    collector, thread = _start(fake, trapper, resync=3600, debounce=debounce)
+    try:
+        before = dict(fake.requests)
+        sent = len(trapper.packets)
+        fake.containers = [{"Id": "c0ffee000000001", "Names": ["/visiology_job.1"], "Status": "Exited (1) 1 second ago"}]
+        for _ in range(5):
+            fake.emit(_container_event("visiology_job.1"))
+        _wait(lambda: len(trapper.packets) > sent)
+        time.sleep(debounce * 2)
+    finally:
+        _finish(fake, collector, thread)
+    queried = fake.requests["/containers/json"] - before.get("/containers/json", 0)
+    ok = len(trapper.packets) == sent + 1 and trapper.keys(sent) == [KEY_EXITED] and queried == 1 \
+        and "visiology_job.1" in trapper.packets[sent][0]["value"]
+    print("Debounce: 5 событий -> запросов /containers/json %d, отправок %d (%s)." % (
+        queried, len(trapper.packets) - sent, ", ".join(trapper.keys(sent)) if len(trapper.packets) > sent else "-"))
+    return ok
+
+
+def _check_busy_resync(fake, trapper, resync=0.5, seconds=2.0):
+    """Пересинхронизация наступает в срок и при непрерывном потоке событий, которые ничего не меняют."""
+    collector, thread = _start(fake, trapper, resync=resync, debounce=0.05)
+    sent = len(trapper.packets)
+    try:
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            fake.emit({"Type": "service", "Action": "update", "Actor": {"Attributes": {"name": "visiology_api"}}})
+            time.sleep(0.02)
+    finally:
+        _finish(fake, collector, thread)
+    # Состояние Swarm не меняется, поэтому уходит только при полной пересинхронизации
+    full = sum(1 for i in range(sent, len(trapper.packets)) if KEY_SWARM in trapper.keys(i))
+    ok = full >= int(seconds / resync) // 2
+    print("Пересинхронизация при потоке событий: %d за %.1f с при периоде %.1f с." % (full, seconds, resync))
+    return ok
+
+
+def selfcheck():
+    """
+    Снимок, протокол sender и цикл событий на поддельных Docker (unix-сокет) и траппере Zabbix в том же процессе.
+    """
+    workdir = tempfile.mkdtemp(prefix="docker-collector-")
+    fake = _FakeDocker(os.path.join(workdir, "docker.sock"))
+    trapper = _FakeTrapper()
+    try:
+        ok = _check_packets()
+        ok = _check_snapshot(fake, trapper) and ok
+        ok = _check_refused(fake, trapper) and ok
+        ok = _check_debounce(fake, trapper) and ok
+        ok = _check_busy_resync(fake, trapper) and ok
+        print("Самопроверка: %s" % ("успешно" if ok else "ОШИБКА"))
+        return ok
+    finally:
+        trapper.close()
+        fake.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сборщик событий Docker с отправкой в элементы-трапперы Zabbix.")
+    parser.add_argument("command", nargs="?", default="run", choices=("run", "selfcheck"),
+                        help="run — сбор и отправка (по умолчанию), selfcheck — самопроверка на поддельных Docker и Zabbix")
+    parser.add_argument("--docker-socket", default=DOCKER_SOCKET, help="unix-сокет Docker (по умолчанию %(default)s)")
+    parser.add_argument("--zabbix-server", default=ZABBIX_SERVER, help="адрес траппера Zabbix host:port (по умолчанию %(default)s)")
+    parser.add_argument("--host", default=ZBX_HOSTNAME, help="имя хоста в Zabbix (по умолчанию %(default)s)")
+    parser.add_argument("--batch", type=int, default=SENDER_BATCH, help="значений в одном пакете (по умолчанию %(default)s)")
+    parser.add_argument("--resync", type=float, default=RESYNC_INTERVAL, help="период полной пересинхронизации, сек")
+    parser.add_argument("--no-compress", action="store_true", help="не сжимать пакеты zlib")
+    parser.add_argument("--once", action="store_true", help="снять снимок, отправить и выйти")
+    parser.add_argument("--dry-run", action="store_true", help="печатать значения вместо отправки в Zabbix")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "selfcheck":
+        sys.exit(0 if selfcheck() else 1)
+    docker = DockerClient(args.docker_socket)
+    sender = ZabbixSender(args.zabbix_server, batch_size=args.batch, compress=not args.no_compress)
+    collector = Collector(docker, sender, args.host, resync=args.resync, dry_run=args.dry_run)
+    try:
+        if args.once:
+            collector.run_once()
+        else:
+            print("Сборщик Docker: %s -> %s (хост «%s»)" % (args.docker_socket, args.zabbix_server, args.host))
+            collector.run()
+    except KeyboardInterrupt:
+        collector.stop()
+    finally:
+        docker.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (RuntimeError, OSError) as e:
+        print("Ошибка: %s" % e, file=sys.stderr)
+        sys.exit(1)
@@ -12,6 +12,15 @@
 #   DO_API_CONFIG=0          — не выполнять настройку через API (по умолчанию 1)
 #   SERVER_IP=192.168.1.1    — IP/хост для доступа к Zabbix (веб, редиректы)
 #   ZABBIX_AGENT_IP=172.17.0.1 — IP, по которому сервер в Docker опрашивает агента (по умолчанию авто: docker bridge)
+#   DOCKER_COLLECTOR=1       — сборщик событий Docker (docker-collector.py) вместо опроса docker CLI агентом
+#   INIT_PROFILE_FORMAT=prom — профиль настройки через API в logs/ как textfile Prometheus (по умолчанию json — Chrome trace)
+#   TIMESCALEDB=1            — БД на TimescaleDB: история/trends в гипертаблицах со сжатием (для новой установки)
+#   SWARM_AGENT=1            — агент глобальным сервисом Swarm на всех узлах + авторегистрация (запуск на менеджере)
+#   EXPECTED_HOSTS=50        — ожидаемое число хостов для профиля сервера (по умолчанию 1, при SWARM_AGENT=1 — узлы Swarm)
+#   ITEMS_PER_HOST=300       — элементов на хост для профиля сервера; TUNING=0 — оставить значения образа
+#   PROXY=1                  — прокси Zabbix (zabbix-proxy-sqlite3) рядом с сервером; хосты опрашиваются через него
+#   PROXY_GROUPS=site-a,site-b — по прокси на группу узлов Swarm (метка узла zabbix-proxy-group=<группа>)
+#   EXPORT=1                 — экспорт в реальном времени (history, trends, events) и его чтение zabbix-export-reader.py
 set -e
 
 DEBUG=0
@@ -40,6 +49,23 @@ VISIOLOGY_INTEGRATE="${VISIOLOGY_INTEGRATE:-0}"
 SERVER_IP="${SERVER_IP:-}"
 # IP, по которому сервер в Docker подключается к агенту (обычно gateway docker0, напр. 172.17.0.1). Пусто — авто.
 ZABBIX_AGENT_IP="${ZABBIX_AGENT_IP:-}"
+# Сборщик событий Docker с отправкой в трапперы (профиль compose «collector»): 1 — да, 0 — опрос агентом
+DOCKER_COLLECTOR="${DOCKER_COLLECTOR:-0}"
+# TimescaleDB вместо PostgreSQL: 1 — да (образ timescale/timescaledb, ENABLE_TIMESCALEDB, сжатие в housekeeping)
+TIMESCALEDB="${TIMESCALEDB:-0}"
+TIMESCALEDB_IMAGE="${TIMESCALEDB_IMAGE:-timescale/timescaledb:latest-pg17}"
+# Агент на каждом узле Swarm (docker-stack-agent2.yml) вместо контейнера compose; хосты — авторегистрацией
+SWARM_AGENT="${SWARM_AGENT:-0}"
+SWARM_STACK="${SWARM_STACK:-visiology-zabbix-agent}"
+# Профиль сервера (кеши, число процессов) по ядрам, памяти и ожидаемому объёму: 1 — рассчитать, 0 — значения образа
+TUNING="${TUNING:-1}"
+EXPECTED_HOSTS="${EXPECTED_HOSTS:-}"
+ITEMS_PER_HOST="${ITEMS_PER_HOST:-300}"
+# Прокси: локальный (профиль compose «proxy») и/или по одному на группу узлов Swarm (docker-stack-proxy.yml)
+PROXY="${PROXY:-0}"
+PROXY_GROUPS="${PROXY_GROUPS:-}"
+# Экспорт в реальном времени (ExportType сервера) и агрегаты по окнам от zabbix-export-reader (профиль compose «export»)
+EXPORT="${EXPORT:-0}"
 
 # Цвета и сброс
 R="\033[0;31m"
@@ -119,6 +145,78 @@ detect_docker_bridge_ip() {
   fi
 }
 
+# Установить KEY=VALUE в env-файле (заменить строку или дописать)
+set_env_var() {
+  local key="$1" value="$2" file="$3"
+  if grep -q "^${key}=" "$file" 2>/dev/null; then
+    sed -i "s|^${key}=.*|${key}=${value}|" "$file"
+  else
+    echo "${key}=${value}" >> "$file"
+  fi
+}
+
+# Включить профиль docker compose (COMPOSE_PROFILES в .env, через запятую)
+add_compose_profile() {
+  local profile="$1" file="$2" current
+  current="$(grep '^COMPOSE_PROFILES=' "$file" 2>/dev/null | cut -d= -f2-)"
+  case ",$current," in
+    *",$profile,"*) ;;
+    *) set_env_var COMPOSE_PROFILES "${current:+$current,}$profile" "$file" ;;
+  esac
+}
+
+# Профиль zabbix-server по ядрам CPU, памяти и ожидаемому числу хостов/элементов -> ZBX_* в .env.
+# Кеши: конфигурации и значений ~ число элементов, истории ~ поток значений (NVPS) с запасом на паузы БД;
+# вместе не больше четверти памяти и не меньше значений образа. Процессы: поллеры и трапперы по числу хостов,
+# синхронизаторы истории — один на ~1000 NVPS (в пределах max_connections PostgreSQL по умолчанию).
+tune_server() {
+  local file="$1" cores mem_mb hosts items tuning kv
+  cores="$(nproc 2>/dev/null || echo 2)"
+  mem_mb="$(awk '/^MemTotal:/ {print int($2 / 1024)}' /proc/meminfo 2>/dev/null)"
+  mem_mb="${mem_mb:-4096}"
+  hosts="$EXPECTED_HOSTS"
+  if [ -z "$hosts" ] && [ "$SWARM_AGENT" = "1" ]; then
+    hosts="$(docker node ls -q 2>/dev/null | wc -l)"
+  fi
+  hosts="${hosts:-1}"
+  [ "$hosts" -ge 1 ] 2>/dev/null || hosts=1
+  items=$((hosts * ITEMS_PER_HOST))
+  tuning="$(awk -v cores="$cores" -v mem="$mem_mb" -v hosts="$hosts" -v items="$items" '
+    function max(a, b) { return a > b ? a : b }
+    function min(a, b) { return a < b ? a : b }
+    function up(x) { return x == int(x) ? x : int(x) + 1 }
+    BEGIN {
+      nvps = items / 60
+      cache = max(32, up(items / 400)); vcache = max(8, up(items / 400))
+      hcache = min(2048, max(16, up(nvps / 16))); icache = min(2048, max(4, up(hcache / 4)))
+      tcache = min(2048, max(4, up(items / 2000)))
+      total = cache + vcache + hcache + icache + tcache
+      if (total > mem / 4) {
+        k = mem / 4 / total
+        cache = max(32, int(cache * k)); vcache = max(8, int(vcache * k))
+        hcache = max(16, int(hcache * k)); icache = max(4, int(icache * k)); tcache = max(4, int(tcache * k))
+      }
+      pollers = min(50, 5 + int(hosts / 100))
+      printf "ZBX_CACHESIZE=%dM\n", cache
+      printf "ZBX_HISTORYCACHESIZE=%dM\n", hcache
+      printf "ZBX_HISTORYINDEXCACHESIZE=%dM\n", icache
+      printf "ZBX_TRENDCACHESIZE=%dM\n", tcache
+      printf "ZBX_VALUECACHESIZE=%dM\n", vcache
+      printf "ZBX_STARTPOLLERS=%d\n", pollers
+      printf "ZBX_STARTAGENTPOLLERS=%d\n", min(max(1, cores), 1 + int(nvps / 2000))
+      printf "ZBX_STARTPOLLERSUNREACHABLE=%d\n", max(1, int(pollers / 5))
+      printf "ZBX_STARTTRAPPERS=%d\n", min(30, 5 + int(hosts / 50))
+      printf "ZBX_STARTPREPROCESSORS=%d\n", max(16, min(64, cores * 2))
+      printf "ZBX_STARTDBSYNCERS=%d\n", min(16, max(4, up(nvps / 1000)))
+      printf "ZBX_STARTLLDPROCESSORS=%d\n", min(max(2, cores), 2 + int(hosts / 100))
+    }')"
+  for kv in $tuning; do
+    set_env_var "${kv%%=*}" "${kv#*=}" "$file"
+  done
+  log_step "Профиль сервера (ядер: $cores, память: ${mem_mb} МБ, хостов: $hosts, элементов: $items, ~$((items / 60)) NVPS):"
+  log_step "  $(echo $tuning)"
+}
+
 # Интерактивный ввод, если не задано переменными
 prompt_if_empty() {
   local var_name="$1"
@@ -227,7 +325,7 @@ fi
 export ZABBIX_AGENT_IP
 
 echo ""
-log_step "Параметры: каталог=$INSTALL_DIR, URL=$URL_MODE, API=$DO_API_CONFIG, Visiology=$VISIOLOGY_INTEGRATE, IP_сервера=$SERVER_IP, IP_агента=$ZABBIX_AGENT_IP"
+log_step "Параметры: каталог=$INSTALL_DIR, URL=$URL_MODE, API=$DO_API_CONFIG, Visiology=$VISIOLOGY_INTEGRATE, IP_сервера=$SERVER_IP, IP_агента=$ZABBIX_AGENT_IP, сборщик_Docker=$DOCKER_COLLECTOR, TimescaleDB=$TIMESCALEDB, агент_Swarm=$SWARM_AGENT, прокси=$PROXY, группы_прокси=${PROXY_GROUPS:-нет}, экспорт=$EXPORT"
 echo ""
 
 # --- Создание каталога и копирование файлов ---
@@ -261,6 +359,21 @@ fi
 # Файлы для настройки по API
 cp -f "$SCRIPT_DIR/zabbix-init-config.py" "$INSTALL_DIR/" 2>/dev/null || true
 cp -f "$SCRIPT_DIR/zabbix-init-config.env" "$INSTALL_DIR/" 2>/dev/null || true
+# Нагрузочный прогон (использует zabbix-init-config.py и отправку из docker-collector.py)
+for f in zabbix-load-test.py zabbix-load-test.json docker-collector.py; do
+  cp -f "$SCRIPT_DIR/$f" "$INSTALL_DIR/" 2>/dev/null || true
+done
+# Агент в Swarm: только на менеджере; контейнер агента из compose не запускается (на этом узле работает задача стека).
+# Проверка — до записи local.env: без стека агента действие авторегистрации не нужно
+if [ "$SWARM_AGENT" = "1" ]; then
+  if [ "$(docker info --format '{{.Swarm.ControlAvailable}}' 2>/dev/null)" = "true" ]; then
+    set_env_var ZABBIX_AGENT2_REPLICAS 0 "$INSTALL_DIR/.env"
+    cp -f "$SCRIPT_DIR/docker-stack-agent2.yml" "$INSTALL_DIR/"
+  else
+    log_warn "Узел не является менеджером Docker Swarm: агент будет запущен через docker compose только на этом сервере."
+    SWARM_AGENT=0
+  fi
+fi
 # Локальный env для init-config: URL веб-интерфейса (как к нему подключаться) и IP агента
 {
   echo "# Сгенерировано установщиком. Для ручного запуска: python3 zabbix-init-config.py"
@@ -270,7 +383,62 @@ cp -f "$SCRIPT_DIR/zabbix-init-config.env" "$INSTALL_DIR/" 2>/dev/null || true
     echo "ZABBIX_URL=http://${SERVER_IP}:8080"
   fi
   echo "ZABBIX_AGENT_IP=${ZABBIX_AGENT_IP:-172.17.0.1}"
+  if [ "$DOCKER_COLLECTOR" = "1" ]; then
+    echo "ZABBIX_DOCKER_COLLECTOR=1"
+  fi
+  if [ "$TIMESCALEDB" = "1" ]; then
+    echo "ZABBIX_TIMESCALEDB=1"
+  fi
+  if [ "$SWARM_AGENT" = "1" ]; then
+    echo "ZABBIX_AUTOREGISTRATION=1"
+  fi
+  # Пул прокси: хосты без поля proxy в инвентаре распределяются по ним равномерно
+  proxy_names=""
+  if [ "$PROXY" = "1" ]; then
+    proxy_names="${ZBX_PROXY_NAME:-visiology-proxy}"
+  fi
+  for group in $(echo "$PROXY_GROUPS" | tr ',' ' '); do
+    proxy_names="${proxy_names:+$proxy_names,}visiology-proxy-$group"
+  done
+  if [ -n "$proxy_names" ]; then
+    echo "ZABBIX_PROXIES=$proxy_names"
+  fi
 } > "$INSTALL_DIR/zabbix-init-config.local.env" 2>/dev/null || true
+# Сборщик событий Docker: скрипт и профиль compose «collector»
+if [ "$DOCKER_COLLECTOR" = "1" ]; then
+  cp -f "$SCRIPT_DIR/docker-collector.py" "$INSTALL_DIR/"
+  add_compose_profile collector "$INSTALL_DIR/.env"
+fi
+# TimescaleDB: образ БД и создание гипертаблиц сервером при создании схемы
+if [ "$TIMESCALEDB" = "1" ]; then
+  set_env_var ZABBIX_DB_IMAGE "$TIMESCALEDB_IMAGE" "$INSTALL_DIR/.env"
+  set_env_var ENABLE_TIMESCALEDB true "$INSTALL_DIR/.env"
+  cp -f "$SCRIPT_DIR/check_timescaledb.sh" "$INSTALL_DIR/"
+fi
+# Кеши и процессы zabbix-server под этот сервер и ожидаемый объём
+if [ "$TUNING" = "1" ]; then
+  tune_server "$INSTALL_DIR/.env"
+fi
+# Экспорт в реальном времени: типы для сервера, скрипт чтения и каталог результатов (профиль compose «export»)
+if [ "$EXPORT" = "1" ]; then
+  set_env_var ZBX_EXPORTTYPE "history,trends,events" "$INSTALL_DIR/.env"
+  cp -f "$SCRIPT_DIR/zabbix-export-reader.py" "$INSTALL_DIR/"
+  mkdir -p "$INSTALL_DIR/export-out"
+  add_compose_profile export "$INSTALL_DIR/.env"
+fi
+# Прокси рядом с сервером: профиль compose «proxy»
+if [ "$PROXY" = "1" ]; then
+  add_compose_profile proxy "$INSTALL_DIR/.env"
+fi
+# Прокси по группам узлов Swarm: стек разворачивается с менеджера
+if [ -n "$PROXY_GROUPS" ]; then
+  if [ "$(docker info --format '{{.Swarm.ControlAvailable}}' 2>/dev/null)" = "true" ]; then
+    cp -f "$SCRIPT_DIR/docker-stack-proxy.yml" "$INSTALL_DIR/"
+  else
+    log_warn "Узел не является менеджером Docker Swarm: прокси групп узлов ($PROXY_GROUPS) не будут развёрнуты."
+    PROXY_GROUPS=""
+  fi
+fi
 # Каталог agent2.d (99_server_active.conf, 98_docker_commands.conf для виджетов)
 if [ -d "$SCRIPT_DIR/agent2.d" ]; then
   mkdir -p "$INSTALL_DIR/agent2.d"
@@ -298,6 +466,10 @@ if [ -f "$INSTALL_DIR/Dockerfile.agent2" ]; then
 fi
 
 # --- Запуск контейнеров ---
+if [ "$TIMESCALEDB" = "1" ] && docker ps -a --format '{{.Names}}' 2>/dev/null | grep -qx zabbix-postgres; then
+  # Гипертаблицы создаются только вместе со схемой; существующую БД нужно переносить отдельно (pg_dump / restore)
+  log_warn "БД zabbix-postgres уже существует: TimescaleDB подключится, но история останется в обычных таблицах. Для новой установки удалите том БД (docker compose down -v)."
+fi
 log_step "Запуск Docker Compose..."
 spinner_start "docker compose up -d"
 (
@@ -307,6 +479,33 @@ spinner_start "docker compose up -d"
 stop_spinner
 log_step "Контейнеры запущены"
 
+# --- Агент на всех узлах Swarm (глобальный сервис) ---
+if [ "$SWARM_AGENT" = "1" ]; then
+  log_step "Развёртывание агента на узлах Swarm (стек $SWARM_STACK)..."
+  # Пассивные проверки на других узлах сервер выполняет со своего адреса — он должен быть в списке Server агента
+  # (и с адресов узлов прокси, если они есть: задайте ZBX_SERVER_HOST целиком, например с подсетью площадок)
+  agent_server_host="${ZBX_SERVER_HOST:-127.0.0.1,172.16.0.0/12,$SERVER_IP}"
+  if ( cd "$INSTALL_DIR" \
+      && ZBX_SERVER_ACTIVE="$SERVER_IP" ZBX_SERVER_HOST="$agent_server_host" \
+      docker stack deploy -c docker-stack-agent2.yml "$SWARM_STACK" ); then
+    log_step "Агент развёрнут: docker service ps ${SWARM_STACK}_zabbix-agent2"
+  else
+    log_warn "docker stack deploy не выполнен. Повторите: cd $INSTALL_DIR && ZBX_SERVER_ACTIVE=$SERVER_IP ZBX_SERVER_HOST=\"$agent_server_host\" docker stack deploy -c docker-stack-agent2.yml $SWARM_STACK"
+  fi
+fi
+
+# --- Прокси на группах узлов Swarm ---
+for group in $(echo "$PROXY_GROUPS" | tr ',' ' '); do
+  log_step "Развёртывание прокси visiology-proxy-$group (узлы с меткой zabbix-proxy-group=$group)..."
+  if ! docker node ls --filter "node.label=zabbix-proxy-group=$group" -q 2>/dev/null | grep -q .; then
+    log_warn "Нет узлов с меткой zabbix-proxy-group=$group. Добавьте: docker node update --label-add zabbix-proxy-group=$group <узел>"
+  fi
+  ( cd "$INSTALL_DIR" \
+      && ZBX_PROXY_NAME="visiology-proxy-$group" ZBX_PROXY_GROUP="$group" ZBX_SERVER_HOST="$SERVER_IP" \
+      docker stack deploy -c docker-stack-proxy.yml "visiology-zabbix-proxy-$group" ) \
+    || log_warn "Прокси группы $group не развёрнут. Повторите вручную (см. комментарий в docker-stack-proxy.yml)."
+done
+
 # --- Ожидание API Zabbix ---
 log_step "Ожидание доступности API Zabbix..."
 ZABBIX_API_URL="http://${SERVER_IP}:8080/api_jsonrpc.php"
@@ -333,17 +532,24 @@ fi
 if [ "$DO_API_CONFIG" -eq 1 ]; then
   log_step "Настройка Zabbix через API (хост, шаблоны, триггер, дашборд)..."
   spinner_start "API: группа, хост, триггер"
+  api_started=$SECONDS
   export ZABBIX_URL="http://${SERVER_IP}:8080"
   export ZABBIX_USER="${ZABBIX_USER:-Admin}"
   export ZABBIX_PASSWORD="${ZABBIX_PASSWORD:-zabbix}"
   export ZBX_HOSTNAME="${ZBX_HOSTNAME:-Visiology-Server}"
   export ZABBIX_AGENT_IP="${ZABBIX_AGENT_IP:-172.17.0.1}"
   export ZABBIX_AGENT_PORT="${ZABBIX_AGENT_PORT:-10050}"
+  # Вывод и профиль настройки (вызовы API, шаги; Chrome trace или .prom) — в logs/ каталога установки
+  mkdir -p "$INSTALL_DIR/logs"
+  init_stamp="$(date +%Y%m%d-%H%M%S)"
+  INIT_LOG="$INSTALL_DIR/logs/zabbix-init-config-${init_stamp}.log"
+  INIT_PROFILE="$INSTALL_DIR/logs/zabbix-init-profile-${init_stamp}.${INIT_PROFILE_FORMAT:-json}"
   if [ -f "$INSTALL_DIR/zabbix-init-config.py" ]; then
     if command -v python3 >/dev/null 2>&1; then
       (
+        set -o pipefail
         cd "$INSTALL_DIR"
-        python3 zabbix-init-config.py
+        python3 zabbix-init-config.py --profile --profile-output "$INIT_PROFILE" 2>&1 | tee "$INIT_LOG"
       ) || {
         stop_spinner
         log_warn "Не удалось выполнить zabbix-init-config.py (проверьте python3). Настройте хост и шаблоны вручную."
@@ -357,7 +563,16 @@ if [ "$DO_API_CONFIG" -eq 1 ]; then
     log_warn "Файл zabbix-init-config.py не найден. Настройте хост и шаблоны вручную."
   fi
   stop_spinner
-  log_step "Настройка через API завершена (хост, шаблоны, триггер, дашборд «Главный экран»: проблемы, контейнеры, диск, Swarm)"
+  log_step "Настройка через API завершена за $((SECONDS - api_started)) с (хост, шаблоны, триггер, дашборд «Главный экран»: проблемы, контейнеры, диск, Swarm)"
+  if [ -f "$INIT_PROFILE" ]; then
+    log_step "Лог настройки: $INIT_LOG, профиль API: $INIT_PROFILE"
+  fi
+fi
+
+# --- Проверка TimescaleDB: гипертаблицы, чанки, сжатие ---
+if [ "$TIMESCALEDB" = "1" ] && [ -f "$INSTALL_DIR/check_timescaledb.sh" ]; then
+  log_step "Проверка TimescaleDB (гипертаблицы, чанки, сжатие)..."
+  sh "$INSTALL_DIR/check_timescaledb.sh" || log_warn "Проверка TimescaleDB не выполнена. Запустите позже: cd $INSTALL_DIR && sh check_timescaledb.sh"
 fi
 
 # --- Интеграция с Visiology (добавить /v3/zabbix в reverse proxy) ---
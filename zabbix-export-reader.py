@@ -0,0 +1,697 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковое чтение файлов экспорта Zabbix в реальном времени (ExportDir, том zabbix_export) без запросов к API.
+Сервер пишет NDJSON-файлы по типам и процессам (history-history-syncer-1.ndjson, trends-..., problems-...) и при
+достижении ExportFileSize переименовывает файл в *.ndjson.old. Скрипт дочитывает файлы с сохранённой позиции
+(inode + смещение) и при ротации сначала дочитывает .old, поэтому файлы никогда не перечитываются целиком.
+История сворачивается в агрегаты по элементу в окнах фиксированной длины (count/min/max/sum/avg/last по clock
+значения); trends и события передаются как есть. Результат пакетами уходит в приёмник: файл NDJSON, stdout
+или локальный unix-сокет. Память ограничена: чтение порциями до CHUNK_SIZE, не больше --max-keys открытых окон,
+очередь на отправку — не больше пакета и одной порции (при недоступном приёмнике чтение приостанавливается).
+После каждой отправки позиции файлов и открытые окна атомарно сохраняются в файл состояния: после перезапуска
+чтение продолжается с того же места (доставка «хотя бы один раз»). Окно, в которое пришли опоздавшие значения,
+может быть выдано повторно частями — получатель складывает записи с одинаковыми itemid и window_start.
+Запуск:
+  python3 zabbix-export-reader.py --dir /var/lib/zabbix/export --sink file:/data/zabbix-export-agg.ndjson
+  python3 zabbix-export-reader.py --once --drain --sink -          # прочитать накопленное, закрыть окна и выйти
+  python3 zabbix-export-reader.py generate --dir /tmp/export      # сгенерировать файлы экспорта (с ротацией)
+  python3 zabbix-export-reader.py selfcheck                       # проверка на сгенерированных файлах
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+
+def env(key, default=None):
+    return os.environ.get(key, default)
+
+
+EXPORT_DIR = env("ZABBIX_EXPORT_DIR", "/var/lib/zabbix/export")
+STATE_FILE = env("ZABBIX_EXPORT_STATE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "zabbix-export-reader.state.json"))
+SINK = env("ZABBIX_EXPORT_SINK", "file:zabbix-export-agg.ndjson")
+KINDS = env("ZABBIX_EXPORT_KINDS", "history,trends,problems")
+WINDOW = int(env("ZABBIX_EXPORT_WINDOW", "60"))
+# Сколько секунд после конца окна ждать значения от других процессов (файлы history-syncer пишутся независимо)
+LATENESS = int(env("ZABBIX_EXPORT_LATENESS", "30"))
+MAX_KEYS = int(env("ZABBIX_EXPORT_MAX_KEYS", "50000"))
+BATCH_SIZE = int(env("ZABBIX_EXPORT_BATCH", "1000"))
+FLUSH_INTERVAL = float(env("ZABBIX_EXPORT_FLUSH_INTERVAL", "5"))
+POLL_INTERVAL = float(env("ZABBIX_EXPORT_POLL", "1"))
+# Порция чтения и заодно предел длины строки: более длинные строки пропускаются
+CHUNK_SIZE = 1 << 20
+STATE_VERSION = 1
+
+# Типы значений истории: 0 — float, 3 — unsigned; остальные (строки, лог, текст) только считаются
+NUMERIC_TYPES = (0, 3)
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def file_kind(name):
+    """history-history-syncer-1.ndjson -> history."""
+    return os.path.basename(name).split("-", 1)[0]
+
+
+class ExportFile(object):
+    """
+    Один файл экспорта и его ротация: позиция — inode и смещение конца последней полной строки.
+    Если inode файла изменился, сервер переименовал прочитанный файл в .old — он дочитывается первым.
+    """
+
+    def __init__(self, path, inode=None, offset=0):
+        self.path = path
+        self.kind = file_kind(path)
+        self.inode = inode
+        self.offset = offset
+        self.rotations = 0
+        self.lost = 0
+        self.skipped_lines = 0
+
+    def checkpoint(self):
+        return {"inode": self.inode, "offset": self.offset}
+
+    def poll(self, on_lines):
+        """
+        Читает не больше одной порции новых полных строк и передаёт их on_lines(kind, строки).
+        Возвращает число прочитанных байт; 0 — новых данных нет.
+        """
+        st = _stat(self.path)
+        if self.inode is not None and (st is None or st.st_ino != self.inode):
+            old = _stat(self.path + ".old")
+            if old is not None and old.st_ino == self.inode:
+                read = self._read(self.path + ".old", on_lines)
+                if read:
+                    return read
+                if old.st_size > self.offset:
+                    # В .old сервер больше не пишет: неполная последняя строка уже не допишется
+                    self.skipped_lines += 1
+                    print("%s.old: неполная последняя строка (%d байт) пропущена." % (
+                        self.path, old.st_size - self.offset), file=sys.stderr)
+            elif st is None:
+                return 0
+            elif self.offset:
+                # Файл повернулся дважды, пока его не читали: остаток прежнего файла уже удалён сервером
+                self.lost += 1
+                print("%s: файл повёрнут дважды, часть данных пропущена." % self.path, file=sys.stderr)
+            self.rotations += 1
+            self.inode, self.offset = None, 0
+        if st is None:
+            return 0
+        if self.inode is None:
+            self.inode = st.st_ino
+        elif st.st_size < self.offset:
+            # Укорочен или повёрнут дважды с повторным использованием inode — прочитанное с начала не повторяется
+            self.lost += 1
+            print("%s: файл укорочен, чтение с начала." % self.path, file=sys.stderr)
+            self.offset = 0
+        return self._read(self.path, on_lines)
+
+    def _read(self, path, on_lines):
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return 0
+        with f:
+            # Между stat и open файл мог повернуться: читаем только тот, на котором стоит позиция
+            if os.fstat(f.fileno()).st_ino != self.inode:
+                return 0
+            f.seek(self.offset)
+            chunk = f.read(CHUNK_SIZE)
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                if len(chunk) < CHUNK_SIZE:
+                    return 0  # строка ещё дописывается
+                return self._skip_long_line(f)
+            lines = chunk[:end].split(b"\n")
+            on_lines(self.kind, lines)
+            self.offset += end + 1
+            return end + 1
+
+    def _skip_long_line(self, f):
+        skipped = 0
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return 0  # конец строки ещё не записан — повторим позже
+            end = chunk.find(b"\n")
+            if end >= 0:
+                skipped += CHUNK_SIZE + end + 1
+                self.offset += skipped
+                self.skipped_lines += 1
+                print("%s: строка длиннее %d байт пропущена." % (self.path, CHUNK_SIZE), file=sys.stderr)
+                return skipped
+            skipped += len(chunk)
+
+
+class WindowAggregator(object):
+    """
+    Агрегаты истории по элементу в окнах [start, start + window) по clock значения.
+    Окно закрывается, когда отметка времени (наибольший clock минус lateness) прошла его конец;
+    при превышении max_keys досрочно закрываются самые старые окна.
+    """
+
+    def __init__(self, window=WINDOW, lateness=LATENESS, max_keys=MAX_KEYS):
+        self.window = window
+        self.lateness = lateness
+        self.max_keys = max_keys
+        self.windows = {}  # start -> {itemid: агрегат}
+        self.keys = 0
+        self.max_clock = 0
+
+    def add(self, rec):
+        clock = int(rec["clock"])
+        start = clock - clock % self.window
+        bucket = self.windows.setdefault(start, {})
+        itemid = rec["itemid"]
+        agg = bucket.get(itemid)
+        if agg is None:
+            agg = bucket[itemid] = {
+                "itemid": itemid, "host": (rec.get("host") or {}).get("host", ""), "name": rec.get("name", ""),
+                "type": rec.get("type"), "window_start": start, "window": self.window, "count": 0,
+            }
+            self.keys += 1
+        agg["count"] += 1
+        if rec.get("type") in NUMERIC_TYPES:
+            value = rec["value"]
+            if "sum" in agg:
+                agg["sum"] += value
+                agg["min"] = min(agg["min"], value)
+                agg["max"] = max(agg["max"], value)
+            else:
+                agg["sum"] = agg["min"] = agg["max"] = value
+            if clock >= agg.get("last_clock", 0):
+                agg["last"] = value
+        if clock >= agg.get("last_clock", 0):
+            agg["last_clock"] = clock
+        self.max_clock = max(self.max_clock, clock)
+
+    def _close(self, start):
+        bucket = self.windows.pop(start)
+        self.keys -= len(bucket)
+        out = []
+        for agg in bucket.values():
+            rec = dict(agg, kind="history")
+            if "sum" in rec:
+                rec["avg"] = rec["sum"] / rec["count"]
+            out.append(rec)
+        return out
+
+    def close_ready(self, now=None):
+        """Закрытые окна (записи для отправки). now — время без новых данных: окна закрываются и по часам."""
+        watermark = max(self.max_clock, now - self.window if now else 0) - self.lateness
+        out = []
+        for start in sorted(self.windows):
+            if start + self.window <= watermark or self.keys > self.max_keys:
+                out.extend(self._close(start))
+        return out
+
+    def close_all(self):
+        out = []
+        for start in sorted(self.windows):
+            out.extend(self._close(start))
+        return out
+
+    def dump(self):
+        return {"max_clock": self.max_clock, "windows": [agg for bucket in self.windows.values() for agg in bucket.values()]}
+
+    def load(self, state):
+        self.max_clock = state.get("max_clock", 0)
+        for agg in state.get("windows", []):
+            if agg.get("window") == self.window:
+                self.windows.setdefault(agg["window_start"], {})[agg["itemid"]] = agg
+                self.keys += 1
+
+
+class FileSink(object):
+    """Дописывает пакеты в файл NDJSON; после записи — fsync, чтобы позиция в состоянии не опережала данные."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def write(self, records):
+        if self.f is None:
+            self.f = open(self.path, "a", encoding="utf-8")
+        self.f.write("".join(json.dumps(r, ensure_ascii=False, sort_keys=True) + "\n" for r in records))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class StdoutSink(object):
+    def write(self, records):
+        for r in records:
+            sys.stdout.write(json.dumps(r, ensure_ascii=False, sort_keys=True) + "\n")
+        sys.stdout.flush()
+
+    def close(self):
+        pass
+
+
+class UnixSocketSink(object):
+    """NDJSON в потоковый unix-сокет локального получателя; при ошибке соединение открывается заново."""
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+
+    def write(self, records):
+        data = "".join(json.dumps(r, ensure_ascii=False, sort_keys=True) + "\n" for r in records).encode("utf-8")
+        try:
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
+                self.sock.connect(self.path)
+            self.sock.sendall(data)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def open_sink(spec):
+    """«-» — stdout, unix:/путь — unix-сокет, file:/путь или просто путь — файл NDJSON."""
+    if spec == "-":
+        return StdoutSink()
+    if spec.startswith("unix:"):
+        return UnixSocketSink(spec[len("unix:"):])
+    return FileSink(spec[len("file:"):] if spec.startswith("file:") else spec)
+
+
+class ExportReader(object):
+    def __init__(self, directory, sink, state_path=STATE_FILE, kinds=KINDS, window=WINDOW, lateness=LATENESS,
+                 max_keys=MAX_KEYS, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.sink = sink
+        self.state_path = state_path
+        self.kinds = set(k.strip() for k in kinds.split(",") if k.strip())
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.aggregator = WindowAggregator(window, lateness, max_keys)
+        self.files = {}
+        self.pending = []
+        self.stats = collections.Counter()
+        self.last_flush = time.time()
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("version") != STATE_VERSION:
+            return
+        for name, pos in state.get("files", {}).items():
+            self.files[name] = ExportFile(os.path.join(self.directory, name), pos.get("inode"), pos.get("offset", 0))
+        self.aggregator.load(state.get("aggregates", {}))
+
+    def save_state(self):
+        """Позиции файлов и открытые окна — атомарно (временный файл и os.replace)."""
+        state = {
+            "version": STATE_VERSION,
+            "files": {name: f.checkpoint() for name, f in sorted(self.files.items())},
+            "aggregates": self.aggregator.dump(),
+        }
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
+
+    def discover(self):
+        for path in glob.glob(os.path.join(self.directory, "*.ndjson")):
+            name = os.path.basename(path)
+            if name not in self.files and file_kind(name) in self.kinds:
+                self.files[name] = ExportFile(path)
+
+    def _lines(self, kind, lines):
+        self.stats["lines"] += len(lines)
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                self.stats["bad_lines"] += 1
+                continue
+            if kind == "history":
+                if "itemid" in rec and "clock" in rec:
+                    self.aggregator.add(rec)
+                else:
+                    self.stats["bad_lines"] += 1
+            else:
+                rec["kind"] = kind
+                self.pending.append(rec)
+        self.stats[kind] += len(lines)
+
+    def poll(self):
+        """
+        Один проход по файлам: порции читаются по очереди из всех файлов, пока есть данные, чтобы clock
+        в разных файлах history-syncer шли примерно вровень. Возвращает число прочитанных байт.
+        """
+        self.discover()
+        total = 0
+        # Приёмник недоступен: новые порции не читаются, пока очередь не уйдёт (память не растёт сверх пакета)
+        if len(self.pending) >= self.batch_size and not self.flush():
+            return 0
+        stalled = False
+        while not stalled:
+            read = 0
+            for name in sorted(self.files):
+                read += self.files[name].poll(self._lines)
+                self.pending.extend(self.aggregator.close_ready())
+                if len(self.pending) >= self.batch_size and not self.flush():
+                    stalled = True
+                    break
+            total += read
+            if not read:
+                break
+        self.stats["bytes"] += total
+        return total
+
+    def flush(self, now=None):
+        """Отправляет накопленное и сохраняет позиции. False — приёмник недоступен (данные остаются в очереди)."""
+        if now:
+            self.pending.extend(self.aggregator.close_ready(now))
+        if self.pending:
+            for i in range(0, len(self.pending), self.batch_size):
+                try:
+                    self.sink.write(self.pending[i:i + self.batch_size])
+                except OSError as e:
+                    del self.pending[:i]
+                    print("Приёмник недоступен (повтор позже): %s" % e, file=sys.stderr)
+                    return False
+            self.stats["sent"] += len(self.pending)
+            self.pending = []
+        self.save_state()
+        self.last_flush = time.time()
+        return True
+
+    def drain(self):
+        """Закрыть все открытые окна и отправить (завершение --once --drain)."""
+        self.pending.extend(self.aggregator.close_all())
+        return self.flush()
+
+    def run(self, poll_interval=POLL_INTERVAL, once=False):
+        while True:
+            read = self.poll()
+            now = time.time()
+            if once:
+                return self.flush()
+            # Без новых данных окна закрываются по часам, иначе последнее окно ждало бы следующего значения
+            if not read or now - self.last_flush >= self.flush_interval:
+                self.flush(now if not read else None)
+            time.sleep(poll_interval if not read else 0)
+
+    def summary(self):
+        lost = sum(f.lost for f in self.files.values())
+        rotations = sum(f.rotations for f in self.files.values())
+        skipped = sum(f.skipped_lines for f in self.files.values())
+        return ("прочитано %d байт, строк: history %d, trends %d, problems %d, ошибочных %d, пропущенных %d; "
+                "отправлено записей %d; ротаций %d, потерь при ротации %d; открытых окон %d" % (
+                    self.stats["bytes"], self.stats["history"], self.stats["trends"], self.stats["problems"],
+                    self.stats["bad_lines"], skipped, self.stats["sent"], rotations, lost, self.aggregator.keys))
+
+
+# --- генерация файлов экспорта (как их пишет сервер) и самопроверка ---
+
+class ExportWriter(object):
+    """Пишет NDJSON как сервер Zabbix: при достижении max_size файл переименовывается в .old (прежний .old удаляется)."""
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.f = open(path, "ab")
+
+    def write(self, rec):
+        self.f.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.f.flush()
+        if self.f.tell() >= self.max_size:
+            self.f.close()
+            os.replace(self.path, self.path + ".old")
+            self.f = open(self.path, "ab")
+
+    def close(self):
+        self.f.close()
+
+
+def generate_records(items, seconds, start, seed=1):
+    """Значения истории (float/unsigned/text) раз в 10 с на элемент и по событию в минуту, в порядке clock."""
+    rnd = random.Random(seed)
+    for t in range(start, start + seconds):
+        for itemid in range(1, items + 1):
+            if (t + itemid) % 10:
+                continue
+            vtype = (0, 3, 4)[itemid % 3]
+            value = round(rnd.uniform(0, 100), 4) if vtype == 0 else rnd.randint(0, 1000) if vtype == 3 else "state %d" % rnd.randint(0, 3)
+            yield "history", itemid, {
+                "host": {"host": "node-%d" % (itemid % 7), "name": "node-%d" % (itemid % 7)}, "groups": ["Visiology"],
+                "item_tags": [], "itemid": itemid, "name": "item %d" % itemid, "clock": t, "ns": rnd.randint(0, 999999999),
+                "value": value, "type": vtype,
+            }
+        if t % 60 == 0:
+            yield "problems", 0, {"clock": t, "ns": 0, "value": 1, "eventid": t, "name": "problem at %d" % t,
+                                  "severity": 2, "hosts": [{"host": "node-1", "name": "node-1"}], "groups": ["Visiology"], "tags": []}
+        if t % 3600 == 0:
+            for itemid in range(1, items + 1, 3):
+                yield "trends", itemid, {"host": {"host": "node-1", "name": "node-1"}, "itemid": itemid, "name": "item %d" % itemid,
+                                         "clock": t, "count": 360, "min": 0, "avg": 50, "max": 100, "type": 0}
+
+
+def generate(directory, items, seconds, start, syncers, max_size, seed=1):
+    """Файлы экспорта с несколькими history-syncer; возвращает итератор-писатель (для пошаговой записи)."""
+    writers = {}
+    try:
+        for kind, itemid, rec in generate_records(items, seconds, start, seed):
+            name = "%s-history-syncer-%d.ndjson" % (kind, itemid % syncers + 1)
+            if name not in writers:
+                writers[name] = ExportWriter(os.path.join(directory, name), max_size)
+            writers[name].write(rec)
+            yield rec
+    finally:
+        for w in writers.values():
+            w.close()
+
+
+def expected_aggregates(records, window):
+    out = {}
+    for rec in records:
+        if "itemid" not in rec or "count" in rec:
+            continue
+        key = (rec["itemid"], rec["clock"] - rec["clock"] % window)
+        agg = out.setdefault(key, {"count": 0})
+        agg["count"] += 1
+        if rec["type"] in NUMERIC_TYPES:
+            agg["sum"] = agg.get("sum", 0) + rec["value"]
+            agg["min"] = min(agg.get("min", rec["value"]), rec["value"])
+            agg["max"] = max(agg.get("max", rec["value"]), rec["value"])
+    return out
+
+
+def merge_output(path):
+    """Записи приёмника -> {(itemid, window_start): агрегат} с объединением частей одного окна."""
+    out = {}
+    counts = collections.Counter()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            counts[rec["kind"]] += 1
+            if rec["kind"] != "history":
+                continue
+            key = (rec["itemid"], rec["window_start"])
+            agg = out.setdefault(key, {"count": 0})
+            agg["count"] += rec["count"]
+            if "sum" in rec:
+                agg["sum"] = agg.get("sum", 0) + rec["sum"]
+                agg["min"] = min(agg.get("min", rec["min"]), rec["min"])
+                agg["max"] = max(agg.get("max", rec["max"]), rec["max"])
+    return out, counts
+
+
+class _DownSink(object):
+    """Приёмник, который всегда недоступен (самопроверка ограничения очереди)."""
+
+    def write(self, records):
+        raise OSError("приёмник недоступен")
+
+    def close(self):
+        pass
+
+
+def _check_partial_old(workdir):
+    """Файл повернут в .old с неполной последней строкой: читатель пропускает её и переходит к новому файлу."""
+    export_dir = os.path.join(workdir, "partial")
+    os.mkdir(export_dir)
+    path = os.path.join(export_dir, "history-history-syncer-1.ndjson")
+    rec = {"itemid": 1, "clock": 1700000000, "ns": 0, "value": 1.0, "type": 0}
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(rec) + "\n" + json.dumps(rec) + "\n" + '{"itemid": 1, "clo')
+    reader = ExportReader(export_dir, StdoutSink(), os.path.join(workdir, "partial.state.json"))
+    reader.poll()
+    os.replace(path, path + ".old")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(rec) + "\n")
+    for _ in range(3):
+        reader.poll()
+    ok = reader.stats["history"] == 3 and reader.files[os.path.basename(path)].skipped_lines == 1
+    print("Неполная строка в .old: %s (прочитано строк %d из 3)." % ("ok" if ok else "ОШИБКА", reader.stats["history"]))
+    return ok
+
+
+def _check_sink_down(workdir, batch_size=100):
+    """Приёмник недоступен: очередь не растёт дальше пакета и одной порции, файл не дочитывается вперёд."""
+    export_dir = os.path.join(workdir, "down")
+    os.mkdir(export_dir)
+    path = os.path.join(export_dir, "trends-history-syncer-1.ndjson")
+    line = json.dumps({"itemid": 1, "clock": 1700000000, "count": 360, "min": 0, "avg": 50, "max": 100, "type": 0,
+                       "name": "x" * 100}) + "\n"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(line * (4 * CHUNK_SIZE // len(line)))
+    reader = ExportReader(export_dir, _DownSink(), os.path.join(workdir, "down.state.json"), batch_size=batch_size)
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+    try:
+        for _ in range(5):
+            reader.poll()
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+    limit = batch_size + CHUNK_SIZE // len(line) + 1
+    ok = len(reader.pending) <= limit and reader.stats["bytes"] < os.path.getsize(path)
+    print("Недоступный приёмник: %s (в очереди %d записей, предел %d)." % ("ok" if ok else "ОШИБКА", len(reader.pending), limit))
+    return ok
+
+
+def selfcheck(items=300, seconds=1800, syncers=3, max_size=256 * 1024, window=60):
+    """
+    Запись файлов с ротацией вперемешку с чтением; на середине читатель «перезапускается» из файла состояния.
+    Итоговые агрегаты (после объединения частей) должны совпасть с рассчитанными по сгенерированным значениям.
+    Отдельно: неполная строка в конце .old и недоступный приёмник.
+    """
+    workdir = tempfile.mkdtemp(prefix="zabbix-export-")
+    try:
+        export_dir = os.path.join(workdir, "export")
+        os.mkdir(export_dir)
+        out_path = os.path.join(workdir, "out.ndjson")
+        state_path = os.path.join(workdir, "state.json")
+        records = []
+        reader = None
+        for i, rec in enumerate(generate(export_dir, items, seconds, 1699999200, syncers, max_size)):
+            records.append(rec)
+            if i % 1000 == 999:
+                if reader is None or i % 20000 == 19999:
+                    # Новый экземпляр читателя — как после перезапуска контейнера: только файл состояния
+                    reader = ExportReader(export_dir, FileSink(out_path), state_path, window=window, batch_size=500)
+                reader.poll()
+                reader.flush()
+        reader = ExportReader(export_dir, FileSink(out_path), state_path, window=window, batch_size=500)
+        reader.run(once=True)
+        reader.drain()
+        rotations = len(glob.glob(os.path.join(export_dir, "*.old")))
+        got, counts = merge_output(out_path)
+        want = expected_aggregates(records, window)
+        bad = [key for key in want if key not in got or got[key]["count"] != want[key]["count"]
+               or abs(got[key].get("sum", 0) - want[key].get("sum", 0)) > 1e-6 * max(1, abs(want[key].get("sum", 0)))
+               or got[key].get("min") != want[key].get("min") or got[key].get("max") != want[key].get("max")]
+        extra = [key for key in got if key not in want]
+        want_events = sum(1 for r in records if "eventid" in r)
+        want_trends = sum(1 for r in records if "count" in r and "itemid" in r)
+        print("Сгенерировано значений: %d, окон: %d; файлов .old после ротаций: %d." % (
+            len(records) - want_events - want_trends, len(want), rotations))
+        print("Получено записей: history %d (окон после объединения %d), problems %d, trends %d." % (
+            counts["history"], len(got), counts["problems"], counts["trends"]))
+        ok = not bad and not extra and counts["problems"] == want_events and counts["trends"] == want_trends
+        if not ok:
+            print("Расхождения: окон с ошибкой %d, лишних %d, событий %d из %d, trends %d из %d." % (
+                len(bad), len(extra), counts["problems"], want_events, counts["trends"], want_trends), file=sys.stderr)
+        ok = _check_partial_old(workdir) and ok
+        ok = _check_sink_down(workdir) and ok
+        print("Самопроверка: %s" % ("успешно" if ok else "ОШИБКА"))
+        return ok
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Потоковое чтение экспорта Zabbix в реальном времени с агрегацией по окнам.")
+    parser.add_argument("command", nargs="?", default="run", choices=("run", "generate", "selfcheck"),
+                        help="run — чтение (по умолчанию), generate — файлы экспорта для проверки, selfcheck — самопроверка")
+    parser.add_argument("--dir", default=EXPORT_DIR, help="каталог экспорта (ExportDir сервера, по умолчанию %(default)s)")
+    parser.add_argument("--state", default=STATE_FILE, help="файл состояния: позиции файлов и открытые окна")
+    parser.add_argument("--sink", default=SINK, help="приёмник: file:/путь, unix:/путь или - (stdout); по умолчанию %(default)s")
+    parser.add_argument("--kinds", default=KINDS, help="типы файлов через запятую (по умолчанию %(default)s)")
+    parser.add_argument("--window", type=int, default=WINDOW, help="длина окна агрегации, сек (по умолчанию %(default)s)")
+    parser.add_argument("--lateness", type=int, default=LATENESS, help="ожидание опоздавших значений, сек")
+    parser.add_argument("--max-keys", type=int, default=MAX_KEYS, help="предел открытых окон (элемент × окно)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="записей в пакете приёмнику")
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL, help="отправка не реже, сек")
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL, help="пауза без новых данных, сек")
+    parser.add_argument("--once", action="store_true", help="прочитать накопленное и выйти")
+    parser.add_argument("--drain", action="store_true", help="с --once: закрыть и отправить все открытые окна")
+    parser.add_argument("--items", type=int, default=300, help="generate: число элементов")
+    parser.add_argument("--seconds", type=int, default=1800, help="generate: сколько секунд истории")
+    parser.add_argument("--syncers", type=int, default=3, help="generate: число файлов history-syncer")
+    parser.add_argument("--rotate-size", type=int, default=1 << 20, help="generate: размер файла до ротации в .old, байт")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "selfcheck":
+        sys.exit(0 if selfcheck(window=args.window) else 1)
+    if args.command == "generate":
+        os.makedirs(args.dir, exist_ok=True)
+        count = sum(1 for _ in generate(args.dir, args.items, args.seconds, int(time.time()) - args.seconds,
+                                        args.syncers, args.rotate_size))
+        print("Записано %d записей в %s." % (count, args.dir))
+        return
+    sink = open_sink(args.sink)
+    reader = ExportReader(args.dir, sink, args.state, args.kinds, args.window, args.lateness, args.max_keys,
+                          args.batch, args.flush_interval)
+    try:
+        if args.once:
+            reader.run(once=True)
+            if args.drain:
+                reader.drain()
+        else:
+            print("Экспорт Zabbix: %s -> %s (окно %d с)" % (args.dir, args.sink, args.window), file=sys.stderr)
+            reader.run(args.poll)
+    except KeyboardInterrupt:
+        reader.flush()
+    finally:
+        sink.close()
+        print("Итог: %s." % reader.summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (RuntimeError, OSError) as e:
+        print("Ошибка: %s" % e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,769 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Стенд для замера стоимости zabbix-init-config.py без живого Zabbix.
+В процессе стенда поднимается имитация api_jsonrpc.php (хранит группы, шаблоны, хосты, элементы, триггеры,
+обнаружение, дашборды и отвечает объектами в формате Zabbix 7.4 с учётом output), при необходимости — с задержкой
+на каждый запрос. zabbix-init-config.py запускается отдельным процессом в сценариях:
+  fresh — первая настройка хоста на пустом сервере;
+  rerun — повторный запуск на уже настроенном сервере (идемпотентность);
+  fleet — парк из N хостов по инвентарю (--hosts, --concurrency);
+  bundle — --bundle по тому же инвентарю: импорт пакета и привязка шаблона к новым и существующим хостам
+           (один существующий хост уже настроен без шаблона и должен быть пропущен).
+По каждому сценарию замеряются вызовы API по методам, байты запросов и ответов, общее время и пиковая память
+процесса скрипта. Результат пишется в JSON; с --baseline сравнивается с прошлым прогоном (рост числа вызовов или
+времени сверх допуска — код возврата 1).
+Запуск:
+  python3 zabbix-init-bench.py
+  python3 zabbix-init-bench.py --hosts 50 --latency 20 --output bench.json
+  python3 zabbix-init-bench.py --baseline bench-main.json --tolerance 0.2
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import csv
+import gzip
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zabbix-init-config.py")
+SCENARIOS = ("fresh", "rerun", "fleet", "bundle")
+# Стандартные шаблоны с элементами: при привязке к хосту они наследуются (templateid != 0), как на живом сервере
+TEMPLATE_ITEMS = {
+    "Linux by Zabbix agent 2": 70,
+    "Docker by Zabbix agent 2": 40,
+}
+# Хост самого сервера с шаблоном «Zabbix server health» (внутренние элементы), как в новой БД Zabbix
+SERVER_HOST = "Zabbix server"
+SERVER_HEALTH_KEYS = [
+    "zabbix[process,%s,avg,busy]" % p
+    for p in ("poller", "agent poller", "unreachable poller", "trapper", "preprocessing worker", "lld worker",
+              "history syncer", "configuration syncer", "housekeeper", "alert manager")
+] + ["zabbix[wcache,history,pused]", "zabbix[wcache,index,pused]", "zabbix[wcache,trend,pused]",
+     "zabbix[rcache,buffer,pused]", "zabbix[vcache,buffer,pused]", "zabbix[wcache,values]", "zabbix[queue]",
+     "zabbix[queue,10m]", "zabbix[preprocessing_queue]"]
+GZIP_MIN_SIZE = 1024
+
+
+class ApiError(Exception):
+    def __init__(self, code, message, data=""):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+def _strings(obj):
+    """Числа в ответах API Zabbix — строки; вложенные списки и объекты обрабатываются рекурсивно."""
+    if isinstance(obj, dict):
+        return dict((k, _strings(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [_strings(v) for v in obj]
+    if isinstance(obj, bool) or obj is None:
+        return obj
+    return str(obj)
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    return value if isinstance(value, list) else [value]
+
+
+def _output(obj, output):
+    """Поля объекта по параметру output (список полей или "extend")."""
+    if isinstance(output, list):
+        return dict((k, obj[k]) for k in output if k in obj)
+    return dict(obj)
+
+
+def _match_filter(obj, flt):
+    for field, wanted in (flt or {}).items():
+        if str(obj.get(field)) not in [str(v) for v in _as_list(wanted)]:
+            return False
+    return True
+
+
+def _match_search(obj, search, any_field=False):
+    if not search:
+        return True
+    hits = []
+    for field, patterns in search.items():
+        value = str(obj.get(field, "")).lower()
+        hits.append(any(str(p).lower() in value for p in _as_list(patterns)))
+    return any(hits) if any_field else all(hits)
+
+
+class MockZabbix(object):
+    """Состояние и обработчики методов имитации API. Все методы вызываются под self.lock."""
+
+    ITEM_DEFAULTS = {
+        "type": 0, "value_type": 3, "delay": "1m", "units": "", "history": "31d", "trends": "365d",
+        "templateid": "0", "master_itemid": "0", "interfaceid": "0", "status": 0, "description": "",
+        "preprocessing": [],
+    }
+
+    def __init__(self, latency=0.0, compress=True):
+        self.latency = latency
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.ids = itertools.count(10001)
+        self.groups = {}
+        self.templates = {}
+        self.template_items = {}
+        self.hosts = {}
+        self.interfaces = {}
+        self.items = {}
+        self.triggers = {}
+        self.rules = {}
+        self.prototypes = {}
+        self.trigger_prototypes = {}
+        self.dashboards = {}
+        self.actions = {}
+        self.proxies = {}
+        self.template_rules = {}
+        self._import_rules = {}
+        self.imported = collections.Counter()
+        self.import_dropped = collections.Counter()
+        self.sessions = set()
+        self.tokens = {}
+        self.housekeeping = {
+            "hk_events_mode": "1", "hk_events_trigger": "365d", "hk_sessions_mode": "1", "hk_sessions": "365d",
+            "hk_history_mode": "1", "hk_history_global": "0", "hk_history": "31d",
+            "hk_trends_mode": "1", "hk_trends_global": "0", "hk_trends": "365d",
+            "db_extension": "", "compression_status": "0", "compress_older": "7d", "compression_availability": "0",
+        }
+        for name, count in TEMPLATE_ITEMS.items():
+            tid = self.nid()
+            self.templates[tid] = {"templateid": tid, "host": name, "name": name, "description": "", "uuid": tid}
+            self.template_items[tid] = [
+                dict(self.ITEM_DEFAULTS, key_="%s.item[%d]" % (name.split()[0].lower(), i), name="%s item %d" % (name, i))
+                for i in range(count)
+            ]
+        tid = self.nid()
+        self.templates[tid] = {"templateid": tid, "host": "Zabbix server health", "name": "Zabbix server health",
+                               "description": "", "uuid": tid}
+        self.template_items[tid] = [dict(self.ITEM_DEFAULTS, type=5, key_=key, name=key) for key in SERVER_HEALTH_KEYS]
+        self.m_host_create({"host": SERVER_HOST, "templates": [{"templateid": tid}]})
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.calls = collections.Counter()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.json_bytes_received = 0
+
+    def nid(self):
+        return str(next(self.ids))
+
+    def _new_item(self, params, store, extra=None):
+        itemid = self.nid()
+        item = dict(self.ITEM_DEFAULTS, **params)
+        item.update(extra or {})
+        item["itemid"] = itemid
+        store[itemid] = _strings(item)
+        return itemid
+
+    def handle(self, method, p, auth):
+        if method not in ("apiinfo.version", "user.login", "user.checkAuthentication"):
+            if auth not in self.sessions and not any(t["token"] == auth for t in self.tokens.values()):
+                raise ApiError(-32602, "Invalid params.", "Session terminated, re-login, please.")
+        handler = getattr(self, "m_" + method.replace(".", "_"), None)
+        if handler is None:
+            raise ApiError(-32601, "Method not found.", 'Incorrect API "%s".' % method)
+        return handler(p)
+
+    # --- авторизация и справочники ---
+
+    def m_apiinfo_version(self, p):
+        return "7.4.0"
+
+    def m_user_login(self, p):
+        session = "%032x" % next(self.ids)
+        self.sessions.add(session)
+        return session
+
+    def m_user_logout(self, p):
+        return True
+
+    def m_user_checkAuthentication(self, p):
+        if p.get("sessionid") in self.sessions or any(t["token"] == p.get("token") for t in self.tokens.values()):
+            return {"userid": "1", "username": "Admin", "type": "3"}
+        raise ApiError(-32602, "Invalid params.", "Session terminated, re-login, please.")
+
+    def m_token_get(self, p):
+        return [_output(t, p.get("output")) for t in self.tokens.values() if _match_filter(t, p.get("filter"))]
+
+    def m_token_create(self, p):
+        tid = self.nid()
+        self.tokens[tid] = _strings(dict(p, tokenid=tid, token=""))
+        return {"tokenids": [tid]}
+
+    def m_token_generate(self, p):
+        for tid in p:
+            self.tokens[str(tid)]["token"] = "%064x" % next(self.ids)
+        return [{"tokenid": str(tid), "token": self.tokens[str(tid)]["token"]} for tid in p]
+
+    def m_token_delete(self, p):
+        for tid in p:
+            self.tokens.pop(str(tid), None)
+        return {"tokenids": [str(tid) for tid in p]}
+
+    def m_user_get(self, p):
+        return [_output({"userid": "1", "username": "Admin", "name": "Zabbix", "surname": "Administrator"}, p.get("output"))]
+
+    def m_hostgroup_get(self, p):
+        return [_output(g, p.get("output")) for g in self.groups.values() if _match_filter(g, p.get("filter"))]
+
+    def m_hostgroup_create(self, p):
+        if any(g["name"] == p["name"] for g in self.groups.values()):
+            raise ApiError(-32602, "Invalid params.", 'Host group "%s" already exists.' % p["name"])
+        gid = self.nid()
+        self.groups[gid] = {"groupid": gid, "name": p["name"], "flags": "0", "uuid": gid}
+        return {"groupids": [gid]}
+
+    def m_template_get(self, p):
+        return [
+            _output(t, p.get("output")) for t in self.templates.values()
+            if _match_filter(t, p.get("filter")) and _match_search(t, p.get("search"), p.get("searchByAny"))
+        ]
+
+    def m_housekeeping_get(self, p):
+        return _output(self.housekeeping, p.get("output"))
+
+    def m_housekeeping_update(self, p):
+        self.housekeeping.update(_strings(p))
+        return list(p)
+
+    def m_action_get(self, p):
+        out = []
+        for action in self.actions.values():
+            if _match_filter(action, p.get("filter")):
+                row = _output(action, p.get("output"))
+                if p.get("selectFilter"):
+                    row["filter"] = action["filter"]
+                if p.get("selectOperations"):
+                    row["operations"] = action["operations"]
+                out.append(row)
+        return out
+
+    def m_action_create(self, p):
+        if any(a["name"] == p["name"] for a in self.actions.values()):
+            raise ApiError(-32602, "Invalid params.", 'Action "%s" already exists.' % p["name"])
+        aid = self.nid()
+        self.actions[aid] = dict(_strings(p), actionid=aid)
+        return {"actionids": [aid]}
+
+    def m_action_update(self, p):
+        self.actions[str(p["actionid"])].update(_strings(p))
+        return {"actionids": [str(p["actionid"])]}
+
+    # --- хосты ---
+
+    def m_host_get(self, p):
+        hostids = _as_list(p.get("hostids"))
+        return [
+            _output(h, p.get("output")) for h in self.hosts.values()
+            if _match_filter(h, p.get("filter")) and (hostids is None or h["hostid"] in map(str, hostids))
+        ]
+
+    def m_host_create(self, p):
+        if any(h["host"] == p["host"] for h in self.hosts.values()):
+            raise ApiError(-32602, "Invalid params.", 'Host with the same name "%s" already exists.' % p["host"])
+        hostid = self.nid()
+        self.hosts[hostid] = {
+            "hostid": hostid, "host": p["host"], "name": p.get("name", p["host"]), "status": "0", "flags": "0",
+            "description": "", "monitored_by": "0", "proxyid": "0", "inventory_mode": "-1", "ipmi_authtype": "-1",
+            "tls_connect": "1", "tls_accept": "1", "maintenance_status": "0", "active_available": "0",
+        }
+        self.hosts[hostid].update(_strings(dict((k, p[k]) for k in ("monitored_by", "proxyid") if k in p)))
+        for iface in p.get("interfaces", []):
+            iid = self.nid()
+            self.interfaces[iid] = _strings(dict(iface, interfaceid=iid, hostid=hostid, available=0, error=""))
+        for tpl in p.get("templates", []):
+            self._link_template(hostid, str(tpl["templateid"]))
+        return {"hostids": [hostid]}
+
+    def m_host_update(self, p):
+        self.hosts[str(p["hostid"])].update(_strings(dict((k, v) for k, v in p.items() if k not in ("groups", "templates"))))
+        return {"hostids": [str(p["hostid"])]}
+
+    def m_proxy_get(self, p):
+        out = []
+        for proxy in self.proxies.values():
+            if _match_filter(proxy, p.get("filter")):
+                row = _output(proxy, p.get("output"))
+                if p.get("selectHosts"):
+                    row["hosts"] = [_output(h, p["selectHosts"]) for h in self.hosts.values()
+                                    if h["monitored_by"] == "1" and h["proxyid"] == proxy["proxyid"]]
+                out.append(row)
+        return out
+
+    def m_proxy_create(self, p):
+        if any(x["name"] == p["name"] for x in self.proxies.values()):
+            raise ApiError(-32602, "Invalid params.", 'Proxy "%s" already exists.' % p["name"])
+        pid = self.nid()
+        self.proxies[pid] = dict(_strings(p), proxyid=pid)
+        return {"proxyids": [pid]}
+
+    def _check_link(self, hostid, templateid):
+        """Как в Zabbix: ключ шаблона, уже занятый на хосте элементом не из этого шаблона, — ошибка привязки."""
+        keys = {spec["key_"] for spec in self.template_items.get(templateid, [])}
+        keys.update(rule["key"] for rule in self.template_rules.get(templateid, []))
+        for it in list(self.items.values()) + list(self.rules.values()):
+            if it["hostid"] == hostid and it["key_"] in keys and it["templateid"] != templateid:
+                raise ApiError(-32602, "Invalid params.", 'Cannot inherit item with key "%s" of template "%s" to host '
+                               '"%s", because an item with the same key already exists.' % (
+                                   it["key_"], self.templates[templateid]["host"], self.hosts[hostid]["host"]))
+
+    def _link_template(self, hostid, templateid):
+        self._check_link(hostid, templateid)
+        for spec in self.template_items.get(templateid, []):
+            if not any(it["hostid"] == hostid and it["key_"] == spec["key_"] for it in self.items.values()):
+                self._new_item(spec, self.items, {"hostid": hostid, "templateid": templateid})
+
+    def m_host_massadd(self, p):
+        # Проверка до изменений: одна ошибка отклоняет весь вызов
+        for h in p.get("hosts", []):
+            for tpl in p.get("templates", []):
+                self._check_link(str(h["hostid"]), str(tpl["templateid"]))
+        for h in p.get("hosts", []):
+            for tpl in p.get("templates", []):
+                self._link_template(str(h["hostid"]), str(tpl["templateid"]))
+        return {"hostids": [str(h["hostid"]) for h in p.get("hosts", [])]}
+
+    def m_hostinterface_get(self, p):
+        hostids = [str(h) for h in _as_list(p.get("hostids"))]
+        return [_output(i, p.get("output")) for i in self.interfaces.values() if i["hostid"] in hostids]
+
+    def m_hostinterface_update(self, p):
+        self.interfaces[str(p["interfaceid"])].update(_strings(p))
+        return {"interfaceids": [str(p["interfaceid"])]}
+
+    # --- элементы, триггеры, обнаружение ---
+
+    def _get_items(self, store, p, owner_field, owner_ids):
+        owners = [str(x) for x in _as_list(owner_ids)]
+        out = []
+        for it in store.values():
+            if it.get(owner_field) in owners and _match_filter(it, p.get("filter")):
+                row = _output(it, p.get("output"))
+                if p.get("selectPreprocessing"):
+                    row["preprocessing"] = it.get("preprocessing", [])
+                out.append(row)
+        return out
+
+    def _check_master(self, p):
+        if str(p.get("type")) == "18" and str(p.get("master_itemid", "0")) not in self.items:
+            raise ApiError(-32602, "Invalid params.", 'Incorrect value for field "master_itemid".')
+
+    def m_item_get(self, p):
+        return self._get_items(self.items, p, "hostid", p.get("hostids"))
+
+    def m_item_create(self, p):
+        ids = []
+        for x in _as_list(p):
+            if any(it["hostid"] == str(x["hostid"]) and it["key_"] == x["key_"] for it in self.items.values()):
+                raise ApiError(-32602, "Invalid params.", 'An item with key "%s" already exists.' % x["key_"])
+            self._check_master(x)
+            ids.append(self._new_item(x, self.items))
+        return {"itemids": ids}
+
+    def m_item_update(self, p):
+        for x in _as_list(p):
+            self.items[str(x["itemid"])].update(_strings(x))
+        return {"itemids": [str(x["itemid"]) for x in _as_list(p)]}
+
+    def m_trigger_get(self, p):
+        hostids = [str(h) for h in _as_list(p.get("hostids"))]
+        return [
+            _output(t, p.get("output")) for t in self.triggers.values()
+            if t["hostid"] in hostids and _match_search(t, p.get("search"), p.get("searchByAny"))
+        ]
+
+    def _trigger_host(self, expression):
+        host = expression.split("/")[1]
+        for h in self.hosts.values():
+            if h["host"] == host:
+                return h["hostid"]
+        raise ApiError(-32602, "Invalid params.", 'Incorrect trigger expression. Host "%s" does not exist.' % host)
+
+    def m_trigger_create(self, p):
+        ids = []
+        for x in _as_list(p):
+            tid = self.nid()
+            self.triggers[tid] = _strings(dict(x, triggerid=tid, hostid=self._trigger_host(x["expression"]), status=0))
+            ids.append(tid)
+        return {"triggerids": ids}
+
+    def m_trigger_update(self, p):
+        self.triggers[str(p["triggerid"])].update(_strings(p))
+        return {"triggerids": [str(p["triggerid"])]}
+
+    def m_discoveryrule_get(self, p):
+        rules = self._get_items(self.rules, p, "hostid", p.get("hostids"))
+        if p.get("selectTriggers"):
+            for r in rules:
+                r["triggers"] = [
+                    {"triggerid": t["triggerid"]} for t in self.trigger_prototypes.values() if t["ruleid"] == r["itemid"]
+                ]
+        return rules
+
+    def m_discoveryrule_create(self, p):
+        self._check_master(p)
+        return {"itemids": [self._new_item(p, self.rules)]}
+
+    def m_discoveryrule_update(self, p):
+        self.rules[str(p["itemid"])].update(_strings(p))
+        return {"itemids": [str(p["itemid"])]}
+
+    def m_itemprototype_get(self, p):
+        return self._get_items(self.prototypes, p, "ruleid", p.get("discoveryids"))
+
+    def m_itemprototype_create(self, p):
+        ids = []
+        for x in _as_list(p):
+            self._check_master(x)
+            ids.append(self._new_item(x, self.prototypes))
+        return {"itemids": ids}
+
+    def m_itemprototype_update(self, p):
+        for x in _as_list(p):
+            self.prototypes[str(x["itemid"])].update(_strings(x))
+        return {"itemids": [str(x["itemid"]) for x in _as_list(p)]}
+
+    def m_triggerprototype_create(self, p):
+        ids = []
+        for x in _as_list(p):
+            hostid = self._trigger_host(x["expression"])
+            ruleid = next((r["itemid"] for r in self.rules.values() if r["hostid"] == hostid), "0")
+            tid = self.nid()
+            self.trigger_prototypes[tid] = _strings(dict(x, triggerid=tid, ruleid=ruleid))
+            ids.append(tid)
+        return {"triggerids": ids}
+
+    # --- дашборды ---
+
+    def _store_pages(self, pages, old=()):
+        # Страница с dashboard_pageid без widgets сохраняет свои виджеты, как в dashboard.update
+        old = {p["dashboard_pageid"]: p for p in old}
+        stored = []
+        for page in pages:
+            if "widgets" not in page and str(page.get("dashboard_pageid")) in old:
+                stored.append(old[str(page["dashboard_pageid"])])
+                continue
+            widgets = []
+            for w in page.get("widgets", []):
+                w = dict(w)
+                w.setdefault("widgetid", self.nid())
+                w.setdefault("view_mode", 0)
+                w["fields"] = [
+                    dict(f, type=str(f["type"]), value=f["value"] if isinstance(f["value"], dict) else str(f["value"]))
+                    for f in w.get("fields", [])
+                ]
+                widgets.append(dict(_strings(dict((k, v) for k, v in w.items() if k != "fields")), fields=w["fields"]))
+            stored.append(dict(page, dashboard_pageid=str(page.get("dashboard_pageid") or self.nid()), widgets=widgets,
+                               name=page.get("name", ""), display_period=str(page.get("display_period", 0))))
+        return stored
+
+    def m_dashboard_get(self, p):
+        out = []
+        for d in self.dashboards.values():
+            if _match_filter(d, p.get("filter")):
+                row = _output(d, p.get("output"))
+                if p.get("selectPages"):
+                    row["pages"] = json.loads(json.dumps(d["pages"]))
+                out.append(row)
+        return out
+
+    def m_dashboard_create(self, p):
+        did = self.nid()
+        self.dashboards[did] = dict(_strings(dict((k, v) for k, v in p.items() if k != "pages")),
+                                    dashboardid=did, pages=self._store_pages(p.get("pages", [])))
+        return {"dashboardids": [did]}
+
+    def m_dashboard_update(self, p):
+        d = self.dashboards[str(p["dashboardid"])]
+        if "pages" in p:
+            d["pages"] = self._store_pages(p["pages"], d["pages"])
+        return {"dashboardids": [str(p["dashboardid"])]}
+
+    # --- импорт пакета (--bundle) ---
+
+    # Раздел экспорта -> правило configuration.import
+    IMPORT_RULES = {
+        "template_groups": "template_groups", "templates": "templates", "items": "items", "triggers": "triggers",
+        "discovery_rules": "discoveryRules", "dashboards": "templateDashboards",
+    }
+
+    def _import_section(self, section, objects, exists=False):
+        """Как в Zabbix: раздел без правила (или с выключенными createMissing/updateExisting) молча пропускается."""
+        flags = self._import_rules.get(self.IMPORT_RULES[section]) or {}
+        if flags.get("updateExisting" if exists else "createMissing"):
+            self.imported[section] += len(objects)
+            return objects
+        self.import_dropped[section] += len(objects)
+        return []
+
+    def m_configuration_import(self, p):
+        self._import_rules = p.get("rules", {})
+        export = json.loads(p["source"])["zabbix_export"]
+        self._import_section("template_groups", export.get("template_groups", []))
+        for tpl in export.get("templates", []):
+            found = [t for t in self.templates.values() if t["host"] == tpl["template"]]
+            if not self._import_section("templates", [tpl], bool(found)):
+                continue
+            tid = found[0]["templateid"] if found else self.nid()
+            self.templates[tid] = {"templateid": tid, "host": tpl["template"], "name": tpl["name"],
+                                   "description": tpl.get("description", ""), "uuid": tpl["uuid"]}
+            items = self._import_section("items", tpl.get("items", []), bool(found))
+            self._import_section("triggers", [t for it in items for t in it.get("triggers", [])], bool(found))
+            self.template_items[tid] = [dict(self.ITEM_DEFAULTS, key_=it["key"], name=it["name"]) for it in items]
+            self.template_rules[tid] = self._import_section("discovery_rules", tpl.get("discovery_rules", []), bool(found))
+            self._import_section("dashboards", tpl.get("dashboards", []), bool(found))
+        return True
+
+
+def serve(mock):
+    """HTTP/1.1 keep-alive сервер с /api_jsonrpc.php на свободном порту 127.0.0.1; возвращает сервер."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Заголовки и тело ответа уходят отдельными записями: без TCP_NODELAY задержанный ACK добавлял бы ~40 мс
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = gzip.decompress(raw) if self.headers.get("Content-Encoding") == "gzip" else raw
+            request = json.loads(body.decode("utf-8"))
+            if mock.latency:
+                time.sleep(mock.latency)
+            auth = (self.headers.get("Authorization") or "").replace("Bearer ", "") or request.get("auth")
+            with mock.lock:
+                mock.calls[request["method"]] += 1
+                try:
+                    result = mock.handle(request["method"], request.get("params"), auth)
+                    response = {"jsonrpc": "2.0", "result": result, "id": request.get("id")}
+                except ApiError as e:
+                    response = {"jsonrpc": "2.0", "error": {"code": e.code, "message": e.message, "data": e.data},
+                                "id": request.get("id")}
+            out = json.dumps(response, ensure_ascii=False).encode("utf-8")
+            json_size = len(out)
+            compressed = mock.compress and "gzip" in (self.headers.get("Accept-Encoding") or "") and len(out) >= GZIP_MIN_SIZE
+            if compressed:
+                out = gzip.compress(out)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            if compressed:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+            with mock.lock:
+                mock.requests += 1
+                mock.bytes_sent += len(raw)
+                mock.bytes_received += len(out)
+                mock.json_bytes_received += json_size
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_client(port, workdir, args, env_extra=None, verbose=False):
+    """
+    Запуск zabbix-init-config.py отдельным процессом; возвращает (код возврата, секунды, пиковая память КБ).
+    Пиковая память — ru_maxrss именно этого процесса (os.wait4), без памяти стенда и имитации сервера.
+    """
+    env = dict(os.environ)
+    env.update({
+        "ZABBIX_INIT_NO_ENV_FILE": "1",
+        "ZABBIX_URL": "http://127.0.0.1:%d" % port,
+        "ZABBIX_USER": "Admin",
+        "ZABBIX_PASSWORD": "zabbix",
+        "ZABBIX_STATE_FILE": os.path.join(workdir, "state.json"),
+    })
+    env.update(env_extra or {})
+    out = None if verbose else subprocess.DEVNULL
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, SCRIPT] + list(args), env=env, stdout=out, stderr=out)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8
+    return proc.returncode, elapsed, usage.ru_maxrss
+
+
+def write_inventory(path, hosts):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["host", "ip", "port"])
+        for i in range(hosts):
+            writer.writerow(["bench-host-%04d" % i, "10.%d.%d.%d" % (i // 65536, i // 256 % 256, i % 256), "10050"])
+
+
+def measure(mock, port, workdir, args, env_extra=None, verbose=False):
+    mock.reset_stats()
+    code, elapsed, rss = run_client(port, workdir, args, env_extra, verbose)
+    return {
+        "ok": code == 0,
+        "exit_code": code,
+        "wall_s": round(elapsed, 4),
+        "peak_rss_kb": rss,
+        "calls_total": sum(mock.calls.values()),
+        "calls": dict(sorted(mock.calls.items())),
+        "http_requests": mock.requests,
+        "bytes_sent": mock.bytes_sent,
+        "bytes_received": mock.bytes_received,
+        "json_bytes_received": mock.json_bytes_received,
+    }
+
+
+def run_scenarios(args):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="zabbix-init-bench-")
+    try:
+        if "fresh" in args.scenario or "rerun" in args.scenario:
+            mock = MockZabbix(args.latency / 1000.0, not args.no_gzip)
+            server = serve(mock)
+            port = server.server_address[1]
+            single = os.path.join(workdir, "single")
+            os.mkdir(single)
+            fresh = measure(mock, port, single, [], verbose=args.verbose)
+            if "fresh" in args.scenario:
+                results["fresh"] = fresh
+            if "rerun" in args.scenario:
+                results["rerun"] = measure(mock, port, single, [], verbose=args.verbose)
+            server.shutdown()
+        if "fleet" in args.scenario:
+            mock = MockZabbix(args.latency / 1000.0, not args.no_gzip)
+            server = serve(mock)
+            fleet = os.path.join(workdir, "fleet")
+            os.mkdir(fleet)
+            inventory = os.path.join(fleet, "hosts.csv")
+            write_inventory(inventory, args.hosts)
+            results["fleet"] = measure(
+                mock, server.server_address[1], fleet, ["--inventory", inventory, "--concurrency", str(args.concurrency)],
+                {"ZBX_HOSTNAME": "bench-host-0000"}, args.verbose)
+            results["fleet"]["hosts"] = args.hosts
+            server.shutdown()
+        if "bundle" in args.scenario:
+            mock = MockZabbix(args.latency / 1000.0, not args.no_gzip)
+            server = serve(mock)
+            bundle = os.path.join(workdir, "bundle")
+            os.mkdir(bundle)
+            inventory = os.path.join(bundle, "hosts.csv")
+            write_inventory(inventory, args.hosts)
+            # Половина хостов уже есть: им шаблон добавляется host.massadd, остальные создаются сразу с ним
+            for i in range(0, args.hosts, 2):
+                mock.m_host_create({"host": "bench-host-%04d" % i, "interfaces": [
+                    {"type": 1, "main": 1, "useip": 1, "ip": "127.0.0.1", "dns": "", "port": "10050"}]})
+            # Один из них уже настроен обычным запуском: элементы с ключами шаблона созданы напрямую
+            conflicted = next(h["hostid"] for h in mock.hosts.values() if h["host"] == "bench-host-0000")
+            mock._new_item({"key_": "docker.services.list", "name": "docker.services.list"}, mock.items, {"hostid": conflicted})
+            mock._new_item({"key_": "docker.services.discovery", "name": "docker.services.discovery", "type": 18},
+                           mock.rules, {"hostid": conflicted})
+            r = results["bundle"] = measure(
+                mock, server.server_address[1], bundle,
+                ["--bundle", "--inventory", inventory, "--concurrency", str(args.concurrency)],
+                {"ZBX_HOSTNAME": "bench-host-0000"}, args.verbose)
+            tid = next((t["templateid"] for t in mock.templates.values() if t["host"] == "Visiology"), None)
+            linked = {it["hostid"] for it in mock.items.values() if tid and it.get("templateid") == tid}
+            r.update({"hosts": args.hosts, "hosts_with_template": len(linked),
+                      "imported": dict(mock.imported), "import_dropped": dict(mock.import_dropped)})
+            # Пропущенный раздел пакета (нет правила импорта) или хост без шаблона — ошибка сценария. Хост с
+            # элементами, созданными напрямую, должен быть пропущен (код возврата 1), а остальные — получить шаблон.
+            r["ok"] = (r["exit_code"] == 1 and not mock.import_dropped and conflicted not in linked
+                       and len(linked) == args.hosts - 1)
+            server.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def print_results(results):
+    print("%-8s %4s %9s %10s %7s %12s %12s" % ("сценарий", "ok", "время, с", "память, КБ", "вызовы", "отправлено", "получено"))
+    for name, r in results.items():
+        print("%-8s %4s %9.3f %10d %7d %12d %12d" % (
+            name, "да" if r["ok"] else "нет", r["wall_s"], r["peak_rss_kb"], r["calls_total"], r["bytes_sent"],
+            r["bytes_received"]))
+    for name, r in results.items():
+        print("%s: %s" % (name, ", ".join("%s=%d" % kv for kv in sorted(r["calls"].items(), key=lambda kv: -kv[1]))))
+
+
+def compare(results, baseline, tolerance):
+    """Регрессии относительно прошлого прогона: больше вызовов API (по методам) или время больше допуска."""
+    problems = []
+    for name, r in results.items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for method, n in sorted(r["calls"].items()):
+            if n > old["calls"].get(method, 0):
+                problems.append("%s: %s — %d вызовов (было %d)" % (name, method, n, old["calls"].get(method, 0)))
+        if r["wall_s"] > old["wall_s"] * (1 + tolerance):
+            problems.append("%s: время %.3f с (было %.3f с, допуск %d%%)" % (name, r["wall_s"], old["wall_s"], tolerance * 100))
+        if r["ok"] != old["ok"]:
+            problems.append("%s: завершение %s (было %s)" % (name, r["ok"], old["ok"]))
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Замер вызовов API, трафика, времени и памяти zabbix-init-config.py на имитации Zabbix.")
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="сценарии (по умолчанию все)")
+    parser.add_argument("--hosts", type=int, default=20, help="хостов в сценарии fleet (по умолчанию 20)")
+    parser.add_argument("--concurrency", type=int, default=8, help="--concurrency скрипта в сценарии fleet (по умолчанию 8)")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа имитации на каждый запрос, мс (по умолчанию 0)")
+    parser.add_argument("--no-gzip", action="store_true", help="не сжимать ответы (по умолчанию gzip при Accept-Encoding, как nginx)")
+    parser.add_argument("--output", default="zabbix-init-bench.json", help="файл результатов JSON (по умолчанию zabbix-init-bench.json)")
+    parser.add_argument("--baseline", metavar="FILE", help="прошлый результат: сравнить и вернуть 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допуск роста времени для --baseline (по умолчанию 0.25)")
+    parser.add_argument("--verbose", action="store_true", help="показывать вывод zabbix-init-config.py")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_scenarios(args)
+    report = {
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "latency_ms": args.latency,
+        "gzip": not args.no_gzip,
+        "scenarios": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_results(results)
+    print("Результаты записаны в %s" % args.output)
+    failed = [name for name, r in results.items() if not r["ok"]]
+    if failed:
+        print("Сценарии завершились с ошибкой: %s (запустите с --verbose)" % ", ".join(failed), file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for line in problems:
+            print("Регрессия: %s" % line, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+        print("Регрессий относительно %s нет." % args.baseline)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,17 +9,27 @@
 """
 from __future__ import print_function
 
+import argparse
+import contextlib
+import csv
+import gzip
+import hashlib
+import http.client
 import json
 import os
 import sys
+import threading
 import time
-import urllib.request
-import urllib.error
+import urllib.parse
+import uuid
 import ssl
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
-# Загрузка переменных из .env (если файл есть)
+# Загрузка переменных из .env (если файл есть). ZABBIX_INIT_NO_ENV_FILE=1 — только окружение процесса (стенд, CI)
 for _env_file in ("zabbix-init-config.local.env", "zabbix-init-config.env"):
     _path = os.path.join(os.path.dirname(os.path.abspath(__file__)), _env_file)
+    if os.environ.get("ZABBIX_INIT_NO_ENV_FILE") == "1":
+        break
     if os.path.isfile(_path):
         with open(_path, "r", encoding="utf-8") as f:
             for line in f:
@@ -51,7 +61,27 @@ TRIGGER_EXPRESSION_TEMPLATE = "last(/{host}/vfs.fs.size[/hostfs,pfree])<25"
 TRIGGER_PRIORITY = 3  # Warning
 
 API_URL = ZABBIX_URL + "/api_jsonrpc.php"
-REQUEST_HEADERS = {"Content-Type": "application/json"}
+REQUEST_HEADERS = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+
+# Параметры HTTP-клиента API: таймаут, число повторов для *.get и предел паузы между повторами.
+API_TIMEOUT = float(env("ZABBIX_API_TIMEOUT", "30"))
+API_RETRIES = int(env("ZABBIX_API_RETRIES", "3"))
+API_BACKOFF = float(env("ZABBIX_API_BACKOFF", "0.5"))
+API_BACKOFF_MAX = float(env("ZABBIX_API_BACKOFF_MAX", "8"))
+# Сжатие тела запроса (Content-Encoding: gzip). Стандартный nginx/PHP фронтенда Zabbix тело не распаковывает,
+# поэтому включайте только за прокси, который это умеет. Ответы в gzip принимаются всегда.
+API_GZIP = env("ZABBIX_API_GZIP", "0") == "1"
+API_GZIP_MIN_SIZE = 1024
+# Коды HTTP, при которых запрос можно повторить (прокси/фронтенд временно недоступен)
+RETRY_HTTP_CODES = (502, 503, 504)
+# Изменяющие запросы не отправляются по соединению, простаивавшему дольше (nginx закрывает keep-alive по таймауту,
+# а повторить такой запрос после обрыва нельзя — сервер мог его уже выполнить)
+API_IDLE_RECONNECT = 10
+# Методы без изменений, которые можно повторять наравне с *.get
+API_READ_METHODS = ("apiinfo.version", "user.checkAuthentication")
+
+# Потоки для независимых шагов настройки одного хоста (hostgroup/template/user.get и т.п. идут параллельно)
+PHASE_WORKERS = int(env("ZABBIX_PHASE_WORKERS", "4"))
 
 # Без проверки SSL для самоподписанных сертификатов (только для внутреннего использования)
 SSL_CONTEXT = ssl.create_default_context()
@@ -59,30 +89,336 @@ SSL_CONTEXT.check_hostname = False
 SSL_CONTEXT.verify_mode = ssl.CERT_NONE
 
 
-def api_request(method, params, auth=None):
-    body = {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
-    headers = dict(REQUEST_HEADERS)
-    if auth:
-        headers["Authorization"] = "Bearer %s" % auth
-    req = urllib.request.Request(
-        API_URL,
-        data=json.dumps(body).encode("utf-8"),
-        headers=headers,
-        method="POST",
-    )
-    try:
-        with urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=30) as r:
-            data = json.loads(r.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
+class ZabbixAPIError(RuntimeError):
+    """Сервер ответил ошибкой JSON-RPC (запрос доставлен и отклонён), в отличие от ошибок сети и HTTP."""
+
+
+class ZabbixAPI(object):
+    """
+    Клиент JSON-RPC Zabbix с одним постоянным (keep-alive) HTTP-соединением.
+    Идемпотентные методы (*.get, API_READ_METHODS) повторяются с ограниченной экспоненциальной паузой, изменяющие —
+    не повторяются после того, как запрос ушёл целиком (обрыв keep-alive — не больше одной немедленной повторной отправки);
+    каждый вызов сохраняется в self.calls: метод, начало, длительность, байты запроса и ответа (как по сети),
+    число повторных отправок, поток и признак ошибки.
+    """
+
+    def __init__(self, url, timeout=API_TIMEOUT, retries=API_RETRIES, gzip_requests=API_GZIP):
+        parts = urllib.parse.urlsplit(url)
+        self.url = url
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        self.timeout = timeout
+        self.retries = retries
+        self.gzip_requests = gzip_requests
+        self.calls = []
+        self._conn = None
+        self._last_used = 0.0
+        self.request_sent = False
+        self._request_id = 0
+
+    def _connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=SSL_CONTEXT)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _post(self, body, headers):
+        """
+        Один POST по текущему соединению. Возвращает (код HTTP, тело ответа, размер ответа по сети).
+        self.request_sent — запрос записан в соединение целиком (после этого сервер мог его выполнить).
+        """
+        if self._conn is None:
+            self._conn = self._connect()
+        self.request_sent = False
+        try:
+            self._conn.request("POST", self.path, body=body, headers=headers)
+            self.request_sent = True
+            resp = self._conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError):
+            self.close()
+            raise
+        self._last_used = time.time()
+        if resp.will_close:
+            self.close()
+        wire = len(data)
+        if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+            data = gzip.decompress(data)
+        return resp.status, data, wire
+
+    def _backoff(self, attempt):
+        return min(API_BACKOFF_MAX, API_BACKOFF * (2 ** attempt))
+
+    def _record(self, method, start, sent, received, retries, error):
+        self.calls.append({
+            "method": method,
+            "start": start,
+            "seconds": time.time() - start,
+            "sent": sent,
+            "received": received,
+            "retries": retries,
+            "thread": threading.current_thread().name,
+            "error": error,
+        })
+
+    def call(self, method, params, auth=None):
+        self._request_id += 1
+        body = json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": self._request_id}).encode("utf-8")
+        headers = dict(REQUEST_HEADERS)
+        if auth:
+            headers["Authorization"] = "Bearer %s" % auth
+        if self.gzip_requests and len(body) >= API_GZIP_MIN_SIZE:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        idempotent = method.endswith(".get") or method in API_READ_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+        start = time.time()
+        if not idempotent and self._conn is not None and start - self._last_used > API_IDLE_RECONNECT:
+            self.close()
+        attempt = 0
+        sends = 0
+        resent = False
+        while True:
+            reused = self._conn is not None
+            sends += 1
+            try:
+                status, raw, received = self._post(body, headers)
+            except (http.client.HTTPException, OSError) as e:
+                # Сервер закрыл простаивающее keep-alive соединение: одна повторная отправка сразу — для чтения
+                # или если запрос не успел уйти. Изменяющий запрос, отправленный целиком, мог быть выполнен.
+                stale = reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError))
+                if stale and not resent and (idempotent or not self.request_sent):
+                    resent = True
+                    continue
+                attempt += 1
+                if attempt >= attempts:
+                    self._record(method, start, len(body) * sends, 0, sends - 1, True)
+                    raise RuntimeError("API %s: %s" % (method, e))
+                time.sleep(self._backoff(attempt - 1))
+                continue
+            if status in RETRY_HTTP_CODES and attempt + 1 < attempts:
+                attempt += 1
+                time.sleep(self._backoff(attempt - 1))
+                continue
+            break
         try:
-            err_body = e.read().decode("utf-8")
-            data = json.loads(err_body)
-        except Exception:
+            data = json.loads(raw.decode("utf-8"))
+        except ValueError:
             data = {}
-        raise RuntimeError("API %s: HTTP %s %s" % (method, e.code, data.get("error", {}).get("data", err_body)))
-    if "error" in data:
-        raise RuntimeError("API %s: %s" % (method, data["error"].get("data", data["error"])))
-    return data.get("result")
+        failed = status >= 400 or "error" in data
+        self._record(method, start, len(body) * sends, received, sends - 1, failed)
+        if status >= 400:
+            err = data.get("error", {}) if isinstance(data, dict) else {}
+            raise RuntimeError("API %s: HTTP %s %s" % (method, status, err.get("data", raw.decode("utf-8", "replace"))))
+        if "error" in data:
+            raise ZabbixAPIError("API %s: %s" % (method, data["error"].get("data", data["error"])))
+        return data.get("result")
+
+    def latency_summary(self):
+        """Сводка по вызовам: {метод: (число вызовов, суммарное время, максимум)}."""
+        summary = {}
+        for c in self.calls:
+            count, total, worst = summary.get(c["method"], (0, 0.0, 0.0))
+            summary[c["method"]] = (count + 1, total + c["seconds"], max(worst, c["seconds"]))
+        return summary
+
+
+# Клиент на поток: keep-alive соединение http.client нельзя делить между потоками (режим парка хостов).
+_local = threading.local()
+_clients = []
+_clients_lock = threading.Lock()
+
+
+def get_api():
+    api = getattr(_local, "api", None)
+    if api is None:
+        api = ZabbixAPI(API_URL)
+        _local.api = api
+        with _clients_lock:
+            _clients.append(api)
+    return api
+
+
+def close_api():
+    with _clients_lock:
+        for api in _clients:
+            api.close()
+
+
+def api_request(method, params, auth=None):
+    return get_api().call(method, params, auth)
+
+
+def print_api_summary():
+    summary = {}
+    with _clients_lock:
+        for api in _clients:
+            for method, (count, total, worst) in api.latency_summary().items():
+                c, t, w = summary.get(method, (0, 0.0, 0.0))
+                summary[method] = (c + count, t + total, max(w, worst))
+    if not summary:
+        return
+    total_calls = sum(v[0] for v in summary.values())
+    total_time = sum(v[1] for v in summary.values())
+    print("API: %d вызовов, %.2f с." % (total_calls, total_time))
+    for method, (count, total, worst) in sorted(summary.items(), key=lambda kv: -kv[1][1]):
+        print("  %-28s %4d  всего %.3f с  макс %.3f с" % (method, count, total, worst))
+
+
+# --- Профилирование (--profile): вызовы API и шаги настройки ---
+# Границы гистограммы задержек, с (как у клиентов Prometheus по умолчанию)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RUN_STARTED = time.time()
+_phases = []
+_phases_lock = threading.Lock()
+
+
+def record_phase(name, start, end):
+    with _phases_lock:
+        _phases.append({"name": name, "start": start, "seconds": end - start, "thread": threading.current_thread().name})
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Шаг main() для профиля: время выполнения блока."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_phase(name, start, time.time())
+
+
+def api_calls():
+    """Вызовы всех клиентов (всех потоков) по времени начала."""
+    with _clients_lock:
+        return sorted((c for api in _clients for c in api.calls), key=lambda c: c["start"])
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def method_stats(calls):
+    """{метод: {count, seconds[], sent, received, retries, errors}}."""
+    stats = {}
+    for c in calls:
+        st = stats.setdefault(c["method"], {"count": 0, "seconds": [], "sent": 0, "received": 0, "retries": 0, "errors": 0})
+        st["count"] += 1
+        st["seconds"].append(c["seconds"])
+        st["sent"] += c["sent"]
+        st["received"] += c["received"]
+        st["retries"] += c["retries"]
+        st["errors"] += 1 if c["error"] else 0
+    return stats
+
+
+def print_profile():
+    calls = api_calls()
+    stats = method_stats(calls)
+    print("Профиль API: %d вызовов, повторов %d, отправлено %.1f КБ, получено %.1f КБ, за %.2f с." % (
+        len(calls), sum(c["retries"] for c in calls), sum(c["sent"] for c in calls) / 1024.0,
+        sum(c["received"] for c in calls) / 1024.0, time.time() - RUN_STARTED))
+    print("  %-28s %5s %8s %7s %7s %7s %7s %9s %9s %4s %4s" % (
+        "метод", "вызов", "всего,с", "сред", "p50", "p95", "макс", "отпр,КБ", "получ,КБ", "повт", "ошиб"))
+    for method, st in sorted(stats.items(), key=lambda kv: -sum(kv[1]["seconds"])):
+        total = sum(st["seconds"])
+        print("  %-28s %5d %8.3f %7.3f %7.3f %7.3f %7.3f %9.1f %9.1f %4d %4d" % (
+            method, st["count"], total, total / st["count"], _percentile(st["seconds"], 0.5),
+            _percentile(st["seconds"], 0.95), max(st["seconds"]), st["sent"] / 1024.0, st["received"] / 1024.0,
+            st["retries"], st["errors"]))
+    with _phases_lock:
+        phases = sorted(_phases, key=lambda ph: -ph["seconds"])
+    if phases:
+        print("  Шаги (самые долгие):")
+        for ph in phases[:15]:
+            print("    %-32s %8.3f с" % (ph["name"], ph["seconds"]))
+
+
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_prometheus():
+    """Профиль в формате textfile collector node_exporter (метрики zabbix_init_*)."""
+    stats = method_stats(api_calls())
+    lines = [
+        "# HELP zabbix_init_api_calls_total Вызовы API Zabbix за запуск zabbix-init-config.py.",
+        "# TYPE zabbix_init_api_calls_total counter",
+    ]
+    lines += ['zabbix_init_api_calls_total{method="%s"} %d' % (_prom_label(m), st["count"]) for m, st in sorted(stats.items())]
+    lines += ["# HELP zabbix_init_api_errors_total Вызовы API, завершившиеся ошибкой.", "# TYPE zabbix_init_api_errors_total counter"]
+    lines += ['zabbix_init_api_errors_total{method="%s"} %d' % (_prom_label(m), st["errors"]) for m, st in sorted(stats.items())]
+    lines += ["# HELP zabbix_init_api_retries_total Повторные отправки запросов.", "# TYPE zabbix_init_api_retries_total counter"]
+    lines += ['zabbix_init_api_retries_total{method="%s"} %d' % (_prom_label(m), st["retries"]) for m, st in sorted(stats.items())]
+    lines += ["# HELP zabbix_init_api_bytes_total Байты запросов и ответов по сети.", "# TYPE zabbix_init_api_bytes_total counter"]
+    for m, st in sorted(stats.items()):
+        lines.append('zabbix_init_api_bytes_total{method="%s",direction="sent"} %d' % (_prom_label(m), st["sent"]))
+        lines.append('zabbix_init_api_bytes_total{method="%s",direction="received"} %d' % (_prom_label(m), st["received"]))
+    lines += ["# HELP zabbix_init_api_request_duration_seconds Время вызова API с повторами.",
+              "# TYPE zabbix_init_api_request_duration_seconds histogram"]
+    for m, st in sorted(stats.items()):
+        label = _prom_label(m)
+        for le in LATENCY_BUCKETS:
+            lines.append('zabbix_init_api_request_duration_seconds_bucket{method="%s",le="%g"} %d' % (
+                label, le, sum(1 for x in st["seconds"] if x <= le)))
+        lines.append('zabbix_init_api_request_duration_seconds_bucket{method="%s",le="+Inf"} %d' % (label, st["count"]))
+        lines.append('zabbix_init_api_request_duration_seconds_sum{method="%s"} %.6f' % (label, sum(st["seconds"])))
+        lines.append('zabbix_init_api_request_duration_seconds_count{method="%s"} %d' % (label, st["count"]))
+    with _phases_lock:
+        phases = list(_phases)
+    lines += ["# HELP zabbix_init_phase_duration_seconds Длительность шагов настройки.", "# TYPE zabbix_init_phase_duration_seconds gauge"]
+    lines += ['zabbix_init_phase_duration_seconds{phase="%s"} %.6f' % (_prom_label(ph["name"]), ph["seconds"]) for ph in phases]
+    lines += [
+        "# HELP zabbix_init_run_duration_seconds Длительность запуска.",
+        "# TYPE zabbix_init_run_duration_seconds gauge",
+        "zabbix_init_run_duration_seconds %.6f" % (time.time() - RUN_STARTED),
+        "# HELP zabbix_init_last_run_timestamp_seconds Время окончания запуска (Unix).",
+        "# TYPE zabbix_init_last_run_timestamp_seconds gauge",
+        "zabbix_init_last_run_timestamp_seconds %d" % int(time.time()),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def render_chrome_trace():
+    """Профиль в формате Chrome trace (chrome://tracing, Perfetto): шаги и вызовы API по потокам."""
+    calls = api_calls()
+    with _phases_lock:
+        phases = list(_phases)
+    threads = {}
+    events = []
+    for ph in phases:
+        events.append({"name": ph["name"], "cat": "phase", "ph": "X", "thread": ph["thread"],
+                       "ts": (ph["start"] - RUN_STARTED) * 1e6, "dur": ph["seconds"] * 1e6, "args": {}})
+    for c in calls:
+        events.append({"name": c["method"], "cat": "api", "ph": "X", "thread": c["thread"],
+                       "ts": (c["start"] - RUN_STARTED) * 1e6, "dur": c["seconds"] * 1e6,
+                       "args": {"sent": c["sent"], "received": c["received"], "retries": c["retries"], "error": c["error"]}})
+    for ev in events:
+        ev["pid"] = 1
+        ev["tid"] = threads.setdefault(ev.pop("thread"), len(threads) + 1)
+    meta = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "zabbix-init-config.py"}}]
+    meta += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}} for name, tid in threads.items()]
+    return {"traceEvents": meta + sorted(events, key=lambda ev: ev["ts"]), "displayTimeUnit": "ms",
+            "otherData": {"zabbix_url": ZABBIX_URL, "host": ZBX_HOSTNAME}}
+
+
+def write_profile(path):
+    """.prom — textfile Prometheus, иначе JSON в формате Chrome trace. Запись через временный файл."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        if path.endswith(".prom"):
+            f.write(render_prometheus())
+        else:
+            json.dump(render_chrome_trace(), f, ensure_ascii=False)
+    os.replace(tmp, path)
+    print("Профиль записан в %s" % path)
 
 
 def wait_for_api(max_wait=120, step=5):
@@ -99,122 +435,677 @@ def wait_for_api(max_wait=120, step=5):
     raise RuntimeError("API не ответил за %s с." % max_wait)
 
 
-def main():
-    if not ZABBIX_URL:
-        print("Задайте ZABBIX_URL (и при необходимости другие переменные из zabbix-init-config.env).", file=sys.stderr)
-        sys.exit(1)
+# Авторизация: ZABBIX_API_TOKEN — готовый API-токен; иначе учётные данные кешируются в файле состояния (0600):
+# session — сессия user.login, token — долгоживущий API-токен (token.create), login — новый user.login каждый раз.
+ZABBIX_API_TOKEN = env("ZABBIX_API_TOKEN", "")
+AUTH_MODE = env("ZABBIX_AUTH_MODE", "session")
+# Срок действия создаваемого API-токена, дней (0 — бессрочный)
+API_TOKEN_TTL_DAYS = int(env("ZABBIX_API_TOKEN_TTL_DAYS", "365"))
+API_TOKEN_NAME = env("ZABBIX_API_TOKEN_NAME", "zabbix-init-config")
+
+
+def _auth_cache_key():
+    return "%s|%s" % (ZABBIX_URL, ZABBIX_USER)
+
 
-    wait_for_api()
+def auth_valid(kind, value):
+    """
+    Дешёвая проверка сохранённой сессии или токена (user.checkAuthentication). False — только если сервер отклонил
+    их ответом JSON-RPC; ошибки сети и HTTP пробрасываются, чтобы сбой связи не приводил к новому входу.
+    """
+    try:
+        api_request("user.checkAuthentication", {"token" if kind == "token" else "sessionid": value})
+        return True
+    except ZabbixAPIError:
+        return False
+
+
+def create_api_token(session):
+    """API-токен пользователя ZABBIX_USER: token.create + token.generate; токен с тем же именем пересоздаётся."""
+    userid = get_userid(session)
+    old = api_request("token.get", {"output": ["tokenid"], "userids": [userid], "filter": {"name": API_TOKEN_NAME}}, session)
+    if old:
+        api_request("token.delete", [t["tokenid"] for t in old], session)
+    params = {"name": API_TOKEN_NAME, "userid": userid, "description": "Создан zabbix-init-config.py"}
+    if API_TOKEN_TTL_DAYS > 0:
+        params["expires_at"] = int(time.time()) + API_TOKEN_TTL_DAYS * 86400
+    tokenid = api_request("token.create", params, session)["tokenids"][0]
+    return api_request("token.generate", [tokenid], session)[0]["token"]
 
+
+def login():
+    """
+    Возвращает значение для заголовка Authorization. Сохранённые сессия или токен проверяются одним вызовом
+    и используются повторно; user.login с паролем — только если их нет или они отклонены.
+    """
+    if ZABBIX_API_TOKEN:
+        if not auth_valid("token", ZABBIX_API_TOKEN):
+            raise RuntimeError("API-токен из ZABBIX_API_TOKEN отклонён сервером (истёк или удалён).")
+        print("Авторизация по API-токену (ZABBIX_API_TOKEN).")
+        return ZABBIX_API_TOKEN
+    cached = load_state().get("auth", {}).get(_auth_cache_key()) if AUTH_MODE != "login" else None
+    if cached and cached.get("kind") == AUTH_MODE and auth_valid(cached["kind"], cached["value"]):
+        print("Авторизация: используется сохранённый %s." % ("API-токен" if cached["kind"] == "token" else "сеанс"))
+        return cached["value"]
     auth = api_request("user.login", {"username": ZABBIX_USER, "password": ZABBIX_PASSWORD})
-    print("Авторизация выполнена.")
+    if AUTH_MODE == "token":
+        try:
+            token = create_api_token(auth)
+        except RuntimeError as e:
+            # Нет прав на token.* (роль пользователя) — продолжаем с сеансом, кешировать нечего
+            print("API-токен не создан, используется сеанс: %s" % e)
+            return auth
+        api_request("user.logout", [], auth)
+        auth = token
+        print("Создан API-токен «%s» и сохранён в %s." % (API_TOKEN_NAME, STATE_FILE))
+    else:
+        print("Авторизация выполнена.")
+    if AUTH_MODE != "login":
+        update_state("auth", _auth_cache_key(), {"kind": AUTH_MODE, "value": auth, "saved": int(time.time())})
+    return auth
 
-    # Группа
-    gr = api_request("hostgroup.get", {"filter": {"name": ZABBIX_HOST_GROUP}, "output": ["groupid"]}, auth)
+
+def ensure_group(auth, name):
+    gr = api_request("hostgroup.get", {"filter": {"name": name}, "output": ["groupid"]}, auth)
     if gr:
         groupid = gr[0]["groupid"]
-        print("Группа '%s' уже есть: %s" % (ZABBIX_HOST_GROUP, groupid))
+        print("Группа '%s' уже есть: %s" % (name, groupid))
     else:
-        groupid = api_request("hostgroup.create", {"name": ZABBIX_HOST_GROUP}, auth)["groupids"][0]
-        print("Создана группа '%s': %s" % (ZABBIX_HOST_GROUP, groupid))
+        groupid = api_request("hostgroup.create", {"name": name}, auth)["groupids"][0]
+        print("Создана группа '%s': %s" % (name, groupid))
+    return groupid
+
 
-    # Шаблоны
+def find_templates(auth, names):
+    """Возвращает {имя шаблона: templateid} для найденных шаблонов из names."""
     tpl = api_request(
         "template.get",
         {
             "output": ["templateid", "name"],
-            "search": {"name": [ZABBIX_TEMPLATE_LINUX, ZABBIX_TEMPLATE_DOCKER]},
+            "search": {"name": list(names)},
             "searchByAny": True,
         },
         auth,
     )
-    template_ids = [x["templateid"] for x in tpl]
-    names_found = [x["name"] for x in tpl]
-    for need in (ZABBIX_TEMPLATE_LINUX, ZABBIX_TEMPLATE_DOCKER):
-        if need not in names_found:
+    found = {x["name"]: x["templateid"] for x in tpl}
+    for need in names:
+        if need not in found:
             print("Внимание: шаблон '%s' не найден (проверьте имя)." % need, file=sys.stderr)
-    if not template_ids:
+    if not found:
         print("Не найдено ни одного шаблона. Создание хоста без шаблонов.", file=sys.stderr)
     else:
-        print("Найдены шаблоны: %s" % names_found)
+        print("Найдены шаблоны: %s" % list(found))
+    return found
+
 
-    # Хост
-    existing = api_request("host.get", {"filter": {"host": ZBX_HOSTNAME}, "output": ["hostid"]}, auth)
+def ensure_host(auth, host, ip, port, groupids, template_ids, proxyid=None):
+    """proxyid — опрос через прокси (monitored_by=1); None — кто опрашивает существующий хост, не меняется."""
+    existing = api_request("host.get", {"filter": {"host": host}, "output": ["hostid", "monitored_by", "proxyid"]}, auth)
     if existing:
         hostid = existing[0]["hostid"]
-        print("Хост '%s' уже есть: %s. Триггер при необходимости будет добавлен." % (ZBX_HOSTNAME, hostid))
+        print("Хост '%s' уже есть: %s. Триггер при необходимости будет добавлен." % (host, hostid))
+        if proxyid and (existing[0].get("monitored_by") != str(MONITORED_BY_PROXY) or existing[0].get("proxyid") != proxyid):
+            api_request("host.update", {"hostid": hostid, "monitored_by": MONITORED_BY_PROXY, "proxyid": proxyid}, auth)
+            print("Хост '%s' переведён на прокси %s." % (host, proxyid))
         # Обновить IP/порт интерфейса агента (чтобы сервер в Docker мог опрашивать агента на хосте, напр. 172.17.0.1)
         ifaces = api_request("hostinterface.get", {"hostids": hostid, "output": ["interfaceid", "ip", "port"]}, auth)
         for iface in (ifaces or []):
             api_request("hostinterface.update", {
                 "interfaceid": iface["interfaceid"],
-                "ip": ZABBIX_AGENT_IP,
-                "port": str(ZABBIX_AGENT_PORT),
+                "ip": ip,
+                "port": str(port),
             }, auth)
-            print("Интерфейс агента обновлён: %s:%s" % (ZABBIX_AGENT_IP, ZABBIX_AGENT_PORT))
+            print("Интерфейс агента обновлён: %s:%s" % (ip, port))
     else:
-        hostid = api_request(
-            "host.create",
+        hostid = create_host(auth, host, ip, port, groupids, template_ids, proxyid)
+    return hostid
+
+
+def create_host(auth, host, ip, port, groupids, template_ids, proxyid=None):
+    params = {
+        "host": host,
+        "groups": [{"groupid": gid} for gid in groupids],
+        "interfaces": [
             {
-                "host": ZBX_HOSTNAME,
-                "groups": [{"groupid": groupid}],
-                "interfaces": [
-                    {
-                        "type": 1,
-                        "main": 1,
-                        "useip": 1,
-                        "ip": ZABBIX_AGENT_IP,
-                        "dns": "",
-                        "port": ZABBIX_AGENT_PORT,
-                    }
-                ],
-                "templates": [{"templateid": tid} for tid in template_ids],
-            },
+                "type": 1,
+                "main": 1,
+                "useip": 1,
+                "ip": ip,
+                "dns": "",
+                "port": str(port),
+            }
+        ],
+        "templates": [{"templateid": tid} for tid in template_ids],
+    }
+    if proxyid:
+        params.update({"monitored_by": MONITORED_BY_PROXY, "proxyid": proxyid})
+    hostid = api_request("host.create", params, auth)["hostids"][0]
+    print("Создан хост '%s': %s%s" % (host, hostid, " (через прокси %s)" % proxyid if proxyid else ""))
+    return hostid
+
+
+# Прокси: активные zabbix-proxy-sqlite3 (профиль compose «proxy», docker-stack-proxy.yml) сами подключаются к серверу,
+# опрашивают агентов своих хостов и передают данные пачками. Хосты без прокси в инвентаре распределяются по пулу.
+ZABBIX_PROXIES = [p.strip() for p in env("ZABBIX_PROXIES", "").split(",") if p.strip()]
+PROXY_MODE_ACTIVE = 0
+MONITORED_BY_PROXY = 1
+
+
+def ensure_proxies(auth, names):
+    """
+    Прокси по именам (недостающие создаются активными). Возвращает {имя: {"proxyid", "hosts"}},
+    где hosts — число хостов, которые прокси уже опрашивает (для распределения нагрузки).
+    """
+    found = api_request(
+        "proxy.get",
+        {"output": ["proxyid", "name"], "filter": {"name": list(names)}, "selectHosts": ["hostid"]},
+        auth,
+    )
+    proxies = {p["name"]: {"proxyid": p["proxyid"], "hosts": len(p.get("hosts") or [])} for p in found}
+    for name in names:
+        if name not in proxies:
+            proxyid = api_request("proxy.create", {"name": name, "operating_mode": PROXY_MODE_ACTIVE}, auth)["proxyids"][0]
+            proxies[name] = {"proxyid": proxyid, "hosts": 0}
+            print("Создан прокси '%s': %s" % (name, proxyid))
+    return proxies
+
+
+def resolve_proxies(auth, hosts):
+    """
+    Прокси для хостов: {имя хоста: proxyid}. Поле proxy в инвентаре закрепляет хост за прокси (площадка, группа узлов);
+    остальные хосты распределяются по ZABBIX_PROXIES: хост, уже опрашиваемый прокси из пула, остаётся на нём,
+    новый уходит на наименее загруженный. Без прокси в пуле и в инвентаре — {} без обращений к API.
+    """
+    names = list(ZABBIX_PROXIES)
+    names.extend(h["proxy"] for h in hosts if h.get("proxy") and h["proxy"] not in names)
+    if not names:
+        return {}
+    proxies = ensure_proxies(auth, names)
+    by_id = {p["proxyid"]: name for name, p in proxies.items()}
+    load = {name: p["hosts"] for name, p in proxies.items()}
+    current = {
+        h["host"]: by_id.get(h["proxyid"])
+        for h in api_request(
+            "host.get",
+            {"output": ["host", "monitored_by", "proxyid"], "filter": {"host": [h["host"] for h in hosts]}},
             auth,
-        )["hostids"][0]
-        print("Создан хост '%s': %s" % (ZBX_HOSTNAME, hostid))
-
-    # Элементы для виджетов дашборда (создаём до триггера, чтобы элемент диска существовал)
-    ifaces = api_request("hostinterface.get", {"hostids": hostid, "output": ["interfaceid"]}, auth)
-    interfaceid = int(ifaces[0]["interfaceid"]) if ifaces else None
-    dash_items = {}
-    # Виджеты: docker service ls (таблица сервисов), docker ps exited, Swarm, диск % и «объём / свободно»
-    items_to_ensure = [
-        ("Docker: services (docker service ls)", "docker.services.list", 4, None),
-        ("Docker: exited containers list", "docker.containers.exited.list", 4, None),
-        ("Docker: Swarm state", "docker.swarm.state", 4, None),
-        ("Disk: /hostfs free %", "vfs.fs.size[/hostfs,pfree]", 0, "%"),
-        ("Disk: /hostfs summary", "hostfs.disk.summary", 4, None),
+        )
+        if h.get("monitored_by") == str(MONITORED_BY_PROXY)
+    }
+    assigned = {}
+    for h in hosts:
+        was = current.get(h["host"])
+        name = h.get("proxy")
+        if not name and ZABBIX_PROXIES:
+            name = was if was in ZABBIX_PROXIES else min(ZABBIX_PROXIES, key=lambda n: (load[n], ZABBIX_PROXIES.index(n)))
+        if not name:
+            continue
+        if name != was:
+            load[name] += 1
+            if was:
+                load[was] -= 1
+        assigned[h["host"]] = proxies[name]["proxyid"]
+    print("Прокси: %s" % ", ".join("%s (хостов: %d)" % (name, load[name]) for name in names))
+    return assigned
+
+
+# Элементы Docker заполняет docker-collector.py через протокол траппера (тип 2) вместо опроса UserParameter агента
+DOCKER_COLLECTOR = env("ZABBIX_DOCKER_COLLECTOR", "0") == "1"
+DOCKER_ITEM = {"type": 2, "delay": "0"} if DOCKER_COLLECTOR else {"type": 0, "delay": "60s"}
+# Типы элементов, которым не нужен интерфейс хоста: траппер, внутренний Zabbix, зависимый
+ITEM_TYPES_WITHOUT_INTERFACE = (2, 5, 18)
+
+
+def _step(step_type, params="", error_handler=0, error_handler_params=""):
+    """Шаг предобработки элемента в формате API."""
+    return {"type": step_type, "params": params, "error_handler": error_handler, "error_handler_params": error_handler_params}
+
+
+# Хранение по классам элементов. Текст (таблицы docker, состояние Swarm, сводка диска) пишется в history_str/_text
+# целиком, поэтому хранится недолго и только при изменении — но не реже раза в TEXT_HEARTBEAT (триггеры nodata и
+# виджеты видят, что элемент жив). Числа коротко хранятся в history, а для графиков за год — в trends (24 строки в сутки).
+TEXT_HISTORY = env("ZABBIX_TEXT_HISTORY", "7d")
+TEXT_HEARTBEAT = env("ZABBIX_TEXT_HEARTBEAT", "1h")
+NUMERIC_HISTORY = env("ZABBIX_NUMERIC_HISTORY", "7d")
+NUMERIC_TRENDS = env("ZABBIX_NUMERIC_TRENDS", "365d")
+TEXT_VALUE_TYPES = (1, 2, 4)
+
+
+def with_retention(spec):
+    """Описание элемента с политикой хранения его класса: history/trends и отбрасывание неизменных значений."""
+    spec = dict(spec)
+    if spec["value_type"] not in TEXT_VALUE_TYPES:
+        spec.setdefault("history", NUMERIC_HISTORY)
+        spec.setdefault("trends", NUMERIC_TRENDS)
+    elif spec.get("history") != "0":
+        spec["history"] = TEXT_HISTORY
+        if TEXT_HEARTBEAT != "0":
+            spec["preprocessing"] = list(spec.get("preprocessing", [])) + [_step(20, TEXT_HEARTBEAT)]
+    return spec
+
+
+# Основной элемент сервисов Swarm: компактный JSON (docker service ls --format json | jq -sc). Из него сервер сам
+# строит таблицу для виджета и элементы обнаружения; история самого JSON не хранится (history 0).
+SERVICES_MASTER_KEY = "docker.services.json"
+# Таблица «как docker service ls» из JSON — для виджета «Запущенные контейнеры»
+SERVICES_TABLE_JS = """var rows = JSON.parse(value);
+var table = [['ID', 'NAME', 'MODE', 'REPLICAS', 'IMAGE']].concat(rows.map(function (s) {
+    return [s.ID, s.Name, s.Mode, s.Replicas, String(s.Image).split('@')[0]];
+}));
+var widths = table[0].map(function (_, i) {
+    return Math.max.apply(null, table.map(function (r) { return String(r[i]).length; }));
+});
+return table.map(function (r) {
+    return r.map(function (c, i) {
+        c = String(c);
+        return i < r.length - 1 ? c + Array(widths[i] - c.length + 4).join(' ') : c;
+    }).join('');
+}).join('\\n');"""
+
+# Элементы для виджетов дашборда: docker service ls (таблица сервисов), docker ps exited, Swarm, диск % и «объём / свободно».
+# master_key — ключ основного элемента для зависимых (тип 18); в API он превращается в master_itemid.
+ITEMS_TO_ENSURE = [with_retention(spec) for spec in [
+    dict(DOCKER_ITEM, name="Docker: services (JSON)", key_=SERVICES_MASTER_KEY, value_type=4, units="", history="0"),
+    {
+        "name": "Docker: services (docker service ls)", "key_": "docker.services.list", "type": 18, "value_type": 4,
+        "units": "", "delay": "0", "master_key": SERVICES_MASTER_KEY, "preprocessing": [_step(21, SERVICES_TABLE_JS)],
+    },
+    dict(DOCKER_ITEM, name="Docker: exited containers list", key_="docker.containers.exited.list", value_type=4, units=""),
+    dict(DOCKER_ITEM, name="Docker: Swarm state", key_="docker.swarm.state", value_type=4, units=""),
+    {"name": "Disk: /hostfs free %", "key_": "vfs.fs.size[/hostfs,pfree]", "type": 0, "value_type": 0, "units": "%", "delay": "60s"},
+    {"name": "Disk: /hostfs summary", "key_": "hostfs.disk.summary", "type": 0, "value_type": 4, "units": "", "delay": "60s"},
+]]
+# Поля, расхождение по которым исправляется через item.update (history/trends — только если заданы в описании)
+ITEM_COMPARE_FIELDS = ("name", "type", "delay", "units", "value_type", "history", "trends")
+
+
+def _service_jsonpath(field):
+    return "$[?(@.Name == '{#SERVICE.NAME}')].%s.first()" % field
+
+
+# Обнаружение сервисов Swarm: правило и прототипы — зависимые от SERVICES_MASTER_KEY, без отдельных опросов агента
+SERVICES_DISCOVERY = {
+    "name": "Docker: обнаружение сервисов Swarm",
+    "key_": "docker.services.discovery",
+    "type": 18,
+    "delay": "0",
+    "master_key": SERVICES_MASTER_KEY,
+    "lld_macro_paths": [
+        {"lld_macro": "{#SERVICE.NAME}", "path": "$.Name"},
+        {"lld_macro": "{#SERVICE.MODE}", "path": "$.Mode"},
+    ],
+}
+SERVICE_ITEM_PROTOTYPES = [with_retention(spec) for spec in [
+    {
+        "name": "Docker: сервис {#SERVICE.NAME}: запущено реплик", "key_": "docker.service.replicas.running[{#SERVICE.NAME}]",
+        "type": 18, "value_type": 3, "units": "", "delay": "0", "master_key": SERVICES_MASTER_KEY,
+        "preprocessing": [_step(12, _service_jsonpath("Replicas")), _step(5, "^(\\d+)/\\d+\n\\1")],
+    },
+    {
+        "name": "Docker: сервис {#SERVICE.NAME}: нужно реплик", "key_": "docker.service.replicas.desired[{#SERVICE.NAME}]",
+        "type": 18, "value_type": 3, "units": "", "delay": "0", "master_key": SERVICES_MASTER_KEY,
+        "preprocessing": [_step(12, _service_jsonpath("Replicas")), _step(5, "^\\d+/(\\d+)\n\\1")],
+    },
+    {
+        "name": "Docker: сервис {#SERVICE.NAME}: образ", "key_": "docker.service.image[{#SERVICE.NAME}]",
+        "type": 18, "value_type": 1, "units": "", "delay": "0", "master_key": SERVICES_MASTER_KEY,
+        "preprocessing": [_step(12, _service_jsonpath("Image"))],
+    },
+]]
+# Реплик меньше нужного дольше 5 минут (кратковременные просадки при обновлении сервиса не считаются)
+SERVICE_TRIGGER_DESCRIPTION = "Docker: сервис {#SERVICE.NAME}: запущено меньше реплик, чем нужно"
+SERVICE_TRIGGER_EXPRESSION_TEMPLATE = (
+    "max(/{host}/docker.service.replicas.running[{{#SERVICE.NAME}}],5m)"
+    "<last(/{host}/docker.service.replicas.desired[{{#SERVICE.NAME}}])"
+)
+
+
+def _preprocessing_key(steps):
+    return [
+        [int(st["type"]), st.get("params", ""), int(st.get("error_handler", 0)), st.get("error_handler_params", "")]
+        for st in steps or []
     ]
-    for name, key, value_type, units in items_to_ensure:
-        if key in dash_items:
+
+
+def diff_items(existing, wanted, ids=None):
+    """
+    Сравнивает элементы хоста (ответ item.get / itemprototype.get) с желаемыми.
+    ids — {ключ: itemid} для подстановки master_itemid зависимым элементам.
+    Возвращает (к созданию, изменения для *.update с itemid, без изменений).
+    Элементы, унаследованные от шаблона, не изменяются.
+    """
+    ids = ids or {}
+    by_key = {it["key_"]: it for it in existing}
+    missing, changed, unchanged = [], [], []
+    for spec in wanted:
+        cur = by_key.get(spec["key_"])
+        if cur is None:
+            missing.append(spec)
             continue
-        # В API Zabbix фильтр по ключу элемента — key_ (с подчёркиванием)
-        existing = api_request("item.get", {"hostids": hostid, "filter": {"key_": key}, "output": ["itemid"]}, auth)
-        if existing:
-            dash_items[key] = int(existing[0]["itemid"])
-        elif interfaceid:
-            try:
-                params = {
-                    "hostid": hostid,
-                    "name": name,
-                    "key_": key,
-                    "type": 0,
-                    "value_type": value_type,
-                    "interfaceid": interfaceid,
-                    "delay": "60s",
-                }
-                if units:
-                    params["units"] = units
-                res = api_request("item.create", params, auth)
-                dash_items[key] = int(res["itemids"][0])
-                print("Создан элемент: %s" % name)
-            except RuntimeError as e:
-                print("Элемент «%s» не создан: %s" % (name, e))
-
-    # Триггер «свободно места < 25%»
+        patch = {f: spec[f] for f in ITEM_COMPARE_FIELDS if f in spec and str(cur.get(f, "")) != str(spec[f])}
+        if _preprocessing_key(cur.get("preprocessing")) != _preprocessing_key(spec.get("preprocessing")):
+            patch["preprocessing"] = spec.get("preprocessing", [])
+        master = ids.get(spec.get("master_key"))
+        if master and str(cur.get("master_itemid", "0")) != str(master):
+            patch["master_itemid"] = master
+        if patch and str(cur.get("templateid", "0")) == "0":
+            patch["itemid"] = cur["itemid"]
+            changed.append(patch)
+        else:
+            unchanged.append(cur)
+    return missing, changed, unchanged
+
+
+def _item_params(spec, ids):
+    """Описание элемента -> параметры *.create: master_key заменяется на master_itemid, пустые единицы убираются."""
+    p = {k: v for k, v in spec.items() if k != "master_key"}
+    if spec.get("master_key"):
+        p["master_itemid"] = ids[spec["master_key"]]
+    if not p.get("units"):
+        p.pop("units", None)
+    return p
+
+
+def _create_items(auth, params, method="item.create"):
+    """*.create массивом; если пакет отклонён, элементы создаются по одному, чтобы ошибка одного не мешала остальным."""
+    try:
+        return dict(zip((p["key_"] for p in params), api_request(method, params, auth)["itemids"]))
+    except RuntimeError as e:
+        if len(params) == 1:
+            print("Элемент «%s» не создан: %s" % (params[0]["name"], e))
+            return {}
+    created = {}
+    for p in params:
+        created.update(_create_items(auth, [p], method))
+    return created
+
+
+def ensure_items(auth, hostid, wanted=None, label="Элементы дашборда"):
+    """
+    Сверяет элементы хоста с ITEMS_TO_ENSURE: один item.get по списку ключей, затем item.create / item.update
+    массивами только для расхождений. На уже настроенном хосте — один вызов API. Возвращает {ключ: itemid}.
+    label — чьи это элементы, в сообщении «... на месте».
+    """
+    wanted = wanted if wanted is not None else ITEMS_TO_ENSURE
+    # В API Zabbix фильтр по ключу элемента — key_ (с подчёркиванием)
+    existing = api_request(
+        "item.get",
+        {
+            "hostids": hostid,
+            "filter": {"key_": [spec["key_"] for spec in wanted]},
+            "output": ["itemid", "key_", "templateid", "master_itemid"] + list(ITEM_COMPARE_FIELDS),
+            "selectPreprocessing": "extend",
+        },
+        auth,
+    )
+    ids = {it["key_"]: int(it["itemid"]) for it in existing}
+    interface = []
+
+    def interfaceid():
+        # Интерфейс нужен только элементам, опрашиваемым агентом; ищется не больше одного раза
+        if not interface:
+            ifaces = api_request("hostinterface.get", {"hostids": hostid, "output": ["interfaceid"]}, auth)
+            interface.append(int(ifaces[0]["interfaceid"]) if ifaces else None)
+        return interface[0]
+
+    def create(specs):
+        params = []
+        for spec in specs:
+            if spec.get("master_key") and spec["master_key"] not in ids:
+                print("Элемент «%s» не создан: нет основного элемента %s." % (spec["name"], spec["master_key"]))
+                continue
+            p = dict(_item_params(spec, ids), hostid=hostid)
+            if p["type"] not in ITEM_TYPES_WITHOUT_INTERFACE:
+                if not interfaceid():
+                    print("Элемент «%s» не создан: у хоста нет интерфейса агента." % p["name"])
+                    continue
+                p["interfaceid"] = interfaceid()
+            params.append(p)
+        if params:
+            created = _create_items(auth, params)
+            for p in params:
+                if p["key_"] in created:
+                    ids[p["key_"]] = int(created[p["key_"]])
+                    print("Создан элемент: %s" % p["name"])
+
+    # Сначала недостающие основные элементы: зависимым при создании и обновлении нужен их itemid
+    masters = {spec["master_key"] for spec in wanted if spec.get("master_key")}
+    create([spec for spec in wanted if spec["key_"] in masters and spec["key_"] not in ids])
+    missing, changed, unchanged = diff_items(existing, wanted, ids)
+    missing = [spec for spec in missing if spec["key_"] not in ids]
+    for p in changed:
+        if "type" in p:
+            p["interfaceid"] = 0 if p["type"] in ITEM_TYPES_WITHOUT_INTERFACE else (interfaceid() or 0)
+    if changed:
+        try:
+            api_request("item.update", changed, auth)
+            print("Обновлены элементы: %s" % ", ".join(
+                it["key_"] for it in existing if any(p["itemid"] == it["itemid"] for p in changed)))
+        except RuntimeError as e:
+            print("Элементы не обновлены: %s" % e)
+    create(missing)
+    if len(unchanged) == len(wanted):
+        print("%s на месте (%d)." % (label, len(unchanged)))
+    return ids
+
+
+def ensure_service_discovery(auth, hostid, ids, host):
+    """
+    Правило обнаружения сервисов Swarm с зависимыми прототипами (реплики, образ) и прототипом триггера.
+    На настроенном хосте — два вызова: discoveryrule.get и itemprototype.get.
+    """
+    if SERVICES_MASTER_KEY not in ids:
+        print("Обнаружение сервисов пропущено: нет элемента %s." % SERVICES_MASTER_KEY)
+        return
+    rules = api_request(
+        "discoveryrule.get",
+        {
+            "hostids": hostid,
+            "filter": {"key_": SERVICES_DISCOVERY["key_"]},
+            "output": ["itemid", "master_itemid"],
+            "selectTriggers": ["triggerid"],
+        },
+        auth,
+    )
+    if rules:
+        ruleid = rules[0]["itemid"]
+        if str(rules[0].get("master_itemid")) != str(ids[SERVICES_MASTER_KEY]):
+            api_request("discoveryrule.update", {"itemid": ruleid, "master_itemid": ids[SERVICES_MASTER_KEY]}, auth)
+    else:
+        ruleid = api_request("discoveryrule.create", dict(_item_params(SERVICES_DISCOVERY, ids), hostid=hostid), auth)["itemids"][0]
+        print("Создано правило обнаружения: %s" % SERVICES_DISCOVERY["name"])
+    protos = api_request(
+        "itemprototype.get",
+        {
+            "discoveryids": ruleid,
+            "output": ["itemid", "key_", "templateid", "master_itemid"] + list(ITEM_COMPARE_FIELDS),
+            "selectPreprocessing": "extend",
+        },
+        auth,
+    )
+    missing, changed, _ = diff_items(protos, SERVICE_ITEM_PROTOTYPES, ids)
+    if changed:
+        api_request("itemprototype.update", changed, auth)
+        print("Обновлены прототипы элементов: %d" % len(changed))
+    if missing:
+        created = _create_items(
+            auth, [dict(_item_params(spec, ids), hostid=hostid, ruleid=ruleid) for spec in missing], "itemprototype.create")
+        print("Созданы прототипы элементов: %d" % len(created))
+    if not rules or not rules[0].get("triggers"):
+        try:
+            api_request(
+                "triggerprototype.create",
+                {
+                    "description": SERVICE_TRIGGER_DESCRIPTION,
+                    "expression": SERVICE_TRIGGER_EXPRESSION_TEMPLATE.format(host=host),
+                    "priority": TRIGGER_PRIORITY,
+                },
+                auth,
+            )
+            print("Создан прототип триггера: %s" % SERVICE_TRIGGER_DESCRIPTION)
+        except RuntimeError as e:
+            print("Прототип триггера по репликам не создан: %s" % e)
+
+
+# Оценка объёма истории. Размер строки в PostgreSQL вместе с индексом, байт: по типу значения и для trends.
+HISTORY_ROW_BYTES = {0: 90, 1: 300, 2: 600, 3: 90, 4: 1024}
+TRENDS_ROW_BYTES = 130
+# Типичный размер значения для длинных текстовых элементов (таблицы docker), байт
+VALUE_BYTES_ESTIMATE = {"docker.services.list": 8192, "docker.containers.exited.list": 4096}
+# Сервисов Swarm на хост для оценки элементов обнаружения; трапперы сборщик пересылает не реже раза в 5 минут
+ESTIMATE_SERVICES = int(env("ZABBIX_ESTIMATE_SERVICES", "20"))
+COLLECTOR_RESYNC = 300
+TIME_SUFFIXES = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def _seconds(value):
+    value = str(value)
+    if value[-1:] in TIME_SUFFIXES:
+        return int(value[:-1]) * TIME_SUFFIXES[value[-1]]
+    return int(value)
+
+
+def _values_per_day(spec, by_key):
+    if spec.get("master_key"):
+        return _values_per_day(by_key[spec["master_key"]], by_key)
+    if spec["type"] == 2:
+        return 86400 // COLLECTOR_RESYNC
+    return 86400 // _seconds(spec["delay"])
+
+
+def estimate_storage(items, count=1):
+    """
+    Оценка строк и байт в сутки для элементов items (на count экземпляров).
+    Возвращает список {key, values, history, trends, bytes, raw_bytes, stored}: values — значений в сутки,
+    history — строк history в сутки, если значения не меняются (отбрасывание неизменных с heartbeat),
+    raw_bytes — объём без отбрасывания, stored — объём в БД при установившемся хранении.
+    """
+    by_key = {spec["key_"]: spec for spec in ITEMS_TO_ENSURE}
+    rows = []
+    for spec in items:
+        values = _values_per_day(spec, by_key) * count
+        history = 0 if spec.get("history", "31d") == "0" else values
+        for st in spec.get("preprocessing", []):
+            if st["type"] == 20:
+                history = min(history, 86400 // _seconds(st["params"]) * count)
+            elif st["type"] == 19:
+                history = min(history, count)
+        trends = 24 * count if spec["value_type"] not in TEXT_VALUE_TYPES and spec.get("trends", "365d") != "0" else 0
+        row_bytes = VALUE_BYTES_ESTIMATE.get(spec["key_"], HISTORY_ROW_BYTES[spec["value_type"]])
+        history_days = _seconds(spec.get("history", "31d")) / 86400.0
+        trends_days = _seconds(spec.get("trends", "0")) / 86400.0
+        rows.append({
+            "key": spec["key_"],
+            "values": values,
+            "history": history,
+            "trends": trends,
+            "bytes": history * row_bytes + trends * TRENDS_ROW_BYTES,
+            "raw_bytes": (0 if history == 0 else values) * row_bytes + trends * TRENDS_ROW_BYTES,
+            "stored": history * row_bytes * history_days + trends * TRENDS_ROW_BYTES * trends_days,
+        })
+    return rows
+
+
+def _mb(value):
+    return value / 1024.0 / 1024.0
+
+
+def print_storage_report(hosts=1, detailed=False):
+    """Оценка суточного объёма истории до применения: на hosts хостов, прототипы — на ESTIMATE_SERVICES сервисов."""
+    rows = estimate_storage(ITEMS_TO_ENSURE, hosts) + estimate_storage(SERVICE_ITEM_PROTOTYPES, hosts * ESTIMATE_SERVICES)
+    total = dict((k, sum(r[k] for r in rows)) for k in ("history", "trends", "bytes", "raw_bytes", "stored"))
+    if detailed:
+        print("Оценка объёма истории в сутки (хостов: %d, сервисов Swarm на хост: %d):" % (hosts, ESTIMATE_SERVICES))
+        print("  %-52s %9s %9s %8s %10s" % ("элемент", "значений", "history", "trends", "КБ/сутки"))
+        for r in rows:
+            print("  %-52s %9d %9d %8d %10.1f" % (r["key"], r["values"], r["history"], r["trends"], r["bytes"] / 1024.0))
+    print(
+        "Оценка истории: %d строк history и %d строк trends в сутки, %.1f МБ/сутки "
+        "(без отбрасывания неизменных значений — %.1f МБ); в БД при установившемся хранении ≈ %.0f МБ."
+        % (total["history"], total["trends"], _mb(total["bytes"]), _mb(total["raw_bytes"]), _mb(total["stored"]))
+    )
+
+
+# Глобальная очистка истории (Administration → Housekeeping): переменная -> (поле, поле режима, поле «для всех элементов»).
+# Пустая переменная — настройка не меняется. ZABBIX_HK_HISTORY/ZABBIX_HK_TRENDS заменяют периоды хранения всех элементов.
+HOUSEKEEPING_ENV = (
+    ("ZABBIX_HK_HISTORY", "hk_history", "hk_history_mode", "hk_history_global"),
+    ("ZABBIX_HK_TRENDS", "hk_trends", "hk_trends_mode", "hk_trends_global"),
+    ("ZABBIX_HK_EVENTS", "hk_events_trigger", "hk_events_mode", None),
+    ("ZABBIX_HK_SESSIONS", "hk_sessions", "hk_sessions_mode", None),
+)
+# БД на TimescaleDB (история и trends — гипертаблицы). Очистка удаляет чанки целиком, только если сроки хранения
+# глобальные (hk_*_global), поэтому они включаются всегда; чанки старше ZABBIX_HK_COMPRESS_OLDER (не меньше 7d) сжимаются.
+# Чанк, удалённый раньше, чем сжат, сжатия не получает: срок хранения должен быть дольше compress_older.
+TIMESCALEDB = env("ZABBIX_TIMESCALEDB", "0") == "1"
+HK_COMPRESS_OLDER = env("ZABBIX_HK_COMPRESS_OLDER", "7d")
+TIMESCALEDB_HK_DEFAULTS = {"ZABBIX_HK_HISTORY": NUMERIC_HISTORY, "ZABBIX_HK_TRENDS": NUMERIC_TRENDS}
+
+
+def timescaledb_defaults():
+    """
+    Сроки хранения по умолчанию для TimescaleDB. История не короче compress_older (ZABBIX_NUMERIC_HISTORY=7d при
+    compress_older=7d) продлевается до двух compress_older — иначе её чанки удаляются несжатыми.
+    """
+    defaults = dict(TIMESCALEDB_HK_DEFAULTS)
+    compress_older = _seconds(HK_COMPRESS_OLDER)
+    if _seconds(defaults["ZABBIX_HK_HISTORY"]) <= compress_older:
+        defaults["ZABBIX_HK_HISTORY"] = "%dd" % (2 * compress_older // 86400)
+    return defaults
+
+
+def housekeeping_settings():
+    wanted = {}
+    defaults = timescaledb_defaults() if TIMESCALEDB else {}
+    for var, field, mode, override in HOUSEKEEPING_ENV:
+        value = env(var, "") or defaults.get(var, "")
+        if value:
+            wanted[field] = value
+            wanted[mode] = 1
+            if override:
+                wanted[override] = 1
+    if TIMESCALEDB:
+        for var, field in (("ZABBIX_HK_HISTORY", "hk_history"), ("ZABBIX_HK_TRENDS", "hk_trends")):
+            if _seconds(wanted[field]) <= _seconds(HK_COMPRESS_OLDER):
+                raise RuntimeError(
+                    "%s=%s не длиннее ZABBIX_HK_COMPRESS_OLDER=%s: чанки будут удаляться до сжатия. "
+                    "Увеличьте срок хранения или уменьшите ZABBIX_HK_COMPRESS_OLDER." % (var, wanted[field], HK_COMPRESS_OLDER)
+                )
+        wanted["compression_status"] = 1
+        wanted["compress_older"] = HK_COMPRESS_OLDER
+    return wanted
+
+
+def ensure_housekeeping(auth):
+    """housekeeping.update только для полей, отличающихся от текущих; без переменных ZABBIX_HK_* — ни одного вызова."""
+    wanted = housekeeping_settings()
+    if not wanted:
+        return
+    try:
+        output = list(wanted) + (["db_extension", "compression_availability"] if TIMESCALEDB else [])
+        current = api_request("housekeeping.get", {"output": output}, auth)
+        if TIMESCALEDB and str(current.get("compression_availability")) != "1":
+            print(
+                "Сжатие TimescaleDB недоступно (расширение БД: %s) — сжатие не включается. "
+                "Проверьте ZABBIX_DB_IMAGE и ENABLE_TIMESCALEDB в .env." % (current.get("db_extension") or "нет")
+            )
+            wanted.pop("compression_status")
+            wanted.pop("compress_older")
+        patch = dict((k, v) for k, v in wanted.items() if str(current.get(k)) != str(v))
+        if not patch:
+            print("Очистка истории (housekeeping) уже настроена.")
+            return
+        api_request("housekeeping.update", patch, auth)
+        print("Очистка истории (housekeeping) обновлена: %s" % ", ".join("%s=%s" % kv for kv in sorted(patch.items())))
+    except RuntimeError as e:
+        # housekeeping.* доступны только Super admin
+        print("Настройки очистки истории не изменены: %s" % e)
+
+
+def ensure_disk_trigger(auth, hostid, host):
+    """Триггер «свободно места < 25%»."""
     try:
-        expr = TRIGGER_EXPRESSION_TEMPLATE.format(host=ZBX_HOSTNAME)
+        expr = TRIGGER_EXPRESSION_TEMPLATE.format(host=host)
         triggers = api_request(
             "trigger.get",
             {
@@ -245,104 +1136,349 @@ def main():
     except RuntimeError as e:
         print("Триггер по диску не создан (можно добавить вручную): %s" % e)
 
-    # Дашборд «Главный экран»
-    dashboard_name = "Главный экран"
-    gid = int(groupid)
-    me = api_request("user.get", {"output": ["userid"], "filter": {"username": ZABBIX_USER}}, auth)
-    userid = int(me[0]["userid"]) if me else 1
 
-    def make_widgets():
-        w = []
-        # Ряд 0: Проблемы по важности, Запущенные контейнеры, Exited контейнеры
+# Авторегистрация: агенты с ZBX_HOSTMETADATA (по умолчанию «visiology») — например, глобальный сервис Swarm
+# из docker-stack-agent2.yml — сами создают хосты; действие добавляет их в группу и привязывает шаблоны.
+AUTOREGISTRATION = env("ZABBIX_AUTOREGISTRATION", "0") == "1"
+AUTOREG_METADATA = env("ZBX_HOSTMETADATA", "visiology")
+AUTOREG_ACTION = env("ZABBIX_AUTOREG_ACTION", "Visiology: авторегистрация агентов")
+EVENTSOURCE_AUTOREGISTRATION = 2
+CONDITION_HOST_METADATA = 24
+OPERATOR_CONTAINS = 2
+OPERATION_ADD_HOST = 2
+OPERATION_ADD_TO_GROUP = 4
+OPERATION_LINK_TEMPLATE = 6
+
+
+def _autoreg_key(metadata, groupids, templateids):
+    return (metadata, sorted(str(g) for g in groupids), sorted(str(t) for t in templateids))
+
+
+def ensure_autoregistration(auth, groupid, template_ids):
+    """
+    Действие авторегистрации: метаданные содержат AUTOREG_METADATA -> добавить хост, группа, шаблоны.
+    template_ids — {имя: templateid}; шаблон пакета BUNDLE_TEMPLATE добавляется, если он уже импортирован.
+    Существующее действие обновляется, только если условие, группа или шаблоны отличаются.
+    """
+    templates = dict(template_ids)
+    bundle = api_request("template.get", {"filter": {"host": BUNDLE_TEMPLATE}, "output": ["templateid"]}, auth)
+    if bundle:
+        templates[BUNDLE_TEMPLATE] = bundle[0]["templateid"]
+    params = {
+        "filter": {
+            "evaltype": 0,
+            "conditions": [{"conditiontype": CONDITION_HOST_METADATA, "operator": OPERATOR_CONTAINS, "value": AUTOREG_METADATA}],
+        },
+        "operations": [
+            {"operationtype": OPERATION_ADD_HOST},
+            {"operationtype": OPERATION_ADD_TO_GROUP, "opgroup": [{"groupid": groupid}]},
+        ],
+    }
+    if templates:
+        params["operations"].append(
+            {"operationtype": OPERATION_LINK_TEMPLATE, "optemplate": [{"templateid": t} for t in templates.values()]})
+    wanted = _autoreg_key(AUTOREG_METADATA, [groupid], templates.values())
+    try:
+        existing = api_request(
+            "action.get",
+            {
+                "output": ["actionid"],
+                "filter": {"name": AUTOREG_ACTION, "eventsource": EVENTSOURCE_AUTOREGISTRATION},
+                "selectFilter": "extend",
+                "selectOperations": "extend",
+            },
+            auth,
+        )
+        if not existing:
+            api_request("action.create", dict(params, name=AUTOREG_ACTION, eventsource=EVENTSOURCE_AUTOREGISTRATION, status=0), auth)
+            print("Создано действие авторегистрации «%s» (метаданные «%s», шаблоны: %s)." % (
+                AUTOREG_ACTION, AUTOREG_METADATA, ", ".join(templates) or "нет"))
+            return
+        action = existing[0]
+        metadata = [c["value"] for c in action.get("filter", {}).get("conditions", [])
+                    if int(c["conditiontype"]) == CONDITION_HOST_METADATA]
+        ops = action.get("operations", [])
+        current = _autoreg_key(
+            metadata[0] if len(metadata) == 1 else None,
+            [g["groupid"] for op in ops for g in op.get("opgroup", [])],
+            [t["templateid"] for op in ops for t in op.get("optemplate", [])],
+        )
+        if current == wanted and any(int(op["operationtype"]) == OPERATION_ADD_HOST for op in ops):
+            print("Действие авторегистрации «%s» уже настроено." % AUTOREG_ACTION)
+            return
+        api_request("action.update", dict(params, actionid=action["actionid"]), auth)
+        print("Действие авторегистрации «%s» обновлено." % AUTOREG_ACTION)
+    except RuntimeError as e:
+        print("Действие авторегистрации не настроено: %s" % e)
+
+
+def make_widgets(gid, dash_items):
+    """Виджеты дашборда «Главный экран» (формат dashboard.create). dash_items — {ключ элемента: itemid}."""
+    w = []
+    # Ряд 0: Проблемы по важности, Запущенные контейнеры, Exited контейнеры
+    w.append({
+        "type": "problemsbysv",
+        "name": "Проблемы по важности",
+        "x": 0, "y": 0, "width": 24, "height": 5, "view_mode": 0,
+        "fields": [{"type": 2, "name": "groupids.0", "value": gid}, {"type": 1, "name": "reference", "value": "SEV01"}],
+    })
+    # Виджет «Item history»: многострочный вывод «как в таблице», моноширинный шрифт (display As is).
+    def itemhistory_fields(itemid, ref_5ch, column_name):
+        return [
+            {"type": 1, "name": "reference", "value": ref_5ch},
+            {"type": 0, "name": "layout", "value": 1},
+            {"type": 1, "name": "columns.0.name", "value": column_name},
+            {"type": 4, "name": "columns.0.itemid", "value": str(itemid)},
+            {"type": 0, "name": "columns.0.display", "value": 1},
+            {"type": 0, "name": "columns.0.monospace_font", "value": 1},
+            {"type": 0, "name": "show_lines", "value": 1},
+            {"type": 0, "name": "show_timestamp", "value": 0},
+            {"type": 0, "name": "show_column_header", "value": 0},
+        ]
+    item_font_fields = [
+        {"type": 0, "name": "desc_size", "value": 7},
+        {"type": 0, "name": "value_size", "value": 8},
+    ]
+    item_services = dash_items.get("docker.services.list")
+    if item_services:
         w.append({
-            "type": "problemsbysv",
-            "name": "Проблемы по важности",
-            "x": 0, "y": 0, "width": 24, "height": 5, "view_mode": 0,
-            "fields": [{"type": 2, "name": "groupids.0", "value": gid}, {"type": 1, "name": "reference", "value": "SEV01"}],
+            "type": "itemhistory",
+            "name": "Запущенные контейнеры (docker service ls)",
+            "x": 24, "y": 0, "width": 24, "height": 10, "view_mode": 0,
+            "fields": itemhistory_fields(item_services, "SVC01", "docker service ls"),
         })
-        # Виджет «Item history»: многострочный вывод «как в таблице», моноширинный шрифт (display As is).
-        def itemhistory_fields(itemid, ref_5ch, column_name):
-            return [
-                {"type": 1, "name": "reference", "value": ref_5ch},
-                {"type": 0, "name": "layout", "value": 1},
-                {"type": 1, "name": "columns.0.name", "value": column_name},
-                {"type": 4, "name": "columns.0.itemid", "value": str(itemid)},
-                {"type": 0, "name": "columns.0.display", "value": 1},
-                {"type": 0, "name": "columns.0.monospace_font", "value": 1},
-                {"type": 0, "name": "show_lines", "value": 1},
-                {"type": 0, "name": "show_timestamp", "value": 0},
-                {"type": 0, "name": "show_column_header", "value": 0},
-            ]
-        item_font_fields = [
-            {"type": 0, "name": "desc_size", "value": 7},
-            {"type": 0, "name": "value_size", "value": 8},
-        ]
-        item_services = dash_items.get(items_to_ensure[0][1])
-        if item_services:
-            w.append({
-                "type": "itemhistory",
-                "name": "Запущенные контейнеры (docker service ls)",
-                "x": 24, "y": 0, "width": 24, "height": 10, "view_mode": 0,
-                "fields": itemhistory_fields(item_services, "SVC01", "docker service ls"),
-            })
-        item_exited = dash_items.get(items_to_ensure[1][1])
-        if item_exited:
-            w.append({
-                "type": "itemhistory",
-                "name": "Exited контейнеры",
-                "x": 48, "y": 0, "width": 24, "height": 10, "view_mode": 0,
-                "fields": itemhistory_fields(item_exited, "EXI01", "exited"),
-            })
-        # Ряд 1: Проблемы и предупреждения
+    item_exited = dash_items.get("docker.containers.exited.list")
+    if item_exited:
+        w.append({
+            "type": "itemhistory",
+            "name": "Exited контейнеры",
+            "x": 48, "y": 0, "width": 24, "height": 10, "view_mode": 0,
+            "fields": itemhistory_fields(item_exited, "EXI01", "exited"),
+        })
+    # Ряд 1: Проблемы и предупреждения
+    w.append({
+        "type": "problems",
+        "name": "Проблемы и предупреждения",
+        "x": 0, "y": 8, "width": 72, "height": 20, "view_mode": 0,
+        "fields": [
+            {"type": 2, "name": "groupids.0", "value": gid},
+            {"type": 0, "name": "show", "value": 3},
+            {"type": 0, "name": "show_lines", "value": 25},
+            {"type": 0, "name": "show_timeline", "value": 1},
+            {"type": 0, "name": "show_opdata", "value": 1},
+            {"type": 1, "name": "reference", "value": "PRB01"},
+        ],
+    })
+    # Ряд 2: Диск (gauge + сводка объёма), Swarm
+    item_disk = dash_items.get("vfs.fs.size[/hostfs,pfree]")
+    if item_disk:
         w.append({
-            "type": "problems",
-            "name": "Проблемы и предупреждения",
-            "x": 0, "y": 8, "width": 72, "height": 20, "view_mode": 0,
+            "type": "gauge",
+            "name": "Свободно места на диске (%)",
+            "x": 0, "y": 28, "width": 12, "height": 8, "view_mode": 0,
             "fields": [
-                {"type": 2, "name": "groupids.0", "value": gid},
-                {"type": 0, "name": "show", "value": 3},
-                {"type": 0, "name": "show_lines", "value": 25},
-                {"type": 0, "name": "show_timeline", "value": 1},
-                {"type": 0, "name": "show_opdata", "value": 1},
-                {"type": 1, "name": "reference", "value": "PRB01"},
+                {"type": 4, "name": "itemid.0", "value": str(item_disk)},
+                {"type": 1, "name": "min", "value": "0"},
+                {"type": 1, "name": "max", "value": "100"},
+                {"type": 0, "name": "show.0", "value": 1}, {"type": 0, "name": "show.1", "value": 2}, {"type": 0, "name": "show.2", "value": 4}, {"type": 0, "name": "show.3", "value": 5},
             ],
         })
-        # Ряд 2: Диск (gauge + сводка объёма), Swarm
-        item_disk = dash_items.get(items_to_ensure[3][1])
-        if item_disk:
-            w.append({
-                "type": "gauge",
-                "name": "Свободно места на диске (%)",
-                "x": 0, "y": 28, "width": 12, "height": 8, "view_mode": 0,
-                "fields": [
-                    {"type": 4, "name": "itemid.0", "value": str(item_disk)},
-                    {"type": 1, "name": "min", "value": "0"},
-                    {"type": 1, "name": "max", "value": "100"},
-                    {"type": 0, "name": "show.0", "value": 1}, {"type": 0, "name": "show.1", "value": 2}, {"type": 0, "name": "show.2", "value": 4}, {"type": 0, "name": "show.3", "value": 5},
-                ],
-            })
-        item_disk_summary = dash_items.get(items_to_ensure[4][1])
-        if item_disk_summary:
-            w.append({
-                "type": "item",
-                "name": "Диск: объём и свободно",
-                "x": 12, "y": 28, "width": 12, "height": 8, "view_mode": 0,
-                "fields": [
-                    {"type": 4, "name": "itemid.0", "value": str(item_disk_summary)},
-                    {"type": 0, "name": "show.0", "value": 1}, {"type": 0, "name": "show.1", "value": 2},
-                    {"type": 0, "name": "desc_size", "value": 7},
-                    {"type": 0, "name": "value_size", "value": 8},
-                ],
-            })
-        item_swarm = dash_items.get(items_to_ensure[2][1])
-        if item_swarm:
+    item_disk_summary = dash_items.get("hostfs.disk.summary")
+    if item_disk_summary:
+        w.append({
+            "type": "item",
+            "name": "Диск: объём и свободно",
+            "x": 12, "y": 28, "width": 12, "height": 8, "view_mode": 0,
+            "fields": [
+                {"type": 4, "name": "itemid.0", "value": str(item_disk_summary)},
+                {"type": 0, "name": "show.0", "value": 1}, {"type": 0, "name": "show.1", "value": 2},
+                {"type": 0, "name": "desc_size", "value": 7},
+                {"type": 0, "name": "value_size", "value": 8},
+            ],
+        })
+    item_swarm = dash_items.get("docker.swarm.state")
+    if item_swarm:
+        w.append({
+            "type": "item",
+            "name": "Состояние Docker Swarm",
+            "x": 24, "y": 28, "width": 24, "height": 10, "view_mode": 0,
+            "fields": [{"type": 4, "name": "itemid.0", "value": str(item_swarm)}, {"type": 0, "name": "show.0", "value": 1}, {"type": 0, "name": "show.1", "value": 2}],
+        })
+    return w
+
+
+# Вторая страница дашборда — нагрузка самого Zabbix: занятость процессов, заполнение кешей, очередь. Внутренние
+# элементы (тип 5) берутся с хоста сервера (шаблон «Zabbix server health»); недостающие создаются на нём же.
+SELF_MONITORING_HOST = env("ZABBIX_SELF_MONITORING_HOST", "Zabbix server")
+SELF_MONITORING_PAGE = "Нагрузка Zabbix"
+COLLECTOR_PROCESSES = ("poller", "agent poller", "unreachable poller", "trapper", "preprocessing worker", "lld worker")
+INTERNAL_PROCESSES = ("history syncer", "configuration syncer", "housekeeper", "alert manager")
+CACHES = (
+    ("wcache,history", "history cache"), ("wcache,index", "history index cache"), ("wcache,trend", "trend cache"),
+    ("rcache,buffer", "configuration cache"), ("vcache,buffer", "value cache"),
+)
+QUEUE_KEYS = ("zabbix[queue]", "zabbix[queue,10m]", "zabbix[preprocessing_queue]")
+VALUES_PER_SECOND_KEY = "zabbix[wcache,values]"
+
+
+def _process_busy_key(process):
+    return "zabbix[process,%s,avg,busy]" % process
+
+
+def _internal(name, key, value_type=0, units="", preprocessing=None):
+    spec = {"name": name, "key_": key, "type": 5, "value_type": value_type, "units": units, "delay": "1m"}
+    if preprocessing:
+        spec["preprocessing"] = preprocessing
+    return with_retention(spec)
+
+
+SELF_MONITORING_ITEMS = (
+    [_internal("Zabbix: utilization of %s processes" % p, _process_busy_key(p), units="%")
+     for p in COLLECTOR_PROCESSES + INTERNAL_PROCESSES]
+    + [_internal("Zabbix: %s used" % name, "zabbix[%s,pused]" % key, units="%") for key, name in CACHES]
+    + [
+        _internal("Zabbix: values processed per second", VALUES_PER_SECOND_KEY, preprocessing=[_step(10)]),
+        _internal("Zabbix: queue (delayed over 6s)", "zabbix[queue]", value_type=3),
+        _internal("Zabbix: queue (delayed over 10m)", "zabbix[queue,10m]", value_type=3),
+        _internal("Zabbix: preprocessing queue", "zabbix[preprocessing_queue]", value_type=3),
+    ]
+)
+GRAPH_COLORS = ("1A7C11", "F63100", "2774A4", "A54F10", "FC6EA3", "6C59DC", "AC8C14", "611F27", "F230E0", "00BFFF")
+
+
+def ensure_server_items(auth):
+    """Внутренние элементы сервера для страницы SELF_MONITORING_PAGE: {ключ: itemid}; {} — хоста сервера нет."""
+    found = api_request("host.get", {"filter": {"host": SELF_MONITORING_HOST}, "output": ["hostid"]}, auth)
+    if not found:
+        print("Хост «%s» не найден: страница «%s» дашборда не создаётся (ZABBIX_SELF_MONITORING_HOST)." % (
+            SELF_MONITORING_HOST, SELF_MONITORING_PAGE))
+        return {}
+    return ensure_items(auth, found[0]["hostid"], SELF_MONITORING_ITEMS,
+                        label="Внутренние элементы хоста «%s»" % SELF_MONITORING_HOST)
+
+
+def _graph_widget(name, itemids, x, y, percent=False):
+    """Виджет «Graph» (svggraph) по списку элементов; для процентов ось Y от 0 до 100."""
+    fields = [{"type": 0, "name": "ds.0.dataset_type", "value": 0}]
+    for i, itemid in enumerate(itemids):
+        fields.append({"type": 4, "name": "ds.0.itemids.%d" % i, "value": str(itemid)})
+        fields.append({"type": 1, "name": "ds.0.color.%d" % i, "value": GRAPH_COLORS[i % len(GRAPH_COLORS)]})
+    if percent:
+        fields.append({"type": 1, "name": "lefty_min", "value": "0"})
+        fields.append({"type": 1, "name": "lefty_max", "value": "100"})
+    return {"type": "svggraph", "name": name, "x": x, "y": y, "width": 36, "height": 8, "view_mode": 0, "fields": fields}
+
+
+def make_server_widgets(server_items):
+    """Виджеты страницы SELF_MONITORING_PAGE. server_items — {ключ элемента: itemid}; виджеты без элементов пропускаются."""
+    def ids(keys):
+        return [server_items[k] for k in keys if k in server_items]
+
+    w = []
+    graphs = (
+        ("Загрузка процессов сбора данных, %", [_process_busy_key(p) for p in COLLECTOR_PROCESSES], 0, 0, True),
+        ("Загрузка внутренних процессов, %", [_process_busy_key(p) for p in INTERNAL_PROCESSES], 36, 0, True),
+        ("Заполнение кешей, %", ["zabbix[%s,pused]" % key for key, _ in CACHES], 0, 8, True),
+        ("Очередь: задержанные элементы", QUEUE_KEYS, 36, 8, False),
+    )
+    for name, keys, x, y, percent in graphs:
+        if ids(keys):
+            w.append(_graph_widget(name, ids(keys), x, y, percent))
+    for name, key, x in (("Новых значений в секунду", VALUES_PER_SECOND_KEY, 0),
+                         ("Задержано больше 10 минут", "zabbix[queue,10m]", 36)):
+        if key in server_items:
             w.append({
                 "type": "item",
-                "name": "Состояние Docker Swarm",
-                "x": 24, "y": 28, "width": 24, "height": 10, "view_mode": 0,
-                "fields": [{"type": 4, "name": "itemid.0", "value": str(item_swarm)}, {"type": 0, "name": "show.0", "value": 1}, {"type": 0, "name": "show.1", "value": 2}],
+                "name": name,
+                "x": x, "y": 16, "width": 36, "height": 4, "view_mode": 0,
+                "fields": [{"type": 4, "name": "itemid.0", "value": str(server_items[key])},
+                           {"type": 0, "name": "show.0", "value": 1}, {"type": 0, "name": "show.1", "value": 2}],
             })
-        return w
+    return w
+
+
+# Файл состояния между запусками (хеши дашборда и т.п.); доступ только владельцу
+STATE_FILE = env("ZABBIX_STATE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "zabbix-init-config.state.json"))
+_state_lock = threading.Lock()
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_state(section, key, value):
+    """Записывает state[section][key] = value атомарно (временный файл с правами 0600 и os.replace)."""
+    with _state_lock:
+        state = load_state()
+        state.setdefault(section, {})[key] = value
+        tmp = STATE_FILE + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, STATE_FILE)
+
+
+def normalize_widget(w):
+    """Виджет в сравнимом виде: API возвращает числа строками, а порядок полей не гарантирован."""
+    return {
+        "type": w["type"],
+        "name": w.get("name", ""),
+        "x": int(w.get("x", 0)),
+        "y": int(w.get("y", 0)),
+        "width": int(w.get("width", 1)),
+        "height": int(w.get("height", 2)),
+        "view_mode": int(w.get("view_mode", 0)),
+        "fields": sorted([int(f["type"]), f["name"], str(f["value"])] for f in w.get("fields", [])),
+    }
+
+
+def widgets_digest(widgets):
+    rows = sorted(json.dumps(normalize_widget(w), sort_keys=True, ensure_ascii=False) for w in widgets)
+    return hashlib.sha256("\n".join(rows).encode("utf-8")).hexdigest()
+
+
+def changed_widgets(live, desired):
+    """Имена виджетов desired, которые новые или отличаются от своей живой версии (по widgetid)."""
+    live_by_id = {w["widgetid"]: normalize_widget(w) for w in live if w.get("widgetid")}
+    return [
+        w.get("name", "") for w in desired
+        if not w.get("widgetid") or live_by_id.get(w["widgetid"]) != normalize_widget(w)
+    ]
+
+
+def remember_dashboard(dash_id, desired_digest, live_digest):
+    try:
+        update_state("dashboards", str(dash_id), {"desired": desired_digest, "live": live_digest})
+    except OSError as e:
+        print("Файл состояния %s не записан: %s" % (STATE_FILE, e), file=sys.stderr)
+
+
+def get_userid(auth):
+    me = api_request("user.get", {"output": ["userid"], "filter": {"username": ZABBIX_USER}}, auth)
+    return int(me[0]["userid"]) if me else 1
+
+
+def _with_widget_ids(desired, live):
+    """Копии виджетов desired с widgetid одноимённых живых виджетов: сервер перезапишет только изменённые."""
+    live_ids = {w.get("name"): w["widgetid"] for w in live if w.get("widgetid")}
+    return [dict(w, widgetid=live_ids[w["name"]]) if w["name"] in live_ids else dict(w) for w in desired]
+
+
+def ensure_dashboard(auth, groupid, dash_items, userid=None, server_items=None):
+    """
+    Дашборд «Главный экран»: создаёт или дополняет виджеты, привязанные к элементам dash_items.
+    server_items — внутренние элементы сервера (ensure_server_items) для страницы SELF_MONITORING_PAGE;
+    без них эта страница не создаётся и не меняется.
+    """
+    dashboard_name = "Главный экран"
+    gid = int(groupid)
+    if userid is None:
+        userid = get_userid(auth)
+    server_widgets = make_server_widgets(server_items or {})
 
     existing_dash = api_request(
         "dashboard.get",
@@ -354,8 +1490,17 @@ def main():
         pages = existing_dash[0].get("pages", [])
         if pages:
             page = pages[0]
+            server_page = next((p for p in pages[1:] if p.get("name") == SELF_MONITORING_PAGE), None)
+            live_server = server_page.get("widgets", []) if server_page else []
+            # Быстрая проверка по хешам из файла состояния: ни желаемый набор, ни живой дашборд не менялись
+            desired_digest = widgets_digest(make_widgets(gid, dash_items) + server_widgets)
+            live_digest = widgets_digest(page.get("widgets", []) + live_server)
+            saved = load_state().get("dashboards", {}).get(str(dash_id), {})
+            if saved.get("desired") == desired_digest and saved.get("live") == live_digest:
+                print("Дашборд «%s» актуален (хеш совпадает), обновление пропущено." % dashboard_name)
+                return
             existing_names = {w.get("name") for w in page.get("widgets", []) if w.get("name")}
-            new_widgets = make_widgets()
+            new_widgets = make_widgets(gid, dash_items)
             to_add = [nw for nw in new_widgets if nw["name"] not in existing_names]
             max_bottom = max((int(w.get("y", 0)) + int(w.get("height", 4)) for w in page.get("widgets", [])), default=0)
             pos_by_name = {
@@ -367,12 +1512,12 @@ def main():
                 "Состояние Docker Swarm": (0, max_bottom + 10, 24, 10),
             }
             name_to_key = {
-                "Запущенные контейнеры (docker service ls)": items_to_ensure[0][1],
-                "Запущенные контейнеры (docker ps)": items_to_ensure[0][1],
-                "Exited контейнеры": items_to_ensure[1][1],
-                "Свободно места на диске (%)": items_to_ensure[3][1],
-                "Диск: объём и свободно": items_to_ensure[4][1],
-                "Состояние Docker Swarm": items_to_ensure[2][1],
+                "Запущенные контейнеры (docker service ls)": "docker.services.list",
+                "Запущенные контейнеры (docker ps)": "docker.services.list",
+                "Exited контейнеры": "docker.containers.exited.list",
+                "Свободно места на диске (%)": "vfs.fs.size[/hostfs,pfree]",
+                "Диск: объём и свободно": "hostfs.disk.summary",
+                "Состояние Docker Swarm": "docker.swarm.state",
             }
             table_widget_names = ("Запущенные контейнеры (docker service ls)", "Запущенные контейнеры (docker ps)", "Exited контейнеры")
             ref_and_col = {
@@ -431,30 +1576,609 @@ def main():
                 xywh = pos_by_name.get(nw["name"], (0, max_bottom, 24, 8))
                 nw["x"], nw["y"], nw["width"], nw["height"] = xywh
                 clean_widgets.append(nw)
-            api_request("dashboard.update", {"dashboardid": dash_id, "pages": [{"dashboard_pageid": page["dashboard_pageid"], "widgets": clean_widgets}]}, auth)
+            changed = changed_widgets(page.get("widgets", []), clean_widgets)
+            server_desired = _with_widget_ids(server_widgets, live_server) if server_widgets else live_server
+            server_changed = changed_widgets(live_server, server_desired) if server_widgets else []
+            if not changed and not server_changed:
+                remember_dashboard(dash_id, desired_digest, live_digest)
+                print("Дашборд «%s» не изменился, обновление пропущено." % dashboard_name)
+                return
+            # В dashboard.update уходят все виджеты страницы с их widgetid: сервер перезаписывает только изменённые.
+            # Остальные страницы передаются только с dashboard_pageid — иначе update удалил бы их.
+            update_pages = []
+            for p in pages:
+                if p is page:
+                    update_pages.append({"dashboard_pageid": p["dashboard_pageid"], "widgets": clean_widgets})
+                elif p is server_page and server_changed:
+                    update_pages.append({"dashboard_pageid": p["dashboard_pageid"], "widgets": server_desired})
+                else:
+                    update_pages.append({"dashboard_pageid": p["dashboard_pageid"]})
+            if server_page is None and server_widgets:
+                update_pages.append({"name": SELF_MONITORING_PAGE, "widgets": server_desired})
+            api_request("dashboard.update", {"dashboardid": dash_id, "pages": update_pages}, auth)
+            remember_dashboard(dash_id, desired_digest, widgets_digest(clean_widgets + server_desired))
             if to_add:
                 print("В дашборд «%s» добавлены виджеты: %s." % (dashboard_name, ", ".join(w["name"] for w in to_add)))
-            else:
-                print("Дашборд «%s» обновлён (привязка к элементам исправлена)." % dashboard_name)
+            elif changed:
+                print("Дашборд «%s» обновлён (изменены виджеты: %s)." % (dashboard_name, ", ".join(changed)))
+            if server_changed:
+                print("Страница «%s» дашборда «%s» %s: %s." % (
+                    SELF_MONITORING_PAGE, dashboard_name, "обновлена" if server_page else "добавлена", "; ".join(server_changed)))
         else:
             print("Дашборд «%s» уже существует." % dashboard_name)
     else:
-        widgets = make_widgets()
-        api_request(
+        widgets = make_widgets(gid, dash_items)
+        pages = [{"name": "", "widgets": widgets}]
+        if server_widgets:
+            pages.append({"name": SELF_MONITORING_PAGE, "widgets": server_widgets})
+        res = api_request(
             "dashboard.create",
             {
                 "name": dashboard_name,
                 "display_period": 60,
                 "auto_start": 1,
-                "pages": [{"name": "", "widgets": widgets}],
+                "pages": pages,
                 "users": [{"userid": userid, "permission": 3}],
                 "userGroups": [],
             },
             auth,
         )
-        print("Создан дашборд «%s» с виджетами: проблемы, контейнеры, диск, Swarm." % dashboard_name)
+        digest = widgets_digest(widgets + server_widgets)
+        remember_dashboard(res["dashboardids"][0], digest, digest)
+        print("Создан дашборд «%s» с виджетами: проблемы, контейнеры, диск, Swarm%s." % (
+            dashboard_name, "; страница «%s»" % SELF_MONITORING_PAGE if server_widgets else ""))
+
+
+# Режим одного импорта: шаблон «Visiology» (элементы, триггер, дашборд шаблона) применяется через configuration.import
+BUNDLE_TEMPLATE = env("ZABBIX_BUNDLE_TEMPLATE", "Visiology")
+BUNDLE_TEMPLATE_GROUP = env("ZABBIX_BUNDLE_TEMPLATE_GROUP", "Templates/Visiology")
+BUNDLE_EXPORT_VERSION = "7.0"
+BUNDLE_UUID_NAMESPACE = uuid.UUID("6f1b3c1e-5d7a-4c59-9a55-3e0f6b1d2a10")
+# Типы элементов, значений и полей виджетов: числа API -> имена формата экспорта
+ITEM_TYPE_EXPORT = {0: "ZABBIX_PASSIVE", 2: "TRAPPER", 5: "INTERNAL", 18: "DEPENDENT"}
+VALUE_TYPE_EXPORT = {0: "FLOAT", 1: "CHAR", 2: "LOG", 3: "UNSIGNED", 4: "TEXT"}
+PREPROCESSING_EXPORT = {5: "REGEX", 12: "JSONPATH", 19: "DISCARD_UNCHANGED", 20: "DISCARD_UNCHANGED_HEARTBEAT", 21: "JAVASCRIPT"}
+WIDGET_FIELD_EXPORT = {0: "INTEGER", 1: "STRING", 2: "HOST_GROUP", 3: "HOST", 4: "ITEM", 5: "ITEM_PROTOTYPE", 6: "GRAPH"}
+BUNDLE_IMPORT_RULES = {
+    "template_groups": {"createMissing": True, "updateExisting": True},
+    "templates": {"createMissing": True, "updateExisting": True},
+    "items": {"createMissing": True, "updateExisting": True, "deleteMissing": False},
+    "triggers": {"createMissing": True, "updateExisting": True, "deleteMissing": False},
+    # Без этого правила configuration.import молча пропускает обнаружение сервисов вместе с прототипами
+    "discoveryRules": {"createMissing": True, "updateExisting": True, "deleteMissing": False},
+    "templateDashboards": {"createMissing": True, "updateExisting": True, "deleteMissing": False},
+}
+
+
+def _bundle_uuid(*parts):
+    return uuid.uuid5(BUNDLE_UUID_NAMESPACE, "/".join(parts)).hex
+
+
+def _export_item(spec, kind="item"):
+    item = {
+        "uuid": _bundle_uuid(BUNDLE_TEMPLATE, kind, spec["key_"]),
+        "name": spec["name"],
+        "key": spec["key_"],
+    }
+    if spec["type"] != 0:
+        item["type"] = ITEM_TYPE_EXPORT[spec["type"]]
+    if spec["delay"] != "0":
+        item["delay"] = spec["delay"]
+    for field in ("history", "trends"):
+        if field in spec:
+            item[field] = spec[field]
+    if "value_type" in spec:
+        item["value_type"] = VALUE_TYPE_EXPORT[spec["value_type"]]
+    if spec.get("units"):
+        item["units"] = spec["units"]
+    if spec.get("preprocessing"):
+        # В API параметры шага разделяются переводом строки, в экспорте — списком; скрипт JavaScript — один параметр
+        item["preprocessing"] = [
+            {
+                "type": PREPROCESSING_EXPORT[st["type"]],
+                "parameters": [st["params"]] if st["type"] == 21 else st["params"].split("\n"),
+            }
+            for st in spec["preprocessing"]
+        ]
+    if spec.get("master_key"):
+        item["master_item"] = {"key": spec["master_key"]}
+    if spec["key_"] == "vfs.fs.size[/hostfs,pfree]":
+        item["triggers"] = [{
+            "uuid": _bundle_uuid(BUNDLE_TEMPLATE, "trigger", "disk-pfree"),
+            "expression": TRIGGER_EXPRESSION_TEMPLATE.format(host=BUNDLE_TEMPLATE),
+            "name": TRIGGER_DESCRIPTION,
+            "priority": "WARNING",
+        }]
+    return item
+
+
+def _export_discovery():
+    rule = _export_item(SERVICES_DISCOVERY, "discovery")
+    rule["lld_macro_paths"] = [dict(m) for m in SERVICES_DISCOVERY["lld_macro_paths"]]
+    rule["item_prototypes"] = [_export_item(spec, "item_prototype") for spec in SERVICE_ITEM_PROTOTYPES]
+    rule["trigger_prototypes"] = [{
+        "uuid": _bundle_uuid(BUNDLE_TEMPLATE, "trigger_prototype", "service-replicas"),
+        "expression": SERVICE_TRIGGER_EXPRESSION_TEMPLATE.format(host=BUNDLE_TEMPLATE),
+        "name": SERVICE_TRIGGER_DESCRIPTION,
+        "priority": "WARNING",
+    }]
+    return rule
+
+
+def _export_widget(widget):
+    """
+    Виджет make_widgets() -> виджет дашборда шаблона. Ссылки на элементы становятся {host, key};
+    виджеты с полями групп хостов (проблемы) на дашборде шаблона недоступны — для них возвращается None.
+    """
+    fields = []
+    for f in widget.get("fields", []):
+        if f["type"] not in (0, 1, 4):
+            return None
+        value = {"host": BUNDLE_TEMPLATE, "key": f["value"]} if f["type"] == 4 else str(f["value"])
+        fields.append({"type": WIDGET_FIELD_EXPORT[f["type"]], "name": f["name"], "value": value})
+    out = {"type": widget["type"], "name": widget["name"]}
+    for k in ("x", "y", "width", "height"):
+        out[k] = str(widget[k])
+    out["fields"] = fields
+    return out
+
+
+def render_bundle():
+    """Экспорт Zabbix (формат configuration.export) с шаблоном BUNDLE_TEMPLATE."""
+    # Вместо itemid виджеты получают ключи элементов: _export_widget превращает их в ссылки {host, key}
+    widgets = [w for w in (_export_widget(x) for x in make_widgets(0, {spec["key_"]: spec["key_"] for spec in ITEMS_TO_ENSURE})) if w]
+    return {
+        "zabbix_export": {
+            "version": BUNDLE_EXPORT_VERSION,
+            "template_groups": [{"uuid": _bundle_uuid("group", BUNDLE_TEMPLATE_GROUP), "name": BUNDLE_TEMPLATE_GROUP}],
+            "templates": [{
+                "uuid": _bundle_uuid("template", BUNDLE_TEMPLATE),
+                "template": BUNDLE_TEMPLATE,
+                "name": BUNDLE_TEMPLATE,
+                "description": "Сгенерировано zabbix-init-config.py: элементы Docker/Swarm/диск, обнаружение сервисов Swarm, триггер по диску, дашборд.",
+                "groups": [{"name": BUNDLE_TEMPLATE_GROUP}],
+                "items": [_export_item(spec) for spec in ITEMS_TO_ENSURE],
+                "discovery_rules": [_export_discovery()],
+                "dashboards": [{
+                    "uuid": _bundle_uuid(BUNDLE_TEMPLATE, "dashboard", "main"),
+                    "name": "Главный экран",
+                    "pages": [{"widgets": widgets}],
+                }],
+            }],
+        }
+    }
+
+
+def write_bundle(path):
+    bundle = render_bundle()
+    with open(path, "w", encoding="utf-8") as f:
+        if os.path.splitext(path)[1].lower() in (".yml", ".yaml"):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("Для экспорта в YAML нужен PyYAML (pip install pyyaml) или укажите файл .json.")
+            yaml.safe_dump(bundle, f, allow_unicode=True, sort_keys=False)
+        else:
+            json.dump(bundle, f, ensure_ascii=False, indent=2)
+    print("Пакет шаблона «%s» записан в %s" % (BUNDLE_TEMPLATE, path))
+
+
+def import_bundle(auth):
+    """Применяет пакет одним configuration.import и возвращает templateid шаблона."""
+    api_request(
+        "configuration.import",
+        {"format": "json", "rules": BUNDLE_IMPORT_RULES, "source": json.dumps(render_bundle(), ensure_ascii=False)},
+        auth,
+    )
+    tpl = api_request("template.get", {"filter": {"host": BUNDLE_TEMPLATE}, "output": ["templateid"]}, auth)
+    if not tpl:
+        raise RuntimeError("Шаблон «%s» не найден после импорта." % BUNDLE_TEMPLATE)
+    print("Пакет импортирован: шаблон «%s» (%s)." % (BUNDLE_TEMPLATE, tpl[0]["templateid"]))
+    return tpl[0]["templateid"]
+
+
+def bundle_conflicts(auth, hostids):
+    """
+    Элементы и правило обнаружения с ключами шаблона пакета, созданные на хостах напрямую (templateid 0, обычный
+    запуск скрипта). Zabbix не привязывает шаблон к такому хосту и отклоняет host.massadd целиком, для всех хостов.
+    Два вызова на все хосты. Возвращает {hostid: [ключи]}.
+    """
+    conflicts = {}
+    if not hostids:
+        return conflicts
+    found = api_request("item.get", {
+        "hostids": hostids, "filter": {"key_": [spec["key_"] for spec in ITEMS_TO_ENSURE], "templateid": "0"},
+        "output": ["hostid", "key_"],
+    }, auth) + api_request("discoveryrule.get", {
+        "hostids": hostids, "filter": {"key_": SERVICES_DISCOVERY["key_"], "templateid": "0"},
+        "output": ["hostid", "key_"],
+    }, auth)
+    for it in found:
+        conflicts.setdefault(it["hostid"], []).append(it["key_"])
+    return conflicts
+
+
+def provision_bundle(auth, hosts, concurrency):
+    """
+    Импорт пакета и привязка шаблона к хостам: существующие хосты находятся одним host.get по списку имён,
+    недостающие создаются сразу с шаблоном, к существующим шаблон добавляется одним host.massadd.
+    Существующие хосты с теми же ключами, созданными напрямую, пропускаются. Интерфейсы существующих хостов
+    в этом режиме не меняются; прокси — только при расхождении. Возвращает имена пропущенных хостов.
+    """
+    templateid = import_bundle(auth)
+    shared = resolve_shared(auth, hosts)
+    shared["templates"][BUNDLE_TEMPLATE] = templateid
+    existing = {
+        h["host"]: h for h in api_request(
+            "host.get", {"filter": {"host": [h["host"] for h in hosts]}, "output": ["hostid", "host", "monitored_by", "proxyid"]},
+            auth)
+    }
+    for h in hosts:
+        found, proxyid = existing.get(h["host"]), shared["proxies"].get(h["host"])
+        if found and proxyid and (found.get("monitored_by") != str(MONITORED_BY_PROXY) or found.get("proxyid") != proxyid):
+            api_request("host.update", {"hostid": found["hostid"], "monitored_by": MONITORED_BY_PROXY, "proxyid": proxyid}, auth)
+            print("Хост '%s' переведён на прокси %s." % (h["host"], proxyid))
+    missing = [h for h in hosts if h["host"] not in existing]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [
+            pool.submit(create_host, auth, h["host"], h["ip"], h["port"],
+                        [shared["groups"][g] for g in h["groups"]],
+                        [shared["templates"][t] for t in h["templates"] + [BUNDLE_TEMPLATE] if t in shared["templates"]],
+                        shared["proxies"].get(h["host"]))
+            for h in missing
+        ]
+        for fut in futures:
+            fut.result()
+    conflicts = bundle_conflicts(auth, [h["hostid"] for h in existing.values()])
+    skipped = sorted(h["host"] for h in existing.values() if h["hostid"] in conflicts)
+    for h in existing.values():
+        if h["hostid"] in conflicts:
+            keys = conflicts[h["hostid"]]
+            print("Хост '%s' пропущен: элементы с ключами шаблона созданы напрямую (%d: %s%s). Удалите их или "
+                  "настраивайте хост без --bundle." % (h["host"], len(keys), ", ".join(keys[:3]), ", ..." if len(keys) > 3 else ""))
+    linkable = [h for h in existing.values() if h["hostid"] not in conflicts]
+    if linkable:
+        api_request("host.massadd", {
+            "hosts": [{"hostid": h["hostid"]} for h in linkable], "templates": [{"templateid": templateid}],
+        }, auth)
+    print("Шаблон «%s» привязан к %d хостам (создано %d, добавлен к существующим %d, пропущено %d)." % (
+        BUNDLE_TEMPLATE, len(missing) + len(linkable), len(missing), len(linkable), len(skipped)))
+    return skipped
+
+
+class Task(object):
+    """Шаг настройки: func(results) получает словарь результатов уже выполненных шагов."""
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+def run_task_graph(tasks, max_workers=PHASE_WORKERS):
+    """
+    Выполняет шаги с учётом зависимостей в пуле потоков: независимые шаги идут параллельно.
+    Возвращает (результаты {имя: значение}, тайминги {имя: (начало, конец)} в секундах от старта).
+    Ошибка шага останавливает запуск зависимых от него шагов и пробрасывается после завершения уже начатых.
+    """
+    by_name = {t.name: t for t in tasks}
+    for t in tasks:
+        for d in t.deps:
+            if d not in by_name:
+                raise RuntimeError("Шаг «%s» зависит от неизвестного шага «%s»." % (t.name, d))
+    results, timings = {}, {}
+    pending = list(tasks)
+    running = {}
+    error = None
+    t0 = time.time()
+
+    def timed(task, snapshot):
+        start = time.time() - t0
+        try:
+            return task.func(snapshot)
+        finally:
+            timings[task.name] = (start, time.time() - t0)
+            record_phase(task.name, t0 + start, time.time())
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            if error is None:
+                for task in [t for t in pending if all(d in results for d in t.deps)]:
+                    pending.remove(task)
+                    running[pool.submit(timed, task, dict(results))] = task
+            if not running:
+                if pending and error is None:
+                    raise RuntimeError("Циклические зависимости шагов: %s" % ", ".join(t.name for t in pending))
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                task = running.pop(fut)
+                try:
+                    results[task.name] = fut.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+    if error is not None:
+        raise error
+    return results, timings
+
+
+def critical_path(tasks, timings):
+    """Цепочка зависимостей, определившая общее время: от последнего завершившегося шага назад по самой поздней зависимости."""
+    by_name = {t.name: t for t in tasks}
+    name = max(timings, key=lambda n: timings[n][1])
+    path = [name]
+    while by_name[name].deps:
+        name = max(by_name[name].deps, key=lambda n: timings[n][1])
+        path.append(name)
+    return list(reversed(path))
+
+
+def print_timings(tasks, timings):
+    print("Шаги настройки (начало, длительность, сек):")
+    for name, (start, end) in sorted(timings.items(), key=lambda kv: kv[1][0]):
+        print("  %-16s +%6.3f  %6.3f" % (name, start, end - start))
+    path = critical_path(tasks, timings)
+    total = sum(timings[n][1] - timings[n][0] for n in path)
+    print("Критический путь: %s (%.3f с из %.3f с)" % (" -> ".join(path), total, max(e for _, e in timings.values())))
+
 
-    print("Готово. Проверьте хост, Latest data и дашборд «Главный экран» в веб-интерфейсе.")
+def host_tasks():
+    """Шаги настройки одного хоста ZBX_HOSTNAME и зависимости между ними."""
+    return [
+        Task("api", lambda r: wait_for_api()),
+        Task("login", lambda r: login(), ["api"]),
+        Task("hostgroup", lambda r: ensure_group(r["login"], ZABBIX_HOST_GROUP), ["login"]),
+        Task("templates", lambda r: find_templates(r["login"], [ZABBIX_TEMPLATE_LINUX, ZABBIX_TEMPLATE_DOCKER]), ["login"]),
+        Task("user", lambda r: get_userid(r["login"]), ["login"]),
+        Task("housekeeping", lambda r: ensure_housekeeping(r["login"]), ["login"]),
+        Task("autoregistration", lambda r: ensure_autoregistration(r["login"], r["hostgroup"], r["templates"])
+             if AUTOREGISTRATION else None, ["hostgroup", "templates"]),
+        Task("proxy", lambda r: resolve_proxies(r["login"], [default_host_spec()]).get(ZBX_HOSTNAME), ["login"]),
+        Task("host", lambda r: ensure_host(
+            r["login"], ZBX_HOSTNAME, ZABBIX_AGENT_IP, ZABBIX_AGENT_PORT, [r["hostgroup"]], list(r["templates"].values()),
+            r["proxy"]),
+            ["hostgroup", "templates", "proxy"]),
+        # Элементы для виджетов дашборда (создаём до триггера, чтобы элемент диска существовал)
+        Task("items", lambda r: ensure_items(r["login"], r["host"]), ["host"]),
+        Task("trigger", lambda r: ensure_disk_trigger(r["login"], r["host"], ZBX_HOSTNAME), ["items"]),
+        Task("discovery", lambda r: ensure_service_discovery(r["login"], r["host"], r["items"], ZBX_HOSTNAME), ["items"]),
+        Task("selfmon", lambda r: ensure_server_items(r["login"]), ["login"]),
+        Task("dashboard", lambda r: ensure_dashboard(r["login"], r["hostgroup"], r["items"], r["user"], r["selfmon"]),
+             ["hostgroup", "items", "user", "selfmon"]),
+    ]
+
+
+def provision_host(auth, spec, shared, with_dashboard=False):
+    """
+    Настройка одного хоста из инвентаря: хост с интерфейсом агента, элементы, триггер, обнаружение сервисов (и дашборд — по запросу).
+    shared — общие для всего парка {"groups": {имя: groupid}, "templates": {имя: templateid}, "proxies": {хост: proxyid}}.
+    """
+    groupids = [shared["groups"][g] for g in spec["groups"] if g in shared["groups"]]
+    template_ids = [shared["templates"][t] for t in spec["templates"] if t in shared["templates"]]
+    with phase("host %s" % spec["host"]):
+        hostid = ensure_host(auth, spec["host"], spec["ip"], spec["port"], groupids, template_ids,
+                             shared["proxies"].get(spec["host"]))
+        dash_items = ensure_items(auth, hostid)
+        ensure_disk_trigger(auth, hostid, spec["host"])
+        ensure_service_discovery(auth, hostid, dash_items, spec["host"])
+        if with_dashboard and groupids:
+            ensure_dashboard(auth, groupids[0], dash_items, server_items=ensure_server_items(auth))
+    return {"hostid": hostid, "items": len(dash_items)}
+
+
+def _split_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in str(value).split(";") if v.strip()]
+
+
+def load_inventory(path):
+    """
+    Инвентарь парка хостов: CSV (host,ip,port,groups,templates,proxy; списки через «;»), JSON или YAML
+    (список объектов с теми же полями или {"hosts": [...]}). Пустые поля берутся из переменных окружения.
+    Имена хостов не повторяются: иначе параллельная настройка создавала бы или меняла один хост дважды.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8") as f:
+        if ext == ".csv":
+            rows = list(csv.DictReader(f))
+        elif ext in (".yml", ".yaml"):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("Для инвентаря YAML нужен PyYAML (pip install pyyaml) или используйте CSV/JSON.")
+            rows = yaml.safe_load(f)
+        else:
+            rows = json.load(f)
+    if isinstance(rows, dict):
+        rows = rows.get("hosts", [])
+    hosts = []
+    seen = {}
+    for i, row in enumerate(rows or [], 1):
+        name = (row.get("host") or "").strip()
+        if not name:
+            raise RuntimeError("Инвентарь %s, запись %d: не задано поле host." % (path, i))
+        if name in seen:
+            raise RuntimeError("Инвентарь %s, запись %d: хост «%s» уже задан в записи %d." % (path, i, name, seen[name]))
+        seen[name] = i
+        hosts.append({
+            "host": name,
+            "ip": (row.get("ip") or ZABBIX_AGENT_IP).strip(),
+            "port": str(row.get("port") or ZABBIX_AGENT_PORT).strip(),
+            "groups": _split_list(row.get("groups")) or [ZABBIX_HOST_GROUP],
+            "templates": _split_list(row.get("templates")) or [ZABBIX_TEMPLATE_LINUX, ZABBIX_TEMPLATE_DOCKER],
+            "proxy": (row.get("proxy") or "").strip(),
+        })
+    return hosts
+
+
+def default_host_spec():
+    """Хост из переменных окружения (режим одного хоста) в формате записи инвентаря."""
+    return {
+        "host": ZBX_HOSTNAME,
+        "ip": ZABBIX_AGENT_IP,
+        "port": str(ZABBIX_AGENT_PORT),
+        "groups": [ZABBIX_HOST_GROUP],
+        "templates": [ZABBIX_TEMPLATE_LINUX, ZABBIX_TEMPLATE_DOCKER],
+        "proxy": "",
+    }
+
+
+def resolve_shared(auth, hosts):
+    """Группы, шаблоны и прокси всего парка ищутся (группы и прокси создаются) один раз, до запуска потоков."""
+    group_names = []
+    template_names = []
+    for h in hosts:
+        group_names.extend(g for g in h["groups"] if g not in group_names)
+        template_names.extend(t for t in h["templates"] if t not in template_names)
+    groups = {name: ensure_group(auth, name) for name in group_names}
+    templates = find_templates(auth, template_names) if template_names else {}
+    return {"groups": groups, "templates": templates, "proxies": resolve_proxies(auth, hosts)}
+
+
+def provision_fleet(auth, hosts, concurrency):
+    shared = resolve_shared(auth, hosts)
+    results = {}
+    print("Настройка %d хостов, параллельно до %d..." % (len(hosts), concurrency))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(provision_host, auth, h, shared, h["host"] == ZBX_HOSTNAME): h["host"]
+            for h in hosts
+        }
+        for fut in as_completed(futures):
+            name = futures[fut]
+            try:
+                results[name] = (True, fut.result())
+            except Exception as e:
+                results[name] = (False, str(e))
+                print("Хост '%s': ошибка: %s" % (name, e), file=sys.stderr)
+    failed = [name for name, (ok, _) in results.items() if not ok]
+    print("")
+    print("Итог: настроено %d из %d хостов." % (len(hosts) - len(failed), len(hosts)))
+    for h in hosts:
+        ok, res = results[h["host"]]
+        if ok:
+            print("  [ok]     %-32s hostid=%s, элементов: %s" % (h["host"], res["hostid"], res["items"]))
+        else:
+            print("  [ошибка] %-32s %s" % (h["host"], res))
+    return failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Настройка Zabbix через API для мониторинга Visiology.")
+    parser.add_argument(
+        "--inventory",
+        default=env("ZABBIX_INVENTORY"),
+        help="файл инвентаря парка хостов (CSV/JSON/YAML); без него настраивается один хост ZBX_HOSTNAME",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(env("ZABBIX_FLEET_CONCURRENCY", "8")),
+        help="число хостов, настраиваемых параллельно (по умолчанию 8)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PHASE_WORKERS,
+        help="число потоков для независимых шагов настройки одного хоста (по умолчанию %d)" % PHASE_WORKERS,
+    )
+    parser.add_argument(
+        "--bundle",
+        action="store_true",
+        default=env("ZABBIX_BUNDLE", "0") == "1",
+        help="применить шаблон «%s» одним configuration.import и привязать его к хостам" % BUNDLE_TEMPLATE,
+    )
+    parser.add_argument(
+        "--storage-report",
+        action="store_true",
+        help="только вывести оценку суточного объёма истории по элементам и выйти, без обращения к API",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=env("ZABBIX_PROFILE", "0") == "1",
+        help="в конце вывести профиль: вызовы API по методам (время, p50/p95, байты, повторы) и самые долгие шаги",
+    )
+    parser.add_argument(
+        "--profile-output",
+        metavar="FILE",
+        default=env("ZABBIX_PROFILE_OUTPUT"),
+        help="записать профиль в FILE: .prom — textfile Prometheus, иначе JSON в формате Chrome trace",
+    )
+    parser.add_argument(
+        "--export-bundle",
+        metavar="FILE",
+        help="только записать пакет шаблона в FILE (.json или .yaml) и выйти, без обращения к API",
+    )
+    return parser.parse_args(argv)
+
+
+def provision(args, hosts):
+    print_storage_report(len(hosts))
+    if not args.bundle and not args.inventory:
+        tasks = host_tasks()
+        _, timings = run_task_graph(tasks, args.workers)
+        print("Готово. Проверьте хост, Latest data и дашборд «Главный экран» в веб-интерфейсе.")
+        print_timings(tasks, timings)
+        print_api_summary()
+        return
+
+    with phase("api"):
+        wait_for_api()
+    with phase("login"):
+        auth = login()
+    with phase("housekeeping"):
+        ensure_housekeeping(auth)
+
+    if AUTOREGISTRATION:
+        with phase("autoregistration"):
+            ensure_autoregistration(
+                auth, ensure_group(auth, ZABBIX_HOST_GROUP),
+                find_templates(auth, [ZABBIX_TEMPLATE_LINUX, ZABBIX_TEMPLATE_DOCKER]))
+
+    if args.bundle:
+        with phase("bundle"):
+            skipped = provision_bundle(auth, hosts, args.concurrency)
+        print("Готово. Дашборд «Главный экран» доступен на хостах с шаблоном «%s»." % BUNDLE_TEMPLATE)
+        print_api_summary()
+        if skipped:
+            print("Шаблон не привязан к %d хостам: %s" % (len(skipped), ", ".join(skipped)), file=sys.stderr)
+            sys.exit(1)
+        return
+
+    with phase("fleet"):
+        failed = provision_fleet(auth, hosts, args.concurrency)
+    print_api_summary()
+    if failed:
+        sys.exit(1)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.export_bundle:
+        write_bundle(args.export_bundle)
+        return
+    hosts = load_inventory(args.inventory) if args.inventory else [default_host_spec()]
+    if args.storage_report:
+        print_storage_report(len(hosts), detailed=True)
+        return
+    if not ZABBIX_URL:
+        print("Задайте ZABBIX_URL (и при необходимости другие переменные из zabbix-init-config.env).", file=sys.stderr)
+        sys.exit(1)
+    # Сроки хранения при TimescaleDB проверяются до первого обращения к API
+    housekeeping_settings()
+    # Профиль выводится и записывается и при ошибке настройки: медленный или упавший вызов в нём виден
+    try:
+        provision(args, hosts)
+    finally:
+        if args.profile:
+            print_profile()
+        if args.profile_output:
+            write_profile(args.profile_output)
 
 
 if __name__ == "__main__":
@@ -463,3 +2187,5 @@ if __name__ == "__main__":
     except RuntimeError as e:
         print("Ошибка: %s" % e, file=sys.stderr)
         sys.exit(1)
+    finally:
+        close_api()
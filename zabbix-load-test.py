@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный прогон: сколько хостов и значений в секунду выдерживает сервер Zabbix из docker-compose.yml.
+1. Через API (функции zabbix-init-config.py: группа, шаблоны, хост, элементы) создаются N синтетических хостов
+   с элементами-трапперами в отдельной группе.
+2. Значения отправляются по протоколу sender (ZabbixSender из docker-collector.py: пакеты, сжатие zlib)
+   ступенями rates значений/с, каждая ступень step_duration секунд, несколькими потоками.
+3. Во время ступени снимаются внутренние метрики сервера (элементы страницы «Нагрузка Zabbix»: заполнение кешей,
+   занятость процессов, очереди, обработано значений/с), а также задержка и отказы отправки.
+4. Ступень, на которой превышен любой порог, — точка деградации; последняя ступень без превышений — устойчивая.
+Прогон задаётся файлом конфигурации (JSON) с seed: конфигурация и профиль сервера (ZBX_* из .env) пишутся в отчёт,
+и прогоны до и после изменения профиля сравниваются через --baseline.
+Запуск:
+  python3 zabbix-load-test.py --config zabbix-load-test.json
+  python3 zabbix-load-test.py --config zabbix-load-test.json --baseline load-report-before.json
+  python3 zabbix-load-test.py cleanup --config zabbix-load-test.json     # удалить синтетические хосты
+"""
+from __future__ import print_function
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_script(name, filename):
+    """Соседние скрипты (с дефисом в имени) подключаются по пути — их функции используются как есть."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+init_config = _load_script("zabbix_init_config", "zabbix-init-config.py")
+collector = _load_script("docker_collector", "docker-collector.py")
+env = init_config.env
+
+REPORT_FILE = env("ZABBIX_LOAD_REPORT", "zabbix-load-report.json")
+# Внутренние элементы собираются раз в минуту, занятость процессов — среднее за последнюю минуту:
+# в оценку ступени идут значения, собранные не раньше чем через минуту после её начала
+METRIC_LAG = 60
+# Сколько ждать, пока новые элементы-трапперы попадут в кеш конфигурации сервера
+CONFIG_SYNC_TIMEOUT = 180
+SENDER_INFO_RE = re.compile(r"processed:\s*(\d+);\s*failed:\s*(\d+)")
+
+HISTORY_CACHE_KEY = "zabbix[wcache,history,pused]"
+DEFAULTS = {
+    "hosts": 50,
+    "items_per_host": 20,
+    "host_prefix": "loadgen",
+    "group": "Visiology load test",
+    # Шаблоны по имени (например, «Linux by Zabbix agent 2»): к нагрузке трапперов добавится опрос агентов
+    "templates": [],
+    "agent_ip": init_config.ZABBIX_AGENT_IP,
+    "agent_port": init_config.ZABBIX_AGENT_PORT,
+    "concurrency": 8,
+    "server": collector.ZABBIX_SERVER,
+    "rates": [500, 1000, 2000, 4000, 8000, 16000],
+    "step_duration": 180,
+    "batch_size": 1000,
+    "senders": 4,
+    "compress": True,
+    "sample_interval": 15,
+    "seed": 1,
+    "stop_on_degradation": True,
+    # Пороги по ключам внутренних элементов (значение за ступень — максимум)
+    "thresholds": {
+        HISTORY_CACHE_KEY: 75,
+        "zabbix[wcache,index,pused]": 75,
+        "zabbix[wcache,trend,pused]": 75,
+        "zabbix[vcache,buffer,pused]": 90,
+        "zabbix[process,history syncer,avg,busy]": 75,
+        "zabbix[process,trapper,avg,busy]": 75,
+        "zabbix[process,preprocessing worker,avg,busy]": 75,
+        "zabbix[preprocessing_queue]": 10000,
+        "zabbix[queue,10m]": 0,
+    },
+    # Доля от целевой скорости: отправлено генератором и обработано сервером (прирост zabbix[wcache,values])
+    "min_send_ratio": 0.95,
+    "min_processed_ratio": 0.9,
+    # Допустимая доля значений, отклонённых сервером (failed в ответе trapper)
+    "max_failed_ratio": 0.01,
+}
+
+
+def load_config(path=None, overrides=None):
+    cfg = json.loads(json.dumps(DEFAULTS))
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            user = json.load(f)
+        unknown = sorted(set(user) - set(DEFAULTS))
+        if unknown:
+            raise RuntimeError("Неизвестные параметры в %s: %s" % (path, ", ".join(unknown)))
+        cfg["thresholds"].update(user.pop("thresholds", {}))
+        cfg.update(user)
+    cfg.update({k: v for k, v in (overrides or {}).items() if v is not None})
+    if cfg["step_duration"] < METRIC_LAG + cfg["sample_interval"]:
+        print("Внимание: step_duration меньше %d с — метрики сервера ступени могут не успеть обновиться." % (
+            METRIC_LAG + cfg["sample_interval"]), file=sys.stderr)
+    return cfg
+
+
+def config_digest(cfg):
+    return hashlib.sha256(json.dumps(cfg, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def server_profile(env_file):
+    """Параметры сервера из .env установки (ZBX_*), чтобы в отчёте было видно, с каким профилем шёл прогон."""
+    profile = {}
+    try:
+        with open(env_file, "r", encoding="utf-8") as f:
+            for line in f:
+                key, sep, value = line.strip().partition("=")
+                if sep and key.startswith("ZBX_"):
+                    profile[key] = value
+    except OSError:
+        pass
+    return profile
+
+
+def host_names(cfg):
+    return ["%s-%04d" % (cfg["host_prefix"], i) for i in range(cfg["hosts"])]
+
+
+def trapper_items(count):
+    return [
+        init_config.with_retention({
+            "name": "Load test: value %d" % i, "key_": "loadgen.value[%d]" % i, "type": 2, "value_type": 0,
+            "delay": "0", "units": "",
+        })
+        for i in range(count)
+    ]
+
+
+def create_hosts(auth, cfg, verbose=False):
+    """Группа, шаблоны и хосты с трапперами через функции zabbix-init-config.py. Возвращает пары (хост, ключ)."""
+    groupid = init_config.ensure_group(auth, cfg["group"])
+    template_ids = list(init_config.find_templates(auth, cfg["templates"]).values()) if cfg["templates"] else []
+    specs = trapper_items(cfg["items_per_host"])
+    names = host_names(cfg)
+    print("Хосты: %d × %d элементов-трапперов (группа «%s»), параллельно до %d..." % (
+        len(names), len(specs), cfg["group"], cfg["concurrency"]))
+
+    def provision(name):
+        hostid = init_config.ensure_host(auth, name, cfg["agent_ip"], cfg["agent_port"], [groupid], template_ids)
+        init_config.ensure_items(auth, hostid, specs)
+
+    start = time.time()
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    failed = []
+    with quiet, ThreadPoolExecutor(max_workers=max(1, cfg["concurrency"])) as pool:
+        futures = {pool.submit(provision, name): name for name in names}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except RuntimeError as e:
+                failed.append(futures[fut])
+                print("Хост '%s': ошибка: %s" % (futures[fut], e), file=sys.stderr)
+    if failed:
+        raise RuntimeError("не созданы хосты: %s" % ", ".join(sorted(failed)))
+    print("Хосты готовы за %.1f с." % (time.time() - start))
+    return [(name, spec["key_"]) for name in names for spec in specs]
+
+
+def parse_sender_info(info):
+    """«processed: 250; failed: 0; total: 250; seconds spent: 0.003» -> (processed, failed)."""
+    m = SENDER_INFO_RE.search(info or "")
+    return (int(m.group(1)), int(m.group(2))) if m else (0, 0)
+
+
+def wait_config_sync(cfg, pairs):
+    """Новые трапперы принимаются после обновления кеша конфигурации: по значению на каждый, пока failed > 0."""
+    sender = collector.ZabbixSender(cfg["server"], batch_size=cfg["batch_size"], compress=cfg["compress"])
+    deadline = time.time() + CONFIG_SYNC_TIMEOUT
+    while True:
+        clock = int(time.time())
+        values = [{"host": h, "key": k, "value": 0, "clock": clock, "ns": 0} for h, k in pairs]
+        failed = sum(parse_sender_info(info)[1] for info in sender.send(values))
+        if not failed:
+            print("Сервер принимает значения всех %d элементов." % len(pairs))
+            return
+        if time.time() > deadline:
+            raise RuntimeError("за %d с сервер так и не принял %d значений из %d (кеш конфигурации)." % (
+                CONFIG_SYNC_TIMEOUT, failed, len(pairs)))
+        print("Ожидание кеша конфигурации сервера: не принято %d из %d..." % (failed, len(pairs)))
+        time.sleep(5)
+
+
+class LoadGenerator(object):
+    """
+    rate значений/с потоками senders: пары (хост, ключ) поделены между потоками, пакеты уходят по расписанию.
+    Если отправка не успевает за расписанием, следующий пакет уходит сразу — фактическая скорость падает,
+    что и фиксируется (трапперы сервера не успевают принимать).
+    """
+
+    def __init__(self, cfg, pairs):
+        self.cfg = cfg
+        self.pairs = pairs
+
+    def run(self, rate, duration):
+        senders = max(1, min(self.cfg["senders"], len(self.pairs)))
+        batch = max(1, min(self.cfg["batch_size"], rate // senders))
+        start = time.time()
+        stats = [{"sent": 0, "processed": 0, "failed": 0, "errors": 0, "latencies": []} for _ in range(senders)]
+        threads = [
+            threading.Thread(target=self._worker, args=(i, senders, batch, batch * senders / float(rate),
+                                                        start, start + duration, stats[i]), daemon=True)
+            for i in range(senders)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = max(time.time() - start, duration)
+        latencies = sorted(x for s in stats for x in s["latencies"])
+        total = {key: sum(s[key] for s in stats) for key in ("sent", "processed", "failed", "errors")}
+        total.update({
+            "elapsed_s": round(elapsed, 1),
+            "send_rate": round(total["sent"] / elapsed, 1),
+            "batch_size": batch,
+            "latency_p50_ms": round(init_config._percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+            "latency_p95_ms": round(init_config._percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+            "last_error": next((s["last_error"] for s in stats if s.get("last_error")), None),
+        })
+        return total
+
+    def _worker(self, index, senders, batch_size, interval, start, deadline, stats):
+        pairs = self.pairs[index::senders]
+        rnd = random.Random("%s-%d" % (self.cfg["seed"], index))
+        sender = collector.ZabbixSender(self.cfg["server"], batch_size=batch_size, compress=self.cfg["compress"])
+        pos = ns = 0
+        for k in range(sys.maxsize):
+            due = start + k * interval
+            if due >= deadline:
+                return
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            clock = int(time.time())
+            values = []
+            for _ in range(batch_size):
+                host, key = pairs[pos]
+                pos = (pos + 1) % len(pairs)
+                # Уникальные clock+ns: у таблиц истории Zabbix 7 первичный ключ (itemid, clock, ns)
+                ns = (ns + 1) % 1000000000
+                values.append({"host": host, "key": key, "value": round(rnd.uniform(0, 100), 3), "clock": clock, "ns": ns})
+            t0 = time.perf_counter()
+            try:
+                processed, failed = parse_sender_info(sender.send(values)[0])
+                stats["processed"] += processed
+                stats["failed"] += failed
+            except (OSError, RuntimeError) as e:
+                stats["errors"] += 1
+                stats["last_error"] = str(e)
+            stats["latencies"].append(time.perf_counter() - t0)
+            stats["sent"] += len(values)
+
+
+class ServerSampler(object):
+    """Значения внутренних элементов сервера (lastvalue/lastclock) раз в interval секунд в отдельном потоке."""
+
+    def __init__(self, auth, items, interval):
+        self.auth = auth
+        self.keys = {str(itemid): key for key, itemid in items.items()}
+        self.interval = interval
+        self.samples = {}  # ключ -> {clock: значение}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        if not self.keys:
+            return {}
+        rows = init_config.api_request(
+            "item.get", {"itemids": list(self.keys), "output": ["itemid", "lastvalue", "lastclock"]}, self.auth)
+        latest = {}
+        for row in rows:
+            clock = int(row.get("lastclock") or 0)
+            if not clock:
+                continue
+            key = self.keys[row["itemid"]]
+            self.samples.setdefault(key, {})[clock] = float(row["lastvalue"])
+            latest[key] = float(row["lastvalue"])
+        return latest
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except RuntimeError as e:
+                print("Метрики сервера не получены: %s" % e, file=sys.stderr)
+
+    def start(self):
+        self.samples = {}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def step_values(self, since):
+        """{ключ: [значения, собранные после since]} за ступень."""
+        return {key: [v for clock, v in sorted(values.items()) if clock >= since] for key, values in self.samples.items()}
+
+
+def evaluate(cfg, rate, sent, values, idle_vps):
+    """Метрики ступени (максимум по замерам, для значений/с — среднее) и список превышенных порогов."""
+    metrics = {key: max(v) for key, v in values.items() if v}
+    vps = values.get(init_config.VALUES_PER_SECOND_KEY) or []
+    processed_rate = (sum(vps) / len(vps) - (idle_vps or 0)) if vps else None
+    violations = []
+    for key, limit in sorted(cfg["thresholds"].items()):
+        if metrics.get(key) is not None and metrics[key] > limit:
+            violations.append("%s = %g > %g" % (key, metrics[key], limit))
+    if sent["send_rate"] < rate * cfg["min_send_ratio"]:
+        violations.append("отправлено %.0f/с из %d/с (p95 пакета %s мс)" % (sent["send_rate"], rate, sent["latency_p95_ms"]))
+    accepted = sent["processed"] + sent["failed"]
+    if accepted and sent["failed"] > accepted * cfg["max_failed_ratio"]:
+        violations.append("отклонено сервером %d из %d" % (sent["failed"], accepted))
+    if sent["errors"]:
+        violations.append("ошибок отправки %d: %s" % (sent["errors"], sent["last_error"]))
+    if processed_rate is not None and processed_rate < rate * cfg["min_processed_ratio"]:
+        violations.append("сервер обработал %.0f/с из %d/с" % (processed_rate, rate))
+    return metrics, processed_rate, violations
+
+
+def _fmt(value, suffix=""):
+    return "—" if value is None else "%.0f%s" % (value, suffix)
+
+
+def print_step(step):
+    m = step["metrics"]
+    print("  %6d/с  отправлено %6.0f/с  обработано %6s/с  p95 %5s мс  кеш истории %4s  history syncer %4s  "
+          "trapper %4s  %s" % (
+              step["rate"], step["sender"]["send_rate"], _fmt(step["processed_rate"]),
+              _fmt(step["sender"]["latency_p95_ms"]), _fmt(m.get(HISTORY_CACHE_KEY), "%"),
+              _fmt(m.get("zabbix[process,history syncer,avg,busy]"), "%"),
+              _fmt(m.get("zabbix[process,trapper,avg,busy]"), "%"),
+              "ok" if not step["violations"] else "деградация: " + "; ".join(step["violations"])))
+
+
+def run(cfg, output, env_file, baseline=None, verbose=False):
+    init_config.wait_for_api()
+    auth = init_config.login()
+    pairs = create_hosts(auth, cfg, verbose)
+    with contextlib.redirect_stdout(io.StringIO()):
+        server_items = init_config.ensure_server_items(auth)
+    if not server_items:
+        print("Хост «%s» не найден: метрики сервера не снимаются, оценка только по отправке." %
+              init_config.SELF_MONITORING_HOST, file=sys.stderr)
+    wait_config_sync(cfg, pairs)
+    sampler = ServerSampler(auth, server_items, cfg["sample_interval"])
+    idle_vps = sampler.sample().get(init_config.VALUES_PER_SECOND_KEY)
+    generator = LoadGenerator(cfg, pairs)
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": cfg,
+        "config_digest": config_digest(cfg),
+        "server_profile": server_profile(env_file),
+        "idle_values_per_second": idle_vps,
+        "steps": [],
+    }
+    print("Ступени по %d с: %s значений/с (элементов %d, потоков %d)" % (
+        cfg["step_duration"], ", ".join(str(r) for r in cfg["rates"]), len(pairs), cfg["senders"]))
+    for rate in cfg["rates"]:
+        start = time.time()
+        sampler.start()
+        try:
+            sent = generator.run(rate, cfg["step_duration"])
+        finally:
+            sampler.stop()
+        values = sampler.step_values(start + METRIC_LAG)
+        metrics, processed_rate, violations = evaluate(cfg, rate, sent, values, idle_vps)
+        step = {"rate": rate, "sender": sent, "metrics": metrics, "processed_rate": processed_rate,
+                "violations": violations}
+        report["steps"].append(step)
+        print_step(step)
+        if violations and cfg["stop_on_degradation"]:
+            break
+    stable = [s["rate"] for s in report["steps"] if not s["violations"]]
+    degraded = next((s for s in report["steps"] if s["violations"]), None)
+    report["last_stable_rate"] = stable[-1] if stable else None
+    report["degradation"] = {"rate": degraded["rate"], "violations": degraded["violations"]} if degraded else None
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("")
+    if degraded:
+        print("Деградация на %d значений/с: %s" % (degraded["rate"], "; ".join(degraded["violations"])))
+    else:
+        print("Деградации на заданных ступенях нет — добавьте ступени выше %d значений/с." % cfg["rates"][-1])
+    print("Устойчиво: %s значений/с (%d хостов × %d элементов). Отчёт: %s" % (
+        _fmt(report["last_stable_rate"]), cfg["hosts"], cfg["items_per_host"], output))
+    if baseline:
+        compare(report, baseline)
+    return report
+
+
+def compare(report, path):
+    """Сравнение с прошлым отчётом: устойчивая скорость и метрики на общих ступенях."""
+    with open(path, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    print("")
+    print("Сравнение с %s:" % path)
+    if base.get("config_digest") != report["config_digest"]:
+        print("  Внимание: конфигурация прогона отличается (%s -> %s)." % (base.get("config_digest"), report["config_digest"]))
+    changed = {k: (base.get("server_profile", {}).get(k), v) for k, v in report["server_profile"].items()
+               if base.get("server_profile", {}).get(k) != v}
+    for key, (old, new) in sorted(changed.items()):
+        print("  %s: %s -> %s" % (key, old, new))
+    print("  устойчиво: %s -> %s значений/с" % (_fmt(base.get("last_stable_rate")), _fmt(report["last_stable_rate"])))
+    old_steps = {s["rate"]: s for s in base.get("steps", [])}
+    for step in report["steps"]:
+        old = old_steps.get(step["rate"])
+        if old:
+            print("  %6d/с  кеш истории %s -> %s, history syncer %s -> %s, p95 отправки %s -> %s мс" % (
+                step["rate"],
+                _fmt(old["metrics"].get(HISTORY_CACHE_KEY), "%"), _fmt(step["metrics"].get(HISTORY_CACHE_KEY), "%"),
+                _fmt(old["metrics"].get("zabbix[process,history syncer,avg,busy]"), "%"),
+                _fmt(step["metrics"].get("zabbix[process,history syncer,avg,busy]"), "%"),
+                _fmt(old["sender"]["latency_p95_ms"]), _fmt(step["sender"]["latency_p95_ms"])))
+
+
+def cleanup(cfg):
+    """Удаляет синтетические хосты (<host_prefix>-NNNN в группе group); сама группа остаётся."""
+    init_config.wait_for_api()
+    auth = init_config.login()
+    groups = init_config.api_request("hostgroup.get", {"filter": {"name": cfg["group"]}, "output": ["groupid"]}, auth)
+    if not groups:
+        print("Группы «%s» нет — удалять нечего." % cfg["group"])
+        return
+    hosts = init_config.api_request(
+        "host.get", {"groupids": groups[0]["groupid"], "output": ["hostid", "host"]}, auth)
+    pattern = re.compile(r"^%s-\d+$" % re.escape(cfg["host_prefix"]))
+    hostids = [h["hostid"] for h in hosts if pattern.match(h["host"])]
+    for i in range(0, len(hostids), 500):
+        init_config.api_request("host.delete", hostids[i:i + 500], auth)
+    print("Удалено хостов: %d (группа «%s»)." % (len(hostids), cfg["group"]))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон сервера Zabbix: хосты через API, значения через sender.")
+    parser.add_argument("command", nargs="?", default="run", choices=("run", "cleanup"),
+                        help="run — прогон (по умолчанию), cleanup — удалить синтетические хосты")
+    parser.add_argument("--config", default=env("ZABBIX_LOAD_CONFIG"), help="файл конфигурации прогона (JSON)")
+    parser.add_argument("--output", default=REPORT_FILE, help="отчёт JSON (по умолчанию %(default)s)")
+    parser.add_argument("--baseline", help="прошлый отчёт для сравнения")
+    parser.add_argument("--env-file", default=os.path.join(SCRIPT_DIR, ".env"),
+                        help="файл .env установки: параметры ZBX_* сервера попадают в отчёт")
+    parser.add_argument("--hosts", type=int, help="число хостов (вместо значения из конфигурации)")
+    parser.add_argument("--items-per-host", type=int, help="элементов-трапперов на хост")
+    parser.add_argument("--rates", help="ступени значений/с через запятую, например 1000,2000,4000")
+    parser.add_argument("--step-duration", type=int, help="длительность ступени, сек")
+    parser.add_argument("--verbose", action="store_true", help="выводить сообщения создания хостов и элементов")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cfg = load_config(args.config, {
+        "hosts": args.hosts,
+        "items_per_host": args.items_per_host,
+        "rates": [int(r) for r in args.rates.split(",")] if args.rates else None,
+        "step_duration": args.step_duration,
+    })
+    if not init_config.ZABBIX_URL:
+        print("Задайте ZABBIX_URL (и при необходимости другие переменные из zabbix-init-config.env).", file=sys.stderr)
+        sys.exit(1)
+    if args.command == "cleanup":
+        cleanup(cfg)
+        return
+    try:
+        report = run(cfg, args.output, args.env_file, args.baseline, args.verbose)
+    except KeyboardInterrupt:
+        print("\nПрервано.", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        init_config.close_api()
+    sys.exit(0 if report["steps"] else 1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (RuntimeError, OSError) as e:
+        print("Ошибка: %s" % e, file=sys.stderr)
+        sys.exit(1)